@@ -6,7 +6,7 @@ import tests
 
 from copy import copy
 from zim.base import LastDefinedOrderedDict, MovingWindowIter
-from zim.base.naturalsort import natural_sort, natural_sorted
+from zim.base.naturalsort import natural_sort, natural_sorted, natural_sort_key
 
 class TestNaturalSorting(tests.TestCase):
 
@@ -38,6 +38,18 @@ class TestNaturalSorting(tests.TestCase):
 		self.assertTrue(id(result) != id(input))
 
 
+class TestNaturalSortKey(tests.TestCase):
+
+	def runTest(self):
+		for string in ('foo10bar', '\u65e5\u672c 2', 'caf\xe9'):
+			key = natural_sort_key(string)
+			self.assertEqual(key, natural_sort_key.__wrapped__(string))
+			self.assertIs(natural_sort_key(string), key)
+
+		natural_sort_key.cache_clear()
+		self.assertEqual(natural_sort_key.cache_info().currsize, 0)
+
+
 class TestLastDefinedOrderedDict(tests.TestCase):
 
 	def runTest(self):
@@ -188,6 +188,14 @@ class TestParseTree(tests.TestCase):
 		text = tree.tostring()
 		self.assertEqual(text, self.xml)
 
+	def testGetSearchText(self):
+		'''Test ParseTree.get_search_text() gives same counts as countre()'''
+		tree = get_format('wiki').Parser().parse('Foo **bar** baz\nfoo bar [[link|foo]]bar\n')
+		text = tree.get_search_text()
+		for regex in (r'\bfoo\b', r'\bfoo\ bar\b', r'\bbar\b', r'\b\S*ba\S*\b'):
+			regex = re.compile(regex, re.I)
+			self.assertEqual(len(regex.findall(text)), tree.countre(regex), regex.pattern)
+
 	def testcleanup_headings(self):
 		'''Test ParseTree.cleanup_headings()'''
 		tree = ParseTree().fromstring(self.xml)
@@ -13,7 +13,7 @@ from zim.notebook.layout import FilesLayout
 from zim.notebook import Path
 from zim.notebook.page import HRef
 from zim.notebook.index import Index, DB_VERSION
-from zim.notebook.index.files import FilesIndexer, TestFilesDBTable, FilesIndexChecker, TYPE_FOLDER
+from zim.notebook.index.files import FilesIndexer, TestFilesDBTable, FilesIndexChecker, TYPE_FOLDER, TYPE_FILE
 from zim.notebook.index.pages import PagesIndexer, TestPagesDBTable, PagesViewInternal
 from zim.notebook.index.links import LinksIndexer
 from zim.notebook.index.tags import TagsIndexer
@@ -86,6 +86,109 @@ class TestIndexInitialization(tests.TestCase):
 		self.assertEqual(index.get_property('db_version'), DB_VERSION)
 
 
+class TestIndexReadConnections(tests.TestCase):
+
+	def runTest(self):
+		from zim.notebook.index.base import ReadConnectionPool
+		from zim.notebook.index.pages import PagesView
+
+		folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		folder.file('foo.txt').write('Content-Type: text/x-zim-wiki\n\ntest 123\n')
+		index = Index(folder.file('.zim/index.db').path, FilesLayout(folder))
+		self.assertIsInstance(index._db_readers, ReadConnectionPool)
+		self.addCleanup(index._db_readers.close)
+
+		pages = PagesView.new_from_index(index)
+		index.update()
+		self.assertEqual(pages.n_all_pages(), 1)
+
+		# Views do not see changes before they are committed
+		index._db.execute('DELETE FROM pages WHERE name = "foo"')
+		self.assertEqual(pages.n_all_pages(), 1)
+		index._db.commit()
+		self.assertEqual(pages.n_all_pages(), 0)
+
+		# Readers are read-only
+		self.assertRaises(sqlite3.OperationalError,
+			index._db_readers.execute, 'DELETE FROM pages')
+
+		# In-memory index has no separate readers
+		index = Index(':memory:', FilesLayout(folder))
+		self.assertIs(index._db_readers, index._db)
+
+
+class TestIndexGeneration(tests.TestCase):
+
+	def runTest(self):
+		folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		file = folder.file('foo.txt')
+		file.write('Content-Type: text/x-zim-wiki\n\ntest 123\n')
+		dbpath = folder.file('.zim/index.db').path
+		index = Index(dbpath, FilesLayout(folder))
+		other = Index(dbpath, FilesLayout(folder)) # e.g. another process
+
+		generation = index.get_generation()
+		index.check_and_update()
+		self.assertEqual(index.get_generation(), generation + 1)
+
+		# Commits without changes in rows keep the generation
+		index.check_and_update()
+		index.touch_current_page_placeholder(Path('foo'))
+		self.assertEqual(index.get_generation(), generation + 1)
+
+		file.write('Content-Type: text/x-zim-wiki\n\ntest 123\nchanged\n')
+		index.update_file(file)
+		self.assertEqual(index.get_generation(), generation + 2)
+
+		# Other objects see the change
+		signals = tests.SignalLogger(other)
+		self.assertEqual(other.get_generation(), generation + 2)
+		self.assertTrue(other.check_generation())
+		self.assertFalse(other.check_generation())
+		self.assertEqual(len(signals['changed']), 1)
+
+		# Generation does not restart when the index is rebuild
+		index.flush()
+		self.assertEqual(index.get_generation(), generation + 3)
+
+
+class TestIndexDBProfile(tests.TestCase):
+
+	def runTest(self):
+		from zim.notebook.index import DB_PROFILES
+
+		folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		folder.file('foo.txt').write('Content-Type: text/x-zim-wiki\n\ntest 123\n')
+		index = Index(folder.file('.zim/index.db').path, FilesLayout(folder))
+		self.addCleanup(index._db_readers.close)
+
+		def pragma(db, key):
+			return db.execute('PRAGMA %s;' % key).fetchone()[0]
+
+		# Small notebook gets small profile, also for the readers
+		cache_size = -DB_PROFILES['small'][0] * 1024
+		self.assertEqual(pragma(index._db, 'cache_size'), cache_size)
+		self.assertEqual(pragma(index._db_readers, 'cache_size'), cache_size)
+
+		index.set_db_profile('large', cache_size=10)
+		self.assertEqual(pragma(index._db, 'cache_size'), -10 * 1024)
+		self.assertEqual(pragma(index._db_readers, 'cache_size'), -10 * 1024)
+		self.assertEqual(pragma(index._db, 'mmap_size'), DB_PROFILES['large'][1] * 1024 * 1024)
+		self.assertRaises(ValueError, index.set_db_profile, 'foo')
+
+		# Unused space is reclaimed
+		self.assertEqual(pragma(index._db, 'auto_vacuum'), 2) # INCREMENTAL
+		index._db.execute('CREATE TABLE junk (data BLOB)')
+		index._db.executemany('INSERT INTO junk VALUES (?)', [(b'x' * 10000,)] * 500)
+		index._db.commit()
+		index._db.execute('DROP TABLE junk')
+		self.assertGreater(pragma(index._db, 'freelist_count'), 0)
+		index.optimize()
+		self.assertEqual(pragma(index._db, 'freelist_count'), 0)
+
+		index.close()
+
+
 class TestFilesIndexer(tests.TestCase, TestFilesDBTable):
 
 	FILES = tuple(map(os_native_path, (
@@ -123,6 +226,7 @@ class TestFilesIndexer(tests.TestCase, TestFilesDBTable):
 		'foo.txt',
 	)
 	PAGE_TEXT = 'Content-Type: text/x-zim-wiki\n\ntest 123\n'
+	BATCH_ARGS = {}
 
 	def runTest(self):
 		# Test in 3 parts:
@@ -134,7 +238,7 @@ class TestFilesIndexer(tests.TestCase, TestFilesDBTable):
 		self.db = sqlite3.connect(':memory:')
 		self.db.row_factory = sqlite3.Row
 
-		indexer = FilesIndexer(self.db, self.root)
+		indexer = FilesIndexer(self.db, self.root, **self.BATCH_ARGS)
 
 		def cb_filter_func(name, o, a):
 			#~ print('>>', name)
@@ -149,7 +253,7 @@ class TestFilesIndexer(tests.TestCase, TestFilesDBTable):
 		signals = tests.SignalLogger(indexer, cb_filter_func)
 
 		def check_and_update_all():
-			checker = FilesIndexChecker(indexer.db, indexer.folder)
+			checker = FilesIndexChecker(indexer.db, indexer.folder, **self.BATCH_ARGS)
 			checker.queue_check()
 			for out_of_date in checker.check_iter():
 				if out_of_date:
@@ -173,9 +277,9 @@ class TestFilesIndexer(tests.TestCase, TestFilesDBTable):
 
 		# 2. Check and update after new files appear
 		signals.clear()
-		self.create_files(
-			self.FILES_UPDATE + self.FILES_CHANGE
-		)
+		self.create_files(self.FILES_UPDATE)
+		for name in self.FILES_CHANGE:
+			self.root.file(name).write(self.PAGE_TEXT + 'changed\n')
 		check_and_update_all()
 
 		files = set(f for f in self.FILES_UPDATE if not is_dir(f))
@@ -243,6 +347,77 @@ class TestFilesIndexerRobustForFolderMtime(TestFilesIndexer):
 		assert count > 0
 
 
+class TestFilesIndexerSmallBatches(TestFilesIndexer):
+	# Like TestFilesIndexer but with batches smaller than the number of
+	# rows, to test re-fetching and commits within a single update
+
+	BATCH_ARGS = {'batch_size': 2, 'commit_rows': 3, 'commit_interval': 1000}
+
+
+class TestPagesIndexerUnchangedContent(tests.TestCase):
+
+	def runTest(self):
+		folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		for name in ('foo.txt', 'bar.txt'):
+			folder.file(name).write('Content-Type: text/x-zim-wiki\n\ntest 123\n')
+		folder.file('foo/attachment.png').write('test 123\n')
+
+		db = sqlite3.connect(':memory:')
+		db.row_factory = sqlite3.Row
+		indexer = FilesIndexer(db, folder)
+		pages = PagesIndexer(db, FilesLayout(folder), indexer)
+
+		def check_and_update_all():
+			checker = FilesIndexChecker(indexer.db, indexer.folder)
+			checker.queue_check()
+			for out_of_date in checker.check_iter():
+				if out_of_date:
+					for i in indexer.update_iter():
+						pass
+
+		check_and_update_all()
+		digests = dict(db.execute('SELECT path, digest FROM files WHERE node_type = ?', (TYPE_FILE,)))
+		self.assertIsNotNone(digests['foo.txt'])
+		self.assertIsNone(digests['foo/attachment.png']) # only page sources
+
+		signals = tests.SignalLogger(pages, lambda name, o, a: a[0]['name'])
+
+		# Only mtime changed
+		for name in ('foo.txt', 'bar.txt'):
+			file = folder.file(name)
+			os.utime(file.path, (file.mtime() + 10, file.mtime() + 10))
+		folder.file('bar.txt').write('Content-Type: text/x-zim-wiki\n\ntest 456\n')
+		check_and_update_all()
+
+		self.assertEqual(signals['page-changed'], ['bar'])
+		self.assertEqual(pages.n_unchanged, 1)
+		mtime, = db.execute('SELECT mtime FROM files WHERE path = "foo.txt"').fetchone()
+		self.assertEqual(mtime, folder.file('foo.txt').mtime())
+		digest, = db.execute('SELECT digest FROM files WHERE path = "bar.txt"').fetchone()
+		self.assertNotEqual(digest, digests['bar.txt'])
+
+
+class TestFilesIndexerKeepsFlaggedChildren(tests.TestCase):
+
+	def runTest(self):
+		# Children that are flagged for update when their parent folder is
+		# checked should be updated, not dropped as if they were deleted
+		folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		layout = FilesLayout(folder)
+		for name in ('Foo', 'Foo:Child', 'Bar'):
+			file, x = layout.map_page(Path(name))
+			file.write('Content-Type: text/x-zim-wiki\n\ntest 123\n')
+
+		index = Index(':memory:', layout)
+		index.check_and_update()
+		pages = sorted(r[0] for r in index._db.execute('SELECT name FROM pages'))
+		self.assertEqual(pages, ['', 'Bar', 'Foo', 'Foo:Child'])
+
+		index.flag_reindex() # also flags the root folder, the source of the root page
+		index.check_and_update()
+		self.assertEqual(sorted(r[0] for r in index._db.execute('SELECT name FROM pages')), pages)
+
+
 class TestFilesIndexerWithCaseInsensitiveFilesytem(tests.TestCase, TestFilesDBTable):
 
 	def runTest(self):
@@ -341,6 +516,7 @@ class TestPagesIndexer(TestPagesDBTable, tests.TestCase):
 		db = sqlite3.connect(':memory:')
 		db.row_factory = sqlite3.Row
 
+		FilesIndexer(db, self.root) # create "files" table, used for digests
 		file_indexer = tests.MockObject(methods=('connect',))
 
 		indexer = PagesIndexer(db, layout, file_indexer)
@@ -378,7 +554,7 @@ class TestPagesIndexer(TestPagesDBTable, tests.TestCase):
 		# 2. update files
 		signals.clear()
 		for i, path in enumerate(self.FILES):
-			row = {'id': i, 'path': path}
+			row = {'id': i, 'path': path, 'digest': None}
 			indexer.on_file_row_changed(file_indexer, row)
 			self.assertPagesDBConsistent(db)
 
@@ -501,7 +677,7 @@ class TestLinksIndexer(tests.TestCase):
 		###
 		pageindexer.setObjectAccess('remove_page')
 		for i, name, cont in self.PAGES:
-			row = {'id': i, 'name': name, 'is_link_placeholder': False}
+			row = {'id': i, 'name': name, 'sortkey': natural_sort_key(name), 'is_link_placeholder': False}
 			indexer.on_page_row_deleted(pageindexer, row)
 
 		indexer.update()
@@ -510,6 +686,49 @@ class TestLinksIndexer(tests.TestCase):
 		self.assertEqual(rows, [])
 
 
+class TestLinksIndexerRecheck(tests.TestCase):
+
+	def runTest(self):
+		folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		for name, text in (
+			('Foo', '[[Dus]]\n[[:Baz]]\n[[+Sub]]\n'),
+			('Foo:Sub', 'test 123\n'),
+			('Other:Page', '[[Dus]]\n[[:Foo:Sub]]\n'),
+		):
+			folder.file(name.replace(':', '/') + '.txt').write(
+				'Content-Type: text/x-zim-wiki\n\n' + text)
+
+		update_iter = buildUpdateIter(folder)
+		update_iter.update()
+
+		def flagged():
+			return sorted(tuple(r) for r in update_iter.db.execute(
+				'SELECT s.name, links.names FROM links '
+				'JOIN pages s ON links.source = s.id WHERE needscheck=1'))
+
+		# Only links that can see the new page are flagged
+		self.assertEqual(flagged(), [])
+		update_iter.pages.insert_page(Path('Foo:Dus'), None)
+		self.assertEqual(flagged(), [('Foo', 'Dus')])
+
+		# Absolute and relative links are resolved without "resolve_link()"
+		update_iter.db.execute('UPDATE links SET needscheck=1')
+		cache = update_iter.links.link_cache
+		cache.clear()
+		cache.hits = cache.misses = 0
+		for i in update_iter.links.update_iter():
+			pass
+		self.assertEqual(cache.hits + cache.misses, 2)
+
+		links = sorted(tuple(r) for r in update_iter.db.execute(
+			'SELECT s.name, t.name FROM links '
+			'JOIN pages s ON links.source = s.id JOIN pages t ON links.target = t.id'))
+		self.assertEqual(links, [
+			('Foo', 'Baz'), ('Foo', 'Dus'), ('Foo', 'Foo:Sub'),
+			('Other:Page', 'Foo:Sub'), ('Other:Page', 'Other:Dus'),
+		])
+
+
 class TestUnicodeRepresentationAlternatives(tests.TestCase):
 
 	# Write "Glück" as either
@@ -648,3 +867,385 @@ class TestFullIndexer(TestFilesIndexer):
 		# 3. Check and update after files disappear
 		self.remove_files(self.FILES_UPDATE)
 		update_iter.check_and_update()
+
+
+@tests.slowTest
+class TestParallelIndexer(tests.TestCase):
+
+	def runTest(self):
+		from zim.notebook.index.parallel import PARALLEL_MIN_FILES
+
+		folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		for i in range(PARALLEL_MIN_FILES + 10):
+			folder.file('page%i.txt' % i).write(
+				'Content-Type: text/x-zim-wiki\n\n'
+				'test %i\n[[page%i]]\n[[:foo:bar]]\n@tag%i\n' % (i, i + 1, i % 5)
+			)
+			if i % 10 == 0:
+				folder.file('page%i/child.txt' % i).write(
+					'Content-Type: text/x-zim-wiki\n\n[[page%i]]\n' % i
+				)
+
+		def dump(update_iter):
+			return dict(
+				(table, [tuple(r) for r in update_iter.db.execute('SELECT * FROM %s ORDER BY rowid' % table)])
+					for table in ('pages', 'links', 'tags', 'tagsources')
+			)
+
+		serial = buildUpdateIter(folder)
+		serial.update()
+
+		parallel = buildUpdateIter(folder)
+		parallel.jobs = 2
+		parallel.update()
+
+		self.assertEqual(dump(parallel), dump(serial))
+		self.assertTrue(len(dump(serial)['pages']) > PARALLEL_MIN_FILES)
+
+
+class TestParseFileJob(tests.TestCase):
+
+	def runTest(self):
+		from zim.notebook.index.parallel import _parse_file_job
+		folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		file = folder.file('page.txt')
+		file.write('Content-Type: text/x-zim-wiki\n\ntest 123\n')
+		etag, tree = _parse_file_job(file.path, 'zim.formats.wiki')
+		self.assertIsNotNone(etag)
+		self.assertEqual(tree.get_search_text(), 'test 123\n')
+
+		with tests.LoggingFilter('zim.notebook.index', 'Error while parsing'):
+			self.assertEqual(_parse_file_job(folder.file('none.txt').path, 'zim.formats.wiki'), (None, None))
+
+
+class TestIndexUpdateOperationJobs(tests.TestCase):
+
+	def runTest(self):
+		from zim.notebook.index import IndexUpdateOperation
+		notebook = self.setUpNotebook()
+		jobs = []
+		class MyOperation(IndexUpdateOperation):
+			def _get_iter(self, notebook, n):
+				jobs.append(n)
+				return iter([])
+
+		MyOperation(notebook) # GUI and background updates run serial
+		MyOperation(notebook, jobs=4)
+		notebook.index.set_jobs(2)
+		MyOperation(notebook)
+		self.assertEqual(jobs, [1, 4, 2])
+
+
+class TestBulkIndexer(tests.TestCase):
+
+	def runTest(self):
+		folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		for i in range(20):
+			folder.file('page%i.txt' % i).write(
+				'Content-Type: text/x-zim-wiki\n\n'
+				'test %i\n[[page%i]]\n[[page%i]]\n[[:foo:bar]]\n@tag%i\n' % (i, i + 1, i + 1, i % 5)
+			)
+
+		def dump(update_iter):
+			return {
+				'pages': sorted(tuple(r) for r in update_iter.db.execute(
+					'SELECT name, n_children, is_link_placeholder FROM pages')),
+				'links': sorted(tuple(r) for r in update_iter.db.execute(
+					'SELECT s.name, t.name, links.needscheck FROM links '
+					'JOIN pages s ON links.source = s.id JOIN pages t ON links.target = t.id')),
+				'tags': sorted(tuple(r) for r in update_iter.db.execute(
+					'SELECT pages.name, tags.name FROM tagsources '
+					'JOIN pages ON tagsources.source = pages.id JOIN tags ON tagsources.tag = tags.id')),
+				'text': sorted(tuple(r) for r in update_iter.db.execute(
+					'SELECT pages.name, pages_text.text FROM pages_text JOIN pages ON pages_text.id = pages.id')),
+			}
+
+		def indexes(update_iter):
+			return set(r[0] for r in update_iter.db.execute(
+				'SELECT name FROM sqlite_master WHERE type="index"'))
+
+		incremental = buildUpdateIter(folder)
+		incremental.is_empty = lambda: False
+		incremental.update()
+
+		bulk = buildUpdateIter(folder)
+		signals = []
+		for signal in ('start-bulk-update', 'commit', 'end-bulk-update'):
+			bulk.connect(signal, lambda o, s=signal: signals.append(s))
+		self.assertTrue(bulk.is_empty())
+		bulk.update()
+		self.assertFalse(bulk.is_empty())
+		self.assertEqual(signals, ['start-bulk-update', 'commit', 'end-bulk-update'])
+		bulk.update()
+		self.assertEqual(signals[3:], ['commit'])
+
+		self.assertEqual(dump(bulk), dump(incremental))
+		self.assertEqual(indexes(bulk), indexes(incremental))
+		self.assertIn('pages_name', indexes(bulk))
+
+
+class TestIndexProfiler(tests.TestCase):
+
+	def runTest(self):
+		from zim.notebook.index.profiler import IndexProfiler, ProfiledConnection
+
+		folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		for i in range(10):
+			folder.file('page%i.txt' % i).write(
+				'Content-Type: text/x-zim-wiki\n\ntest %i\n[[page%i]]\n@tag%i\n' % (i, i + 1, i % 3)
+			)
+
+		profiler = IndexProfiler()
+		db = ProfiledConnection(':memory:')
+		db.row_factory = sqlite3.Row
+		profiler.attach_connection(db)
+		update_iter = IndexUpdateIter(db, FilesLayout(folder), profiler)
+		update_iter.check_and_update()
+
+		self.assertEqual(profiler.n_pages, 10)
+		self.assertGreater(profiler.n_statements, 0)
+		report = profiler.report()
+		for name in (
+			'FilesIndexer.update_iter',
+			'PagesIndexer.on_file_row_changed',
+			'LinksIndexer.on_page_changed',
+			'TagsIndexer.on_page_changed',
+			'SELECT * FROM pages WHERE name=?',
+		):
+			self.assertIn(name, report)
+
+
+class TestLinkResolutionCache(tests.TestCase):
+
+	def runTest(self):
+		folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		def write(name, text):
+			folder.file(name.replace(':', '/') + '.txt').write(
+				'Content-Type: text/x-zim-wiki\n\n' + text)
+
+		for ns in ('A', 'B', 'B:C'):
+			for i in range(10):
+				write('%s:page%i' % (ns, i), '[[Target]]\n[[Other]]\n[[:Foo:Bar]]\n[[+Child]]\n[[page%i]]\n' % (i + 1))
+		write('Target', 'test 123\n')
+
+		def dump(update_iter):
+			return sorted(tuple(r) for r in update_iter.db.execute(
+				'SELECT s.name, t.name, links.needscheck FROM links '
+				'JOIN pages s ON links.source = s.id JOIN pages t ON links.target = t.id'))
+
+		cached = buildUpdateIter(folder)
+		uncached = buildUpdateIter(folder)
+		uncached.links._pages.link_cache = None
+		for update_iter in (cached, uncached):
+			update_iter.update()
+		self.assertEqual(dump(cached), dump(uncached))
+		self.assertGreater(cached.links.link_cache.hits, 0)
+
+		# Adding pages changes how existing links resolve
+		write('B:Other', 'test 123\n')
+		write('A:page3:Child', 'test 123\n')
+		write('B:C:page10', 'test 123\n')
+		for update_iter in (cached, uncached):
+			update_iter.check_and_update()
+		self.assertEqual(dump(cached), dump(uncached))
+		self.assertIn(('B:C:page1', 'B:Other', 0), dump(cached))
+		self.assertIn(('A:page3', 'A:page3:Child', 0), dump(cached))
+		self.assertIn(('B:C:page9', 'B:C:page10', 0), dump(cached))
+
+
+class TestPagesClosure(tests.TestCase):
+
+	def runTest(self):
+		from zim.notebook.index.files import STATUS_NEED_UPDATE
+		from zim.notebook.index.pages import PagesView
+
+		folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		layout = FilesLayout(folder)
+		for name in ('Foo', 'Foo:Child1', 'Foo:Child1:Grand', 'Foo:Child2', 'Bar'):
+			file, x = layout.map_page(Path(name))
+			file.write('Content-Type: text/x-zim-wiki\n\ntest 123\n')
+		index = Index(':memory:', layout)
+		index.update()
+
+		view = PagesView.new_from_index(index)
+		self.assertEqual(view.n_descendants(), 5)
+		self.assertEqual(view.n_descendants(Path('Foo')), 3)
+		self.assertEqual(view.n_descendants(Path('Bar')), 0)
+		self.assertEqual(
+			[p.name for p in view.list_descendants(Path('Foo'))],
+			['Foo:Child1', 'Foo:Child1:Grand', 'Foo:Child2']
+		)
+		self.assertEqual(
+			[p.name for p in view.list_descendants(Path('Foo'), depth=1)],
+			['Foo:Child1', 'Foo:Child2']
+		)
+		self.assertEqual(
+			sorted(p.name for p in view.list_descendants()),
+			sorted(p.name for p in view.walk())
+		)
+
+		index.flag_reindex(Path('Foo:Child1'))
+		flagged = [r[0] for r in index._db.execute(
+			'SELECT path FROM files WHERE index_status=? ORDER BY path',
+			(STATUS_NEED_UPDATE,)
+		)]
+		self.assertEqual(flagged, [
+			os_native_path('Foo/Child1.txt'),
+			os_native_path('Foo/Child1/Grand.txt')
+		])
+
+
+class TestMovePages(tests.TestCase):
+
+	PAGES = {
+		'Foo': '[[Bar]]\n@foo\n',
+		'Foo:Child1': '[[+Grand]]\n[[Child2]]\n@child\n',
+		'Foo:Child1:Grand': 'test 123\n',
+		'Foo:Child2': '[[:Foo:Child1]]\n',
+		'Bar': '[[Foo:Child1]]\n[[Baz]]\n',
+	}
+
+	def setUp(self):
+		self.folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		self.layout = FilesLayout(self.folder)
+		for name, text in self.PAGES.items():
+			file, folder = self.layout.map_page(Path(name))
+			file.write('Content-Type: text/x-zim-wiki\n\n' + text)
+		self.index = Index(':memory:', self.layout)
+		self.index.update()
+
+	def move(self, oldname, newname):
+		file, folder = self.layout.map_page(Path(oldname))
+		newfile, newfolder = self.layout.map_page(Path(newname))
+		folder.moveto(newfolder)
+		file.moveto(newfile)
+		self.index.files_moved([(folder, newfolder), (file, newfile)])
+
+	def dump(self, db):
+		return {
+			'pages': sorted(tuple(r) for r in db.execute(
+				'SELECT name, n_children, is_link_placeholder, sortkey FROM pages')),
+			'files': sorted(tuple(r) for r in db.execute(
+				'SELECT f.path, p.path FROM files f JOIN files p ON f.parent = p.id')),
+			'links': sorted(tuple(r) for r in db.execute(
+				'SELECT s.name, t.name, links.names FROM links '
+				'JOIN pages s ON links.source = s.id JOIN pages t ON links.target = t.id')),
+			'closure': sorted(tuple(r) for r in db.execute(
+				'SELECT a.name, d.name, depth FROM pages_closure '
+				'JOIN pages a ON ancestor = a.id JOIN pages d ON descendant = d.id')),
+			'tags': sorted(tuple(r) for r in db.execute(
+				'SELECT pages.name, tags.name FROM tagsources '
+				'JOIN pages ON tagsources.source = pages.id JOIN tags ON tagsources.tag = tags.id')),
+			'text': sorted(tuple(r) for r in db.execute(
+				'SELECT pages.name, pages_text.text FROM pages_text JOIN pages ON pages_text.id = pages.id')),
+		}
+
+	def ids(self):
+		return dict((r['name'], r['id']) for r in self.index._db.execute(
+			'SELECT id, name FROM pages WHERE source_file IS NOT NULL'))
+
+	def assertIndexMatchesNewIndex(self):
+		new = Index(':memory:', self.layout)
+		new.update()
+		self.assertEqual(self.dump(self.index._db), self.dump(new._db))
+
+	def testMovePage(self):
+		ids = self.ids()
+		self.move('Foo', 'Dus:Foo')
+
+		newids = self.ids()
+		self.assertEqual(newids['Dus:Foo:Child1'], ids['Foo:Child1'])
+		self.assertEqual(newids['Dus:Foo'], ids['Foo'])
+		self.assertIndexMatchesNewIndex()
+
+	def testMovePageReplacingPlaceholder(self):
+		ids = self.ids()
+		self.move('Foo', 'Baz')
+		self.assertEqual(self.ids()['Baz:Child2'], ids['Foo:Child2'])
+		self.assertIndexMatchesNewIndex()
+
+	def testFallbackMovePageIntoOwnNamespace(self):
+		file, folder = self.layout.map_page(Path('Bar'))
+		newfile, newfolder = self.layout.map_page(Path('Bar:Sub'))
+		file.moveto(newfile)
+		self.index.file_moved(file, newfile)
+		self.assertIndexMatchesNewIndex()
+
+
+class TestIndexVerify(tests.TestCase):
+
+	PAGES = {
+		'Foo': '[[Bar]]\n@foo\n',
+		'Foo:Child1': '[[+Grand]]\n[[Child2]]\n@child\n',
+		'Foo:Child1:Grand': 'test 123\n',
+		'Foo:Child2': '[[:Foo:Child1]]\n',
+		'Bar': '[[Foo:Child1]]\n[[Baz]]\n',
+		'Baz': 'test 123\n',
+	}
+
+	def setUp(self):
+		self.folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		self.layout = FilesLayout(self.folder)
+		for name, text in self.PAGES.items():
+			file, folder = self.layout.map_page(Path(name))
+			file.write('Content-Type: text/x-zim-wiki\n\n' + text)
+		self.index = Index(':memory:', self.layout)
+		self.index.update()
+
+	def dump(self, db):
+		return {
+			'pages': sorted(tuple(r) for r in db.execute(
+				'SELECT name, n_children, is_link_placeholder FROM pages')),
+			'closure': sorted(tuple(r) for r in db.execute(
+				'SELECT a.name, d.name, depth FROM pages_closure '
+				'JOIN pages a ON ancestor = a.id JOIN pages d ON descendant = d.id')),
+			'files': sorted(tuple(r) for r in db.execute(
+				'SELECT f.path, p.path FROM files f JOIN files p ON f.parent = p.id')),
+			'links': sorted(tuple(r) for r in db.execute(
+				'SELECT s.name, t.name FROM links '
+				'JOIN pages s ON links.source = s.id JOIN pages t ON links.target = t.id')),
+			'tags': sorted(tuple(r) for r in db.execute(
+				'SELECT pages.name, tags.name FROM tagsources '
+				'JOIN pages ON tagsources.source = pages.id JOIN tags ON tagsources.tag = tags.id')),
+			'text': sorted(tuple(r) for r in db.execute(
+				'SELECT pages.name, pages_text.text FROM pages_text JOIN pages ON pages_text.id = pages.id')),
+		}
+
+	def runTest(self):
+		self.assertEqual(self.index.verify(), [])
+
+		db = self.index._db
+		baz_id, = db.execute('SELECT id FROM pages WHERE name="Baz"').fetchone()
+		db.execute('UPDATE pages SET n_children=5 WHERE name="Foo"')
+		db.execute('DELETE FROM pages WHERE name="Foo:Child1"')
+		db.execute('UPDATE files SET parent=999 WHERE path="Bar.txt"')
+		db.execute('DELETE FROM pages_closure WHERE depth=1 AND descendant=(SELECT id FROM pages WHERE name="Foo:Child2")')
+		db.commit()
+
+		problems = self.index.verify()
+		self.assertEqual(
+			sorted(set((p.table, p.name) for p in problems)),
+			[
+				('files', 'Bar.txt'),
+				('links', ''), # links from Foo:Child1
+				('links', 'Bar'),
+				('links', 'Foo:Child2'),
+				('pages', 'Foo'),
+				('pages', 'Foo:Child1:Grand'),
+				('pages', 'Foo:Child2'),
+				('pages_closure', ''),
+				('pages_text', ''),
+				('tagsources', ''),
+			]
+		)
+
+		problems = self.index.verify(repair=True)
+		self.assertTrue(len(problems) > 0)
+		self.assertEqual(self.index.verify(), [])
+
+		new = Index(':memory:', self.layout)
+		new.update()
+		self.assertEqual(self.dump(self.index._db), self.dump(new._db))
+
+		# Pages outside the repaired sections keep their rows
+		self.assertEqual(db.execute('SELECT id FROM pages WHERE name="Baz"').fetchone()[0], baz_id)
@@ -7,6 +7,7 @@ import tests
 
 from gi.repository import Gtk
 
+import re
 import sqlite3
 
 from zim.notebook import Path, HRef
@@ -160,6 +161,22 @@ class TestPagesView(tests.TestCase):
 		for page in pages.walk(section):
 			self.assertTrue(page.ischild(section))
 
+	def testWalkFallback(self):
+		# Single query and recursive python implementations should agree
+		from zim.notebook.index.pages import ROOT_ID
+		db = new_test_database()
+		pages = PagesView(db)
+
+		for page_id in [ROOT_ID] + [p.id for p in pages.walk()]:
+			self.assertEqual(
+				[p.name for p in pages._pages.walk(page_id)],
+				[p.name for p in pages._pages._walk_recursive(page_id)]
+			)
+			self.assertEqual(
+				[p.name for p in pages._pages.walk_bottomup(page_id)],
+				[p.name for p in pages._pages._walk_bottomup_recursive(page_id)]
+			)
+
 	def testPreviousAndNext(self):
 		# Mix of caps and small letters to trigger issues with sorting
 		names = ('AAA', 'BBB', 'ccc', 'ddd', 'EEE', 'FFF', 'ggg', 'hhh')
@@ -303,6 +320,19 @@ class TestPagesView(tests.TestCase):
 		self.assertEqual([p.name for p in pages.match_all_pages_by_words(['and', 'ild'])],
 			['Foo:Child1:GrandChild1', 'Foo:Child1:GrandChild2'])
 
+	def testMatchNames(self):
+		db = new_test_database()
+		pages = PagesView(db)
+		self.assertEqual(sorted(p.name for p in pages.match_names(['xyz%'])), [])
+		self.assertEqual(sorted(p.name for p in pages.match_names(['foo:child1%'])),
+			['Foo:Child1', 'Foo:Child1:GrandChild1', 'Foo:Child1:GrandChild2'])
+		regex = re.compile(r'^Foo:Child1$', re.I)
+		self.assertEqual([p.name for p in pages.match_names(['foo:child1%'], regex)], ['Foo:Child1'])
+		self.assertEqual(
+			sorted(p.name for p in pages.match_names(['foo:child1%'], regex, inverse=True)),
+			sorted(p.name for p in pages.walk() if p.name != 'Foo:Child1')
+		)
+
 
 from zim.notebook.index.tags import TagsIndexer, TagsView, IndexTag, \
 		TaggedPagesTreeModelMixin, TagsTreeModelMixin
@@ -368,7 +398,7 @@ class TestTagsView(tests.TestCase):
 		db = new_test_database()
 		mockindex = tests.MockObject(methods=('connect',))
 		mockindex._db = db
-		mockindex.update_iter = tests.MockObject()
+		mockindex.update_iter = tests.MockObject(methods=('connect',))
 		mockindex.update_iter.pages = tests.MockObject(methods=('connect',))
 		mockindex.update_iter.tags = tests.MockObject(methods=('connect',))
 		model = TaggedPagesTreeModelMixin(mockindex, tags=('tag1', 'tag2'))
@@ -398,7 +428,7 @@ class TestTagsView(tests.TestCase):
 		db = new_test_database()
 		mockindex = tests.MockObject(methods=('connect',))
 		mockindex._db = db
-		mockindex.update_iter = tests.MockObject()
+		mockindex.update_iter = tests.MockObject(methods=('connect',))
 		mockindex.update_iter.pages = tests.MockObject(methods=('connect',))
 		mockindex.update_iter.tags = tests.MockObject(methods=('connect',))
 
@@ -465,6 +495,17 @@ class TestLinksView(tests.TestCase):
 				n_links = linksview.n_list_links_section(path)
 				self.assertEqual(n_links, len(mylinks))
 
+			page_id = linksview._pages.get_page_id(path)
+			for dir in (LINK_DIR_FORWARD, LINK_DIR_BACKWARD, LINK_DIR_BOTH):
+				self.assertEqual(
+					sorted((l.source.name, l.target.name) for l in linksview.list_links_section(path, dir)),
+					sorted((l.source.name, l.target.name) for l in linksview._list_links_section_recursive(page_id, path, dir))
+				)
+				self.assertEqual(
+					linksview.n_list_links_section(path, dir),
+					linksview._n_list_links_section_recursive(page_id, dir)
+				)
+
 		lclinks = [(l.source, l.target) for l in linksview.list_floating_links('foo')]
 		uclinks = [(l.source, l.target) for l in linksview.list_floating_links('FOO')]
 		self.assertGreater(len(lclinks), 0)
@@ -359,6 +359,7 @@ class TestFS(object):
 		self.assertRaises(FileNotFoundError, folder.list_names)
 		self.assertRaises(FileNotFoundError, folder.list_files)
 		self.assertRaises(FileNotFoundError, folder.list_folders)
+		self.assertRaises(FileNotFoundError, folder.stat_children)
 
 		# Test listing with only files
 		file1 = folder.file('foo.txt')
@@ -397,6 +398,16 @@ class TestFS(object):
 			child = folder.child(name)
 			self.assertIsInstance(child, wanted[name])
 
+		# Test stat_children()
+		folder.file('.hidden').touch()
+		self.assertEqual(
+			folder.stat_children(),
+			[(name, wanted[name] is Folder, folder.child(name).mtime()) for name in folder.list_names()]
+		)
+		self.assertEqual([s[0] for s in folder.stat_children(include_hidden=True)],
+			['.hidden', 'bar', 'bar.txt', 'foo', 'foo.txt'])
+		folder.file('.hidden').remove()
+
 		# Test new_file()
 		newfile1 = folder.new_file('foo.txt')
 		self.assertEqual(newfile1.dirname, folder.path)
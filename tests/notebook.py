@@ -20,6 +20,7 @@ from zim.formats.wiki import Parser as WikiParser
 from zim.notebook import *
 from zim.notebook.notebook import NotebookConfig, IndexNotUptodateError, PageExistsError
 from zim.notebook.index import Index
+from zim.notebook.operations import ongoing_operation
 from zim.notebook.layout import FilesLayout, FILE_TYPE_PAGE_SOURCE, FILE_TYPE_ATTACHMENT
 
 
@@ -1591,6 +1592,76 @@ class TestTrash(tests.TestCase):
 		self.assertFalse(page.exists())
 
 
+class TestParseTreeCache(tests.TestCase):
+
+	TEXT = 'Content-Type: text/x-zim-wiki\nWiki-Format: zim 0.6\n\n====== Foo ======\n**Bold** and [[Link]] @tag\n'
+
+	def testCache(self):
+		from zim.notebook.parsecache import ParseTreeCache
+		import zim.formats.wiki as format
+
+		folder = self.setUpFolder(mock=tests.MOCK_ALWAYS_REAL)
+		file = folder.file('Foo.txt')
+		file.write(self.TEXT)
+		dbpath = folder.file('cache.db').path
+
+		cache = ParseTreeCache(dbpath)
+		tree, etag = cache.get_parsetree(file, format)
+		self.assertEqual((cache.hits, cache.misses), (0, 1))
+		self.assertEqual(tree.tostring(), format.Parser().parse(self.TEXT, file_input=True).tostring())
+		self.assertEqual(etag, file.read_with_etag()[1])
+		cache.close()
+
+		# New object for same db, content from cache
+		cache = ParseTreeCache(dbpath)
+		mytree, myetag = cache.get_parsetree(file, format)
+		self.assertEqual((cache.hits, cache.misses), (1, 0))
+		self.assertEqual(mytree.tostring(), tree.tostring())
+		self.assertEqual(dict(mytree.meta), dict(tree.meta))
+		self.assertEqual(myetag, etag)
+
+		# Only mtime changed
+		os.utime(file.path, (etag[0] + 10, etag[0] + 10))
+		mytree, myetag = cache.get_parsetree(file, format)
+		self.assertEqual((cache.hits, cache.misses), (2, 0))
+		self.assertEqual(myetag, (etag[0] + 10, etag[1]))
+
+		# Content changed
+		file.write(self.TEXT + 'More text\n')
+		mytree, myetag = cache.get_parsetree(file, format)
+		self.assertEqual((cache.hits, cache.misses), (2, 1))
+		self.assertIn('More text', mytree.tostring())
+
+		# Least recently used entries are dropped
+		cache.max_size = 1
+		other = folder.file('Bar.txt')
+		other.write(self.TEXT)
+		cache.get_parsetree(other, format)
+		paths = [r[0] for r in cache.db.execute('SELECT path FROM parsetrees')]
+		self.assertEqual(paths, [])
+
+	def testNotebookUsesCache(self):
+		from zim.notebook.parsecache import ParseTreeCache
+
+		notebook = self.setUpNotebook(content={'Foo': 'test 123\n', 'Bar': 'test [[Foo]]\n'})
+		cache = ParseTreeCache(':memory:')
+		notebook.parse_cache = cache
+		notebook.index.set_parse_cache(cache)
+
+		notebook.index.flag_reindex()
+		notebook.index.check_and_update()
+		self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+		notebook.index.flag_reindex()
+		notebook.index.check_and_update()
+		self.assertEqual((cache.hits, cache.misses), (2, 2))
+		self.assertEqual(notebook.links.n_list_links(Path('Bar')), 1)
+
+		page = notebook.get_page(Path('Foo'))
+		self.assertEqual(page.dump('wiki'), ['test 123\n'])
+		self.assertEqual((cache.hits, cache.misses), (3, 2))
+
+
 class TestIndexBackgroundCheck(tests.TestCase):
 
 	def runTest(self):
@@ -1607,6 +1678,69 @@ class TestIndexBackgroundCheck(tests.TestCase):
 		notebook.index.stop_background_check()
 
 
+class TestIndexChangeMonitor(tests.TestCase):
+
+	def runTest(self):
+		from gi.repository import Gio
+		from zim.notebook.index import IndexChangeMonitor
+
+		notebook = self.setUpNotebook(mock=tests.MOCK_ALWAYS_REAL, content=('Foo', 'Foo:Bar'))
+		notebook.index.check_and_update()
+		folder = notebook.layout.root
+
+		changed = []
+		monitor = IndexChangeMonitor(notebook.index._db, folder, changed.extend, max_watches=2)
+		self.assertTrue(monitor.start())
+		self.assertEqual(set(monitor._monitors), {'.', 'Foo'})
+
+		# Changes are collected and passed on in one call
+		file = folder.file('Foo/Bar.txt')
+		for name in ('Foo/Bar.txt', 'Foo/.hidden', 'Foo/Bar.txt~'):
+			gfile = Gio.File.new_for_path(folder.file(name).path)
+			monitor._on_changed(None, gfile, None, Gio.FileMonitorEvent.CHANGES_DONE_HINT)
+		self.assertIsNotNone(monitor._timeout_id)
+		monitor._flush_queue()
+		self.assertEqual(changed, [file])
+
+		# Too many folders, fall back to full checks
+		folder.file('Foo/Bar/Baz.txt').write('test 123\n')
+		folder.file('Dus.txt').write('test 123\n')
+		notebook.index.check_and_update()
+		monitor.update_watches()
+		self.assertFalse(monitor.running)
+		self.assertEqual(monitor._monitors, {})
+
+		monitor.max_watches = 10
+		self.assertTrue(monitor.start())
+		self.assertEqual(set(monitor._monitors), {'.', 'Foo', 'Foo/Bar'})
+		monitor.stop()
+
+
+class TestIndexChangeMonitorQueuesCheck(tests.TestCase):
+
+	def runTest(self):
+		notebook = self.setUpNotebook(mock=tests.MOCK_ALWAYS_REAL, content=('Foo',))
+		notebook.index.check_and_update()
+
+		notebook.index.start_background_check(notebook)
+		while notebook.index.background_check.running:
+			tests.gtk_process_events()
+		self.assertTrue(notebook.index.change_monitor.running)
+
+		# Second call only handles monitored changes
+		notebook.layout.root.file('Bar.txt').write('Content-Type: text/x-zim-wiki\n\ntest 123\n')
+		notebook.index._on_files_changed([notebook.layout.root.file('Bar.txt')])
+		while notebook.index.background_check.running:
+			tests.gtk_process_events()
+		op = ongoing_operation(notebook)
+		if op:
+			op.wait()
+		self.assertTrue(notebook.pages.lookup_by_pagename(Path('Bar')).exists())
+
+		notebook.index.stop_background_check()
+		self.assertFalse(notebook.index.change_monitor.running)
+
+
 class TestBackgroundSave(tests.TestCase):
 
 	def runTest(self):
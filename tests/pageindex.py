@@ -181,6 +181,45 @@ class TestPageTreeStore(tests.TestCase):
 		self.assertTrue(npages > 10) # double check sanity of walk() method
 
 
+class TestPageTreeStoreWideNamespace(tests.TestCase):
+
+	def runTest(self):
+		notebook = self.setUpNotebook()
+		names = ['Page%i' % i for i in range(0, 200, 2)]
+		for name in names:
+			page = notebook.get_page(Path(name))
+			page.parse('plain', 'Test 123\n')
+			notebook.store_page(page)
+
+		def check(treestore, names):
+			treestore.flush_cache()
+			for i, name in enumerate(names):
+				iter = treestore.on_get_iter((i,))
+				self.assertEqual(iter.row['name'], name)
+			self.assertIsNone(treestore.on_get_iter((len(names),)))
+			treestore.flush_cache()
+			for i, name in reversed(list(enumerate(names))):
+				self.assertEqual(treestore.find(Path(name)), Gtk.TreePath((i,)))
+
+		treestore = PageTreeStore(notebook.index)
+		reverse_treestore = PageTreeStore(notebook.index, reverse=True)
+		check(treestore, names)
+		check(reverse_treestore, list(reversed(names)))
+
+		# Rows are updated in place when pages are added or removed
+		for name in ('Page51', 'Page1', 'Page999'):
+			page = notebook.get_page(Path(name))
+			page.parse('plain', 'Test 123\n')
+			notebook.store_page(page)
+			names.append(name)
+		notebook.delete_page(Path('Page100'))
+		names.remove('Page100')
+		names.sort(key=lambda n: int(n[4:]))
+
+		check(treestore, names)
+		check(reverse_treestore, list(reversed(names)))
+
+
 class TestSignals(tests.TestCase):
 
 	PAGES = ('a', 'a:a', 'a:b', 'b', 'c')
@@ -241,6 +280,44 @@ class TestSignals(tests.TestCase):
 		self.assertEqual(signals, expect_del)
 
 
+class TestSignalsBulkUpdate(tests.TestCase):
+
+	PAGES = ('a', 'a:a', 'a:b', 'b', 'c')
+
+	def runTest(self):
+		notebook = self.setUpNotebook()
+		for path in map(Path, self.PAGES):
+			file, folder = notebook.layout.map_page(path)
+			file.write('Content-Type: text/x-zim-wiki\n\ntest 123\n')
+
+		model = PageTreeStore(notebook.index)
+		init_model_validator_wrapper(self, model)
+
+		signals = []
+		def signal_logger(o, *a):
+			path = a[0].to_string()
+			signal = a[-1]
+			signals.append((signal, path))
+
+		for signal in ('row-inserted', 'row-changed', 'row-deleted', 'row-has-child-toggled'):
+			model.connect(signal, signal_logger, signal)
+
+		# Index is empty, so the update is a bulk update and only the
+		# top level is refreshed when it is committed
+		notebook.index.update()
+		self.assertEqual(signals, [
+			('row-inserted', '0'),
+			('row-has-child-toggled', '0'),
+			('row-inserted', '1'),
+			('row-inserted', '2'),
+		])
+
+		# Row signals are handled again after the bulk update
+		signals[:] = []
+		notebook.delete_page(Path('c'))
+		self.assertEqual(signals, [('row-deleted', '2')])
+
+
 class TestPageTreeView(tests.TestCase):
 
 	def setUp(self):
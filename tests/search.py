@@ -236,6 +236,183 @@ class TestSearch(tests.TestCase):
 		# TODO test Name
 
 
+class TestQueryPlanner(tests.TestCase):
+
+	def setUp(self):
+		self.notebook = self.setUpNotebook(content=tests.FULL_NOTEBOOK)
+		self.notebook.index.check_and_update()
+
+	def testIndexTermsLimitContent(self):
+		results = SearchSelection(self.notebook)
+		results.search(Query('Namespace: "TaskList" content:fix'))
+		self.assertIn(Path('TaskList:foo'), results)
+		self.assertTrue(all(p.name.startswith('TaskList') for p in results))
+
+		for text in (
+			'Namespace: "TaskList" content:ThisWordDoesNotExistingInTheTestNotebook',
+			'Tag: NonExistingTag content:foo',
+			'Tag: NonExistingTag foo',
+		):
+			results.search(Query(text))
+			self.assertFalse(results, 'Unexpected results for: %s' % text)
+
+	def testScoreCountsPagesOnce(self):
+		# More than one link in the namespace points to Test:foo:bar
+		results = SearchSelection(self.notebook)
+		results.search(Query('LinksFrom: "Test*"'))
+		self.assertIn(Path('Test:foo:bar'), results)
+		self.assertEqual(set(results.scores.values()), {1})
+
+	def testLinkTermsNotResolved(self):
+		# Link terms for page names that can not be resolved match nothing
+		results = SearchSelection(self.notebook)
+		for text in ('LinksTo: +Foo', 'Bar LinksFrom: +Foo'):
+			results.search(Query(text))
+			self.assertFalse(results, 'Unexpected results for: %s' % text)
+
+		results.search(Query('not LinksTo: +Foo'))
+		self.assertTrue(results)
+
+	def testPlan(self):
+		planner = QueryPlanner(SearchSelection(self.notebook))
+		query = Query('Namespace: Test Tag: tags LinksTo: Foo or Name: Bar foo')
+		indexterms, subgroups, contentterms = planner.split(query.root)
+		self.assertEqual(indexterms, [query.root[0], query.root[1], query.root[2]])
+		self.assertEqual(subgroups, [])
+		self.assertEqual(contentterms, [query.root[3]])
+
+		# Most selective term first
+		self.assertLess(planner.estimate(query.root[1]), planner.estimate(query.root[0]))
+		sql, params = planner.compile(query.root.operator, indexterms)
+		self.assertLess(sql.index('tagsources'), sql.index('REGEXP'))
+
+		text = planner.explain(query)
+		self.assertIn('SQL: WITH', text)
+		self.assertIn('Content scan of the pages matching the terms above', text)
+
+
+class TestSearchCache(tests.TestCase):
+
+	def setUp(self):
+		self.notebook = self.setUpNotebook(content=tests.FULL_NOTEBOOK)
+		self.notebook.index.check_and_update()
+		self.cache = SearchCache.get_for_notebook(self.notebook)
+
+	def search(self, text):
+		results = SearchSelection(self.notebook)
+		results.search(Query(text))
+		return results
+
+	def store(self, name, text):
+		page = self.notebook.get_page(Path(name))
+		page.get_parsetree() # load content
+		page.parse('wiki', text)
+		self.notebook.store_page(page)
+
+	def testHit(self):
+		results = self.search('foo bar')
+		self.assertEqual(self.cache.misses, 1)
+		cached = self.search('bar foo') # same query, other order
+		self.assertEqual(self.cache.hits, 1)
+		self.assertEqual(cached, results)
+		self.assertEqual(cached.scores, results.scores)
+
+		results.search(Query('foo bar'), selection={Path('Test:foo')})
+		self.assertEqual(self.cache.hits + self.cache.misses, 2) # selection is not cached
+
+	def testChangedPage(self):
+		self.assertNotIn(Path('Test:foo'), self.search('Tag: newtag'))
+		self.assertIn(Path('Test:foo'), self.search('Namespace: Test'))
+		self.store('Test:foo', 'some text @newtag\n')
+		self.assertIn(Path('Test:foo'), self.search('Tag: newtag'))
+		self.assertEqual(self.cache.hits, 1) # only the changed page was searched again
+
+		self.store('Test:foo', 'other text\n')
+		self.assertNotIn(Path('Test:foo'), self.search('Tag: newtag'))
+		self.assertIn(Path('Test:foo'), self.search('Namespace: Test'))
+		self.assertEqual(self.cache.hits, 3)
+
+		self.notebook.delete_page(Path('Test:foo'))
+		self.assertNotIn(Path('Test:foo'), self.search('Namespace: Test'))
+
+	def testChangedLinks(self):
+		self.assertNotIn(Path('Test:foo'), self.search('LinksTo: Linking:Foo'))
+		self.store('Test:foo', 'link to [[Linking:Foo]]\n')
+		self.assertIn(Path('Test:foo'), self.search('LinksTo: Linking:Foo'))
+		self.assertEqual(self.cache.hits, 0) # links are not cached across changes
+
+	def testModifiedPage(self):
+		self.assertNotIn(Path('Test:foo'), self.search('content:unsaved'))
+		page = self.notebook.get_page(Path('Test:foo'))
+		page.get_parsetree() # load content
+		page.parse('wiki', 'some unsaved text\n')
+		page.set_modified(True)
+		self.assertIn(Path('Test:foo'), self.search('content:unsaved'))
+		self.assertEqual(self.cache.hits, 1)
+		page.set_modified(False)
+
+	def testNavigate(self):
+		# Opening pages commits the index, but changes no page rows
+		# for existing pages, results should be kept
+		results = self.search('foo')
+		self.search('Tag: tags')
+		self.notebook.index.touch_current_page_placeholder(Path('Test:foo'))
+		self.notebook.index.check_and_update() # background check finds nothing
+		self.search('LinksTo: Linking:Foo')
+		self.notebook.index.touch_current_page_placeholder(Path('Linking:Foo'))
+		self.assertEqual(self.search('foo'), results)
+		self.assertEqual(self.cache.hits, 1)
+		self.assertEqual(self.search('LinksTo: Linking:Foo'), set())
+		self.assertEqual(self.cache.hits, 2)
+
+		# A placeholder for a new page only affects local results for that page
+		self.notebook.index.touch_current_page_placeholder(Path('Some:New:Page'))
+		self.assertEqual(self.search('foo'), results)
+		self.search('Tag: tags')
+		self.assertEqual(self.cache.hits, 4)
+
+	def testUpdatedElsewhere(self):
+		self.search('foo')
+		index = self.notebook.index
+		index._db.execute( # e.g. update by another process
+			'UPDATE zim_index SET value = CAST(value AS INTEGER) + 1 '
+			'WHERE key = "generation"'
+		)
+		index._db.commit()
+		self.assertTrue(index.check_generation())
+		self.search('foo')
+		self.assertEqual(self.cache.hits, 0)
+
+
+class TestSearchStoredText(tests.TestCase):
+
+	def runTest(self):
+		'''Test content search uses the text stored in the index'''
+		notebook = self.setUpNotebook(content={'Foo': 'some text\n', 'Bar': 'other text\n'})
+		notebook.index.check_and_update()
+		self.assertEqual(
+			sorted((p.name, t) for p, t in notebook.pages.iter_text()),
+			[('Bar', 'other text\n'), ('Foo', 'some text\n')]
+		)
+
+		# Change stored text to see it is used instead of the page
+		from zim.notebook.index.pages import compress_text
+		notebook.index._db.execute(
+			'UPDATE pages_text SET text=? WHERE id=(SELECT id FROM pages WHERE name="Bar")',
+			(compress_text('indexed text'),)
+		)
+		notebook.index._db.commit()
+		results = SearchSelection(notebook)
+		results.search(Query('content:indexed'))
+		self.assertEqual(results, {Path('Bar')})
+
+		# Page in memory is used instead of stored text
+		page = notebook.get_page(Path('Bar'))
+		page.get_parsetree()
+		results.search(Query('Name: Bar content:indexed'))
+		self.assertEqual(results, set())
+
+
 @tests.slowTest
 class TestSearchFiles(TestSearch):
 
@@ -246,6 +423,65 @@ class TestSearchFiles(TestSearch):
 		'''Test search API with file based notebook'''
 		TestSearch.runTest(self)
 
+@tests.slowTest
+class TestSearchParallel(tests.TestCase):
+	'''Test content search in worker processes gives the same results'''
+
+	def setUp(self):
+		import zim.parallelsearch
+		self.notebook = self.setUpNotebook(mock=tests.MOCK_ALWAYS_REAL, content=tests.FULL_NOTEBOOK)
+		self.notebook.index.check_and_update()
+		self.notebook.index._db.execute('DELETE FROM pages_text') # force reading the pages
+		self.notebook.index._db.commit()
+		self.cache = SearchCache.get_for_notebook(self.notebook)
+		min_pages = zim.parallelsearch.PARALLEL_MIN_PAGES
+		zim.parallelsearch.PARALLEL_MIN_PAGES = 1
+		def restore():
+			zim.parallelsearch.PARALLEL_MIN_PAGES = min_pages
+		self.addCleanup(restore)
+
+	def runTest(self):
+		for string in ('foo bar', '+TODO -bar', 'TODO or bar', 'content:foo*', 'Test:foo'):
+			query = Query(string)
+			serial = SearchSelection(self.notebook, jobs=1)
+			serial.search(query)
+			self.cache.clear()
+			parallel = SearchSelection(self.notebook, jobs=2)
+			parallel.search(query)
+			self.cache.clear()
+			self.assertTrue(len(serial) > 0, 'no results for: %s' % string)
+			self.assertEqual(parallel, serial)
+			self.assertEqual(parallel.scores, serial.scores)
+
+		# Callback is called in order and can cancel
+		seen = []
+		def callback(selection, path):
+			if path is not None:
+				seen.append(path)
+			return len(seen) < 3
+
+		parallel = SearchSelection(self.notebook, jobs=2)
+		parallel.search(Query('content:foo'), callback=callback)
+		self.assertTrue(parallel.cancelled)
+		self.assertEqual(len(seen), 3)
+		listed = [p.name for p, text in self.notebook.pages.iter_text()]
+		self.assertEqual([p.name for p in seen], sorted((p.name for p in seen), key=listed.index))
+
+
+class TestSearchParallelDefault(tests.TestCase):
+
+	def runTest(self):
+		# Content is searched in worker processes only when asked for
+		from zim.parallelsearch import ParallelContentScanner, PARALLEL_MIN_PAGES
+		notebook = self.setUpNotebook(mock=tests.MOCK_ALWAYS_REAL)
+		self.assertIsNone(ParallelContentScanner.new_for_notebook(notebook, PARALLEL_MIN_PAGES))
+		scanner = ParallelContentScanner.new_for_notebook(notebook, PARALLEL_MIN_PAGES, jobs=2)
+		self.assertIsInstance(scanner, ParallelContentScanner)
+		scanner.close()
+		notebook.index.set_jobs(2)
+		self.assertIsNotNone(ParallelContentScanner.new_for_notebook(notebook, PARALLEL_MIN_PAGES))
+
+
 @tests.skipIf(
 	indexed_fts.IndexedFTSPlugin.check_dependencies()[0] == False,
 	"Indexed FTS plugin not available"
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+
+# Benchmark for building the index of a notebook from scratch
+#
+# Usage: tools/time_indexing.py [--no-bulk] [--jobs N] NOTEBOOK_FOLDER
+#
+# A large test notebook can be generated with
+# tools/create_large_test_notebook.py
+#
+# Use "--no-bulk" to compare with the incremental code path that was used
+# for building the index before bulk updates were introduced.
+
+import sys
+sys.path.insert(0, '.')
+
+import os
+import time
+import getopt
+import tempfile
+
+
+def main(argv):
+	opts, args = getopt.gnu_getopt(argv, '', ['no-bulk', 'jobs='])
+	opts = dict(opts)
+	if len(args) != 1:
+		sys.exit("Usage: %s [--no-bulk] [--jobs N] NOTEBOOK_FOLDER" % sys.argv[0])
+
+	from zim.newfs import LocalFolder
+	from zim.notebook.layout import FilesLayout
+	from zim.notebook.index import Index, IndexUpdateIter
+
+	if '--no-bulk' in opts:
+		IndexUpdateIter.is_empty = lambda self: False
+
+	layout = FilesLayout(LocalFolder(args[0]))
+	with tempfile.TemporaryDirectory() as dir:
+		index = Index(os.path.join(dir, 'index.db'), layout)
+		index.set_jobs(int(opts.get('--jobs', 1)))
+
+		start = time.time()
+		index.update()
+		total = time.time() - start
+
+		n_pages, = index._db.execute('SELECT COUNT(*) FROM pages').fetchone()
+		n_links, = index._db.execute('SELECT COUNT(*) FROM links').fetchone()
+		index._db.close()
+
+	print("Pages: %i, Links: %i" % (n_pages, n_links))
+	print("Index build: %.2f sec (%s)" % (total, 'incremental' if '--no-bulk' in opts else 'bulk'))
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
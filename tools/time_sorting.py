@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+
+# Benchmark for natural sort keys on a large set of page names
+#
+# Usage: tools/time_sorting.py [N_PAGES]
+#
+# Compares building the keys from scratch with the memoized
+# natural_sort_key() for a list of page names. The "lookup" pass mimics
+# the index, which computes keys for the same names again and again
+# when resolving links and when pages are changed.
+
+import sys
+sys.path.insert(0, '.')
+
+import time
+import random
+
+
+def make_names(n):
+	words = ('Foo', 'bar', 'Baz', 'Dus', 'ja', 'Some Page', 'Journal', 'Item')
+	random.seed(n)
+	return [
+		'%s %i%s' % (random.choice(words), random.randint(0, n), random.choice(('', 'a', 'b')))
+		for i in range(n)
+	]
+
+
+def timed(func, *args):
+	start = time.time()
+	func(*args)
+	return time.time() - start
+
+
+def main(argv):
+	n = int(argv[0]) if argv else 100000
+
+	from zim.base.naturalsort import natural_sort_key, SORT_KEY_CACHE_SIZE
+	uncached = natural_sort_key.__wrapped__
+
+	names = make_names(n)
+	lookups = [random.choice(names[:SORT_KEY_CACHE_SIZE]) for i in range(n)]
+
+	def sort(key):
+		sorted(names, key=lambda s: (key(s), s))
+
+	def lookup(key):
+		for name in lookups:
+			key(name)
+
+	natural_sort_key.cache_clear()
+	results = [
+		('sort, uncached', timed(sort, uncached)),
+		('sort, memoized (cold)', timed(sort, natural_sort_key)),
+		('lookup, uncached', timed(lookup, uncached)),
+		('lookup, memoized', timed(lookup, natural_sort_key)),
+	]
+
+	print("Names: %i, cache size: %i" % (n, SORT_KEY_CACHE_SIZE))
+	for name, sec in results:
+		print("%-25s %.3f sec" % (name, sec))
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
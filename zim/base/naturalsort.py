@@ -6,11 +6,15 @@
 import locale
 import re
 import unicodedata
+import functools
 
 
 _num_re = re.compile(r'\d+')
 
+SORT_KEY_CACHE_SIZE = 20000 #: max number of keys memoized by L{natural_sort_key()}
 
+
+@functools.lru_cache(maxsize=SORT_KEY_CACHE_SIZE)
 def natural_sort_key(string, numeric_padding=5):
 	'''Format string such that it gives 'natural' sorting on string
 	compare. Will pad any numbers in the string with "0" such that "10"
@@ -22,6 +26,11 @@ def natural_sort_key(string, numeric_padding=5):
 	C{(sort_key, original_string)}. Or use either L{natural_sort()} or
 	L{natural_sorted()} instead.
 
+	@note: results are memoized in a bounded cache, since the same names
+	are looked up over and over again by the index. The key depends on
+	the locale, so call C{natural_sort_key.cache_clear()} after changing
+	it with C{locale.setlocale()}.
+
 	@param string: the string to format
 	@param numeric_padding: number of digits to use for padding
 	@returns: string transformed to sorting key
@@ -38,7 +47,10 @@ def natural_sort_key(string, numeric_padding=5):
 		# Known python issue :(
 		bytestring = string
 
-	key = ''.join(["%02x" % ord(c) for c in bytestring])
+	try:
+		key = bytestring.encode('latin-1').hex()
+	except UnicodeEncodeError:
+		key = ''.join(["%02x" % ord(c) for c in bytestring])
 	return key
 
 
@@ -580,6 +580,21 @@ class ParseTree(object):
 
 		return count
 
+	def get_search_text(self):
+		'''Returns the text of this tree as a single string for searching.
+		The text of each element is put on a separate line, so a regular
+		expression that does not match newlines gives the same number of
+		matches on this string as L{countre()} gives for the tree.
+		'''
+		parts = []
+		for element in self._etree.iter():
+			if element.text:
+				parts.append(element.text)
+			if element.tail:
+				parts.append(element.tail)
+
+		return '\n'.join(parts)
+
 	def get_ends_with_newline(self):
 		'''Checks whether this tree ends in a newline or not'''
 		return self._get_element_ends_with_newline(self._etree.getroot())
@@ -662,6 +662,7 @@ class MainWindow(WindowBaseMixin, Window):
 		op = ongoing_operation(self.notebook)
 		if op:
 			op.wait()
+		self.notebook.index.optimize()
 
 		Window.destroy(self) # gtk destroy & will also emit destroy signal
 
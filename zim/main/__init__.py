@@ -100,9 +100,14 @@ Import Options:
 
 Search Options:
   -s, --with-scores print score for each page, sort by score
+  -j, --jobs        number of processes used to search page content
 
 Index Options:
   -f, --flush       flush the index first and force re-building
+  -j, --jobs        number of processes used to parse pages
+  --profile-index   print a report of the time used by the indexers
+  --verify          check the index for inconsistencies
+  --repair          with --verify, repair the inconsistencies found
 
 Try 'zim --manual' for more help.
 '''
@@ -580,6 +585,7 @@ class SearchCommand(NotebookCommand):
 	arguments = ('NOTEBOOK', 'QUERY')
 	options = (
 		("with-scores", "s", "also print scores of search results"),
+		('jobs=', 'j', 'number of processes used to search page content'),
 	)
 
 	def run(self):
@@ -594,7 +600,8 @@ class SearchCommand(NotebookCommand):
 		else:
 			raise ValueError('Empty query')
 
-		selection = SearchSelection(notebook)
+		jobs = int(self.opts['jobs']) if 'jobs' in self.opts else None
+		selection = SearchSelection(notebook, jobs=jobs)
 		selection.search(query)
 
 		if self.opts.get("with-scores", False):
@@ -614,6 +621,10 @@ class IndexCommand(NotebookCommand):
 	arguments = ('NOTEBOOK',)
 	options = (
 		('flush', 'f', 'flush the index first and force re-building'),
+		('jobs=', 'j', 'number of processes used to parse pages'),
+		('profile-index', '', 'print a report of the time used by the indexers'),
+		('verify', '', 'check the index for inconsistencies'),
+		('repair', '', 'with --verify, repair the inconsistencies found'),
 	)
 
 	def run(self):
@@ -629,8 +640,19 @@ class IndexCommand(NotebookCommand):
 		mylogger.setLevel(logging.DEBUG)
 		mylogger.addFilter(elevate_index_logging)
 
+		if self.opts.get('profile-index'):
+			from zim.notebook.index.profiler import PROFILE_ENV
+			os.environ[PROFILE_ENV] = '1' # before the index is created
+
 		notebook, x = self.build_notebook(ensure_uptodate=False)
-		if self.opts.get('flush'):
+		if 'jobs' in self.opts:
+			notebook.index.set_jobs(int(self.opts['jobs']))
+		else:
+			from zim.notebook.index.parallel import default_jobs
+			notebook.index.set_jobs(default_jobs())
+		if self.opts.get('verify'):
+			return self.run_verify(notebook)
+		elif self.opts.get('flush'):
 			notebook.index.flush()
 			notebook.index.update()
 		else:
@@ -638,8 +660,38 @@ class IndexCommand(NotebookCommand):
 			logger.info('Checking notebook index')
 			notebook.index.check_and_update()
 
+		n_unchanged = notebook.index.update_iter.pages.n_unchanged
+		if n_unchanged:
+			logger.info('Skipped %i files with new mtime but unchanged content', n_unchanged)
+		if notebook.parse_cache:
+			logger.info('Parse cache: %i hits, %i misses',
+				notebook.parse_cache.hits, notebook.parse_cache.misses)
+		link_cache = notebook.index.update_iter.links.link_cache
+		logger.info('Link resolution cache: %i hits, %i misses',
+			link_cache.hits, link_cache.misses)
+		notebook.index.close()
 		logger.info('Index up to date!')
 
+	def run_verify(self, notebook):
+		repair = self.opts.get('repair')
+		logger.info('Verifying notebook index')
+		problems = notebook.index.verify(repair=repair)
+		for problem in problems:
+			print(problem)
+
+		if not problems:
+			logger.info('No problems found')
+		elif repair:
+			remaining = notebook.index.verify()
+			if remaining:
+				logger.error('Could not repair %i problem(s), use --flush to rebuild the index', len(remaining))
+			else:
+				logger.info('Repaired %i problem(s)', len(problems))
+		else:
+			logger.info('Found %i problem(s), use --repair to fix them', len(problems))
+
+		notebook.index.close()
+
 
 commands = {
 	'help': HelpCommand,
@@ -471,6 +471,22 @@ class Folder(FSObjectBase):
 	def list_names(self, include_hidden=False):
 		raise NotImplementedError
 
+	def stat_children(self, include_hidden=False):
+		'''List the type and modification time of all children in one
+		go. Sub-classes can implement this more efficiently than getting
+		the object for each child and checking it separately.
+		@param include_hidden: if C{True} include hidden files
+		@returns: a list of C{(name, isdir, mtime)} tuples, sorted by name
+		'''
+		stats = []
+		for name in self.list_names(include_hidden):
+			try:
+				child = self.child(name)
+				stats.append((name, isinstance(child, Folder), child.mtime()))
+			except FileNotFoundError:
+				pass # removed while listing
+		return stats
+
 	def walk(self):
 		for child in self:
 			yield child
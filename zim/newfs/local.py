@@ -185,6 +185,27 @@ class LocalFolder(LocalFSObjectBase, Folder):
 
 		return sorted(names)
 
+	def stat_children(self, include_hidden=False):
+		# os.scandir() gets the type from the directory listing, so only
+		# one stat call per child is needed to get the mtime
+		stats = []
+		try:
+			with os.scandir(self.path) as entries:
+				for entry in entries:
+					name = entry.name
+					if not include_hidden \
+					and (name[0] in ('.', '~') or name[-1] == '~'):
+						continue # Ignore hidden files and tmp files
+
+					try:
+						stats.append((name, entry.is_dir(), entry.stat().st_mtime))
+					except OSError:
+						pass # removed while listing
+		except OSError:
+			raise FileNotFoundError(self)
+
+		return sorted(stats)
+
 	def file(self, path):
 		return LocalFile(self.get_childpath(path), watcher=self.watcher)
 
@@ -5,16 +5,21 @@
 
 import sqlite3
 import logging
+import time
+import atexit
 
 logger = logging.getLogger('zim.notebook.index')
 
 try:
 	from gi.repository import GObject
+	from gi.repository import Gio
+	from gi.repository import GLib
 except ImportError:
 	GObject = None
+	Gio = None
 
 
-from zim.newfs import LocalFile, File, Folder, FileNotFoundError
+from zim.newfs import LocalFile, LocalFolder, File, Folder, FileNotFoundError, SEP
 from zim.signals import SignalEmitter
 from zim.base.naturalsort import natural_sort_key
 
@@ -25,11 +30,28 @@ from .base import *
 from .pages import *
 from .links import *
 from .tags import *
+from .parallel import ParallelPageParser
+from .profiler import IndexProfiler, ProfiledConnection, profiling_enabled
 
 
-DB_VERSION = '0.8'
+DB_VERSION = '0.11'
 DB_SORTKEY_CONTENT = 'text_1.2.3_unicode_αβγ_žžž'
 
+DB_PROFILES = {
+	# name: (cache_size, mmap_size, temp_store), sizes in MB
+	'small': (2, 0, 'DEFAULT'),
+	'medium': (16, 64, 'MEMORY'),
+	'large': (64, 256, 'MEMORY'),
+} #: Settings for the database connections, see L{Index.set_db_profile()}
+DB_PROFILE_AUTO = ((2000, 'small'), (50000, 'medium'), (None, 'large'))
+	# profile used for "auto" by max number of pages
+
+VACUUM_MIN_FREE = 0.25 # fraction of unused space that triggers a vacuum
+VACUUM_MIN_SIZE = 4 * 1024 * 1024 # min size of unused space in bytes
+
+FULL_CHECK_INTERVAL = 3600 # seconds between full checks when changes are monitored
+MAX_WATCHES = 4096 # max number of folders monitored for changes
+
 
 class Index(SignalEmitter):
 	'''The Index keeps a cache of all pages in a notebook store, all
@@ -48,7 +70,8 @@ class Index(SignalEmitter):
 
 	@signal: C{new-update-iter (update_iter)}: signal used for plugins wanting
 	to extend the indexer
-	@signal: C{changed ()}: emitted after changes have been committed
+	@signal: C{changed ()}: emitted after changes have been committed,
+	see also L{get_generation()}
 	'''
 
 	__signals__ = {
@@ -63,20 +86,40 @@ class Index(SignalEmitter):
 		'''
 		self.dbpath = dbpath
 		self.layout = layout
+		self.jobs = 1
+		self.parse_cache = None
+		if profiling_enabled():
+			self.profiler = IndexProfiler()
+			atexit.register(self.profiler.print_report)
+		else:
+			self.profiler = None
 		self._db_connect()
+		self._db_readers = self._db_new_readers()
 		if not hasattr(self, 'update_iter'):
 			self._update_iter_init()
 		# else _update_iter_init already called via _db_init()
 
+		self._db_pragmas = None
+		self.set_db_profile()
+
 		self._checker = FilesIndexChecker(self._db, self.layout.root)
 		self.background_check = BackgroundCheck(self._checker, None)
+		self.change_monitor = IndexChangeMonitor(self._db, self.layout.root, self._on_files_changed)
+		self.connect('changed', lambda o: self.change_monitor.update_watches())
+		self._last_full_check = None
+		self._generation = self.get_generation()
 
 	def _update_iter_init(self):
-		self.update_iter = IndexUpdateIter(self._db, self.layout)
+		self.update_iter = IndexUpdateIter(self._db, self.layout, self.profiler)
+		self.update_iter.jobs = self.jobs
+		self.update_iter.pages.parse_cache = self.parse_cache
 		self.update_iter.connect('commit', self.on_commit)
 		self.emit('new-update-iter', self.update_iter)
 
 	def on_commit(self, iter):
+		if self._db_profile[0] == 'auto':
+			self._db_apply_profile() # number of pages may have changed a lot
+		self._generation = self.get_generation()
 		self.emit('changed')
 
 	def _db_connect(self):
@@ -91,13 +134,16 @@ class Index(SignalEmitter):
 			logger.debug('Connecting to in-memory database')
 
 		try:
-			self._db = sqlite3.Connection(self.dbpath)
+			self._db = self._db_new_connection()
 		except:
 			self._db_recover()
 
 		self._db.row_factory = sqlite3.Row
 
 		try:
+			self._db.execute('PRAGMA auto_vacuum=INCREMENTAL;')
+				# only effective for a new database file, else after a vacuum
+			self._db_set_journal_mode()
 			self._db.execute('PRAGMA synchronous=OFF;')
 			# Don't wait for disk writes, we can recover from crashes
 			# anyway. Allows us to use commit more frequently.
@@ -120,6 +166,15 @@ class Index(SignalEmitter):
 		except sqlite3.DatabaseError:
 			self._db_recover()
 
+	def _db_new_connection(self):
+		if self.profiler is None:
+			db = sqlite3.Connection(self.dbpath)
+		else:
+			db = ProfiledConnection(self.dbpath)
+			self.profiler.attach_connection(db)
+		init_connection(db)
+		return db
+
 	def _db_recover(self):
 		assert not self.dbpath == ':memory:'
 		file = LocalFile(self.dbpath)
@@ -131,11 +186,35 @@ class Index(SignalEmitter):
 			logger.error('Could not access database file, running in-memory database')
 			self.dbpath = ':memory:'
 		finally:
-			self._db = sqlite3.Connection(self.dbpath)
+			self._db = self._db_new_connection()
 			self._db.row_factory = sqlite3.Row
+			self._db.execute('PRAGMA auto_vacuum=INCREMENTAL;')
+			self._db_set_journal_mode()
 			self._db_init()
 
+	def _db_set_journal_mode(self):
+		# WAL mode allows views to read from separate connections, also
+		# in other processes, while an update is writing. Not supported
+		# for in-memory databases and e.g. some network file systems.
+		try:
+			mode = self._db.execute('PRAGMA journal_mode=WAL;').fetchone()[0]
+		except sqlite3.OperationalError:
+			mode = None
+		self._wal_mode = (mode == 'wal')
+
+	def _db_new_readers(self):
+		if self._wal_mode:
+			return ReadConnectionPool(self.dbpath)
+		else:
+			logger.debug('Index not in WAL mode, views share the main connection')
+			return self._db
+
 	def _db_init(self):
+		try:
+			generation = self.get_generation()
+		except sqlite3.DatabaseError:
+			generation = 0
+
 		tables = [r[0] for r in self._db.execute(
 			'SELECT name FROM sqlite_master '
 			'WHERE type="table" and name NOT LIKE "sqlite%"'
@@ -144,17 +223,11 @@ class Index(SignalEmitter):
 			self._db.execute('DROP TABLE %s' % table)
 
 		logger.debug('(Re-)Initializing database for index')
-		self._db.executescript('''
-			CREATE TABLE zim_index (
-				key TEXT,
-				value TEXT,
-				CONSTRAINT uc_MetaOnce UNIQUE (key)
-			);
-			INSERT INTO zim_index VALUES ('db_version', %r);
-			INSERT INTO zim_index VALUES ('db_sortkey_format', %r)
-		''' % (DB_VERSION, natural_sort_key(DB_SORTKEY_CONTENT)))
-
 		self._update_iter_init() # Force re-init of all tables
+		self.set_property('db_version', DB_VERSION)
+		self.set_property('db_sortkey_format', natural_sort_key(DB_SORTKEY_CONTENT))
+		self.set_property('generation', generation + 1)
+			# Keep counting, caches may still have data for the old generation
 		self._db.commit()
 
 	def get_property(self, key):
@@ -168,6 +241,121 @@ class Index(SignalEmitter):
 		else:
 			self._db.execute('INSERT OR REPLACE INTO zim_index VALUES (?, ?)', (key, value))
 
+	def set_db_profile(self, profile='auto', cache_size=None, mmap_size=None):
+		'''Set performance settings for the database connections
+		@param profile: one of the keys in C{DB_PROFILES}, or C{"auto"}
+		to pick a profile based on the number of pages in the index
+		@param cache_size: size of the page cache in MB, overrules the
+		profile when not C{None}
+		@param mmap_size: size of memory-mapped I/O in MB, overrules the
+		profile when not C{None}
+		'''
+		if profile != 'auto' and profile not in DB_PROFILES:
+			raise ValueError('No such index profile: %s' % profile)
+		self._db_profile = (profile, cache_size, mmap_size)
+		self._db_apply_profile()
+
+	def _db_apply_profile(self):
+		profile, cache_size, mmap_size = self._db_profile
+		if profile == 'auto':
+			n_pages = self._db.execute('SELECT MAX(id) FROM pages').fetchone()[0] or 0
+			for limit, profile in DB_PROFILE_AUTO:
+				if limit is None or n_pages < limit:
+					break
+
+		p_cache_size, p_mmap_size, temp_store = DB_PROFILES[profile]
+		if cache_size is None:
+			cache_size = p_cache_size
+		if mmap_size is None:
+			mmap_size = p_mmap_size
+
+		pragmas = (
+			'PRAGMA cache_size=%i;' % -(cache_size * 1024), # negative means KiB
+			'PRAGMA mmap_size=%i;' % (mmap_size * 1024 * 1024),
+			'PRAGMA temp_store=%s;' % temp_store,
+		)
+		if pragmas != self._db_pragmas:
+			logger.debug('Index uses "%s" profile', profile)
+			for pragma in pragmas:
+				self._db.execute(pragma)
+			if self._db_readers is not self._db:
+				self._db_readers.set_pragmas(pragmas)
+			self._db_pragmas = pragmas
+
+	def optimize(self):
+		'''Run maintenance on the database. Updates the statistics used
+		to plan queries and vacuums the database file when a large part of
+		it is unused, e.g. after many pages were moved or deleted.
+		'''
+		try:
+			self._db.commit()
+			self._db.execute('PRAGMA optimize;')
+
+			page_size, = self._db.execute('PRAGMA page_size;').fetchone()
+			page_count, = self._db.execute('PRAGMA page_count;').fetchone()
+			freelist_count, = self._db.execute('PRAGMA freelist_count;').fetchone()
+			if freelist_count * page_size >= VACUUM_MIN_SIZE \
+				and freelist_count >= VACUUM_MIN_FREE * page_count:
+					logger.info('Vacuum index, %i of %i pages unused', freelist_count, page_count)
+					auto_vacuum, = self._db.execute('PRAGMA auto_vacuum;').fetchone()
+					if auto_vacuum == 2: # INCREMENTAL
+						self._db.executescript('PRAGMA incremental_vacuum;')
+							# executescript() steps until all pages are freed
+					else:
+						# Convert the file, next time use the faster incremental vacuum
+						self._db.execute('PRAGMA auto_vacuum=INCREMENTAL;')
+						self._db.execute('VACUUM;')
+		except sqlite3.DatabaseError:
+			logger.exception('Error while optimizing index')
+
+	def close(self):
+		'''Run L{optimize()} and close the database connections'''
+		self.stop_background_check()
+		self.optimize()
+		if self._db_readers is not self._db:
+			self._db_readers.close()
+		self._db.close()
+
+	def get_generation(self):
+		'''Get the generation of the index data. The generation is
+		incremented each time an update that changed rows is committed,
+		also when the update is done by another process using the same
+		index file. Caches for data derived from the index can use it as
+		a key.
+		@returns: an integer
+		'''
+		value = self.get_property('generation')
+		return int(value) if value else 0
+
+	def check_generation(self):
+		'''Check whether the index was updated by another process since
+		the last commit seen by this object. If so, the C{changed} signal
+		is emitted.
+		@returns: C{True} if the index changed
+		'''
+		generation = self.get_generation()
+		if generation != self._generation:
+			self._generation = generation
+			self.emit('changed')
+			return True
+		else:
+			return False
+
+	def set_jobs(self, jobs):
+		'''Set the number of worker processes used to parse pages
+		during large index updates
+		@param jobs: number of processes, C{1} for a serial update
+		'''
+		self.jobs = jobs
+		self.update_iter.jobs = jobs
+
+	def set_parse_cache(self, parse_cache):
+		'''Set a cache for parse trees of page source files
+		@param parse_cache: a L{ParseTreeCache} or C{None}
+		'''
+		self.parse_cache = parse_cache
+		self.update_iter.pages.parse_cache = parse_cache
+
 	@property
 	def is_uptodate(self):
 		return self.update_iter.is_uptodate()
@@ -180,8 +368,8 @@ class Index(SignalEmitter):
 		'''Check and update all data in the index'''
 		self.update_iter.check_and_update()
 
-	def check_and_update_iter(self):
-		return self.update_iter.check_and_update_iter()
+	def check_and_update_iter(self, jobs=None):
+		return self.update_iter.check_and_update_iter(jobs=jobs)
 
 	def check_async(self, notebook, paths, recursive=False):
 		assert GObject, 'async operation requires gobject mainloop'
@@ -199,24 +387,108 @@ class Index(SignalEmitter):
 		logger.info('Flushing index')
 		self._db_init()
 
-	def flag_reindex(self):
+	def flag_reindex(self, path=None):
 		'''This methods flags all pages with content to be re-indexed.
 		Main reason to use this would be when loading a new plugin that
 		wants to index all pages.
 		Differs from L{flush()} because it does not drop all data
+		@param path: optional L{Path}, if given only this page and its
+		children are flagged
 		'''
 		from .files import STATUS_NEED_UPDATE
-		self._db.execute(
-			'UPDATE files SET index_status = ?'
-			'WHERE id IN (SELECT source_file FROM pages)',
-			(STATUS_NEED_UPDATE,)
-		)
+		if path is None or path.isroot:
+			self._db.execute(
+				'UPDATE files SET index_status = ?, digest = NULL '
+				'WHERE id IN (SELECT source_file FROM pages)',
+				(STATUS_NEED_UPDATE,)
+			) # reset digest, else unchanged files are skipped
+		else:
+			self._db.execute(
+				'UPDATE files SET index_status = ?, digest = NULL '
+				'WHERE id IN ('
+				'	SELECT source_file FROM pages '
+				'	JOIN pages_closure ON pages.id = pages_closure.descendant '
+				'	WHERE pages_closure.ancestor = (SELECT id FROM pages WHERE name=?)'
+				')',
+				(STATUS_NEED_UPDATE, path.name)
+			)
+
+	def verify(self, repair=False):
+		'''Check the index for inconsistencies, e.g. wrong counts of
+		children or rows that refer to pages that do not exist. The
+		checks use a few queries per table, so this is much faster
+		than re-building the index.
+
+		@param repair: if C{True} the inconsistencies are repaired. Pages
+		and files with problems are dropped from the index, including
+		all their children, and indexed again. The rest of the index
+		is kept.
+		@returns: a list of L{IndexInconsistency} objects for the
+		problems found before repair
+		'''
+		update_iter = self.update_iter
+		problems = update_iter.files.check_integrity()
+		for indexer in update_iter._indexers[1:]:
+			problems.extend(indexer.check_integrity())
+
+		if problems and repair:
+			self._repair(problems)
+
+		return problems
+
+	def _repair(self, problems):
+		update_iter = self.update_iter
+		for indexer in update_iter._indexers[1:]:
+			indexer.repair_integrity()
+
+		pagenames = _top_sections(
+			[p.name for p in problems if p.table == 'pages' and p.name], ':')
+		paths = [p.name for p in problems if p.table == 'files']
+		for name in pagenames:
+			logger.info('Repair index for page: %s', name)
+			path = Path(name)
+			update_iter.pages.repair_section(path)
+			file, folder = self.layout.map_page(path)
+			paths.append(file.relpath(self.layout.root))
+			paths.append(folder.relpath(self.layout.root))
+
+		for path in _top_sections(paths, SEP):
+			logger.info('Repair index for file: %s', path)
+			update_iter.files.repair_section(path)
+
+		update_iter.commit()
+		self.update()
 
 	def start_background_check(self, notebook):
-		self.check_async(notebook, [Path(':')], recursive=True)
+		'''Start checking the notebook folder for changes in the background
+
+		When the folders can be monitored for changes, the changed files
+		are checked as soon as they are signaled and a full check of all
+		files is only done once every C{FULL_CHECK_INTERVAL} seconds.
+		Else each call does a full check.
+
+		Also checks whether another process updated the index in the
+		mean time, see L{check_generation()}.
+		@param notebook: the L{Notebook} object
+		'''
+		self.check_generation()
+		if self.change_monitor.start() \
+		and self._last_full_check is not None \
+		and time.time() - self._last_full_check < FULL_CHECK_INTERVAL:
+			logger.debug('Changes are monitored, skip full check')
+			self.check_async(notebook, [])
+		else:
+			self._last_full_check = time.time()
+			self.check_async(notebook, [Path(':')], recursive=True)
 
 	def stop_background_check(self):
 		self.background_check.stop()
+		self.change_monitor.stop()
+
+	def _on_files_changed(self, files):
+		for file in files:
+			self._checker.queue_check(file, recursive=False)
+		self.background_check.start()
 
 	def update_file(self, file):
 		if not file.exists():
@@ -246,8 +518,7 @@ class Index(SignalEmitter):
 		for i in self.update_iter.partial_update_iter():
 			pass
 
-		self._db.commit()
-		self.on_commit(None)
+		self.update_iter.commit()
 
 	def remove_file(self, file):
 		path = file.relpath(self.layout.root)
@@ -268,14 +539,108 @@ class Index(SignalEmitter):
 		for i in self.update_iter.partial_update_iter():
 			pass
 
-		self._db.commit()
-		self.on_commit(None)
+		self.update_iter.commit()
 
 	def file_moved(self, oldfile, newfile):
-		# TODO: make this more efficient, specific for moved folders
-		#       by supporting moved pages in indexers
-		self.remove_file(oldfile)
-		self.update_file(newfile)
+		'''Update the index after a file or folder has been moved,
+		see L{files_moved()}
+		'''
+		self.files_moved([(oldfile, newfile)])
+
+	def files_moved(self, changes):
+		'''Update the index after files and folders have been moved.
+		When possible the rows are updated in place, keeping the row ids
+		and all indexed data for the moved pages. Else falls back to
+		removing the old and indexing the new location.
+		@param changes: a list of 2-tuples of the old and the new
+		L{File} or L{Folder} objects, typically the file and the
+		folder for a single page
+		'''
+		moves = self._get_moves(changes)
+		if moves is None:
+			logger.debug('Can not move rows in place, re-index moved files')
+			for oldfile, newfile in changes:
+				self.remove_file(oldfile)
+				self.update_file(newfile)
+			return
+
+		filemoves, pagemoves = moves
+		for node_id, newfile in filemoves:
+			self.update_iter.files.move_node(node_id, newfile)
+		for oldname, newname in pagemoves:
+			self.update_iter.pages.move_page(oldname, newname)
+
+		for i in self.update_iter.partial_update_iter():
+			pass
+
+		self.update_iter.commit()
+
+	def _get_moves(self, changes):
+		# Returns a list of files rows and a list of pages to move,
+		# or None if any of the changes can not be handled in place
+		filemoves = []
+		pagemoves = {}
+		with_source = set()
+		with_folder = set()
+		for oldfile, newfile in changes:
+			if not newfile.exists() or isinstance(newfile, File) != isinstance(oldfile, File):
+				return None
+
+			oldpath = oldfile.relpath(self.layout.root)
+			newpath = newfile.relpath(self.layout.root)
+			row = self._db.execute('SELECT id FROM files WHERE path=?', (oldpath,)).fetchone()
+			if row is None or self._db.execute('SELECT id FROM files WHERE path=?', (newpath,)).fetchone():
+				return None
+			filemoves.append((row['id'], newfile))
+
+			if isinstance(newfile, File):
+				pagerow = self._db.execute('SELECT name FROM pages WHERE source_file=?', (row['id'],)).fetchone()
+				newname, file_type = self.layout.map_file(newfile)
+				if pagerow is None and file_type != FILE_TYPE_PAGE_SOURCE:
+					continue # attachment
+				elif pagerow is None or file_type != FILE_TYPE_PAGE_SOURCE:
+					return None # file type changed
+				oldname = Path(pagerow['name'])
+				with_source.add(oldname)
+			else:
+				oldname = self.layout.map_folder(oldfile)
+				newname = self.layout.map_folder(newfile)
+				if self._db.execute('SELECT id FROM pages WHERE name=?', (oldname.name,)).fetchone() is None:
+					continue # no pages in this folder
+				with_folder.add(oldname)
+
+			if pagemoves.setdefault(oldname, newname) != newname:
+				return None
+
+		for oldname, newname in list(pagemoves.items()):
+			if oldname == newname:
+				pagemoves.pop(oldname) # only the file path changed
+				continue
+			elif newname.ischild(oldname) or oldname.ischild(newname):
+				return None
+
+			# The source file and the folder of a page need to move together
+			if oldname not in with_source:
+				row = self._db.execute(
+					'SELECT source_file FROM pages WHERE name=?', (oldname.name,)
+				).fetchone()
+				if row['source_file'] is not None:
+					return None
+			if oldname not in with_folder:
+				row = self._db.execute(
+					'SELECT id FROM pages WHERE substr(name, 1, ?) = ? and source_file IS NOT NULL',
+					(len(oldname.name) + 1, oldname.name + ':')
+				).fetchone()
+				if row is not None:
+					return None
+
+			row = self._db.execute(
+				'SELECT source_file, n_children FROM pages WHERE name=?', (newname.name,)
+			).fetchone()
+			if row and (row['source_file'] is not None or row['n_children'] > 0):
+				return None # only replace placeholders
+
+		return filemoves, list(pagemoves.items())
 
 	def touch_current_page_placeholder(self, path):
 		'''Create a placeholder for C{path} if the page does not
@@ -304,26 +669,74 @@ class Index(SignalEmitter):
 				(ROOT_ID, pid, HREF_REL_ABSOLUTE, path.name)
 			)
 
-		self._db.commit()
-		self.on_commit(None)
+		self.update_iter.commit()
+
+
+def _top_sections(names, sep):
+	# Reduce a list of names to the ones that are not below another
+	# name in the list
+	sections = []
+	for name in sorted(set(names), key=len):
+		if not any(name.startswith(s + sep) for s in sections):
+			sections.append(name)
+	return sorted(sections)
 
 
 class IndexUpdateIter(SignalEmitter):
+	'''Object that runs the indexers to update the index
+
+	@signal: C{commit ()}: changes have been committed
+	@signal: C{start-bulk-update ()}: the index was empty and is now
+	being filled, row signals of the indexers can be ignored until
+	C{end-bulk-update}
+	@signal: C{end-bulk-update ()}: the bulk update has been committed,
+	listeners should refresh their view of the index as a whole
+	'''
 
 	__signals__ = {
 		'commit': (None, None, ()),
+		'start-bulk-update': (None, None, ()),
+		'end-bulk-update': (None, None, ()),
 	}
 
-	def __init__(self, db, layout):
+	def __init__(self, db, layout, profiler=None):
 		self.db = db
 		self.layout = layout
+		self.profiler = profiler
+		self.db.executescript('''
+			CREATE TABLE IF NOT EXISTS zim_index (
+				key TEXT,
+				value TEXT,
+				CONSTRAINT uc_MetaOnce UNIQUE (key)
+			);
+			INSERT OR IGNORE INTO zim_index VALUES ('generation', 0);
+		''')
 		self.files = FilesIndexer(db, layout.root)
+		if profiler:
+			profiler.attach_indexer(self.files) # before others connect
 		self.pages = PagesIndexer(db, layout, self.files)
+		if profiler:
+			profiler.attach_indexer(self.pages)
 		self.links = LinksIndexer(db, self.pages)
 		self.tags = TagsIndexer(db, self.pages)
 		self._indexers = [self.files, self.pages, self.links, self.tags]
+		if profiler:
+			for indexer in self._indexers[2:]:
+				profiler.attach_indexer(indexer)
+		self.jobs = 1
+		self._in_bulk_update = False
+		self._rows_changed = False
+		for signal in ('file-row-inserted', 'file-row-deleted'):
+			self.files.connect(signal, self._on_rows_changed)
+		for signal in ('page-row-inserted', 'page-row-changed', 'page-row-deleted', 'page-row-moved', 'page-changed'):
+			self.pages.connect(signal, self._on_rows_changed)
+
+	def _on_rows_changed(self, *args):
+		self._rows_changed = True
 
 	def add_indexer(self, indexer):
+		if self.profiler:
+			self.profiler.attach_indexer(indexer)
 		self._indexers.append(indexer)
 
 	def remove_indexer(self, indexer):
@@ -343,10 +756,66 @@ class IndexUpdateIter(SignalEmitter):
 		return self
 
 	def __iter__(self):
-		for indexer in self._indexers:
-			for i in indexer.update_iter():
-				yield
-		self.emit('commit')
+		return self.parallel_update_iter(self.jobs)
+
+	def parallel_update_iter(self, jobs):
+		'''Like iterating the object itself, but uses C{jobs} worker
+		processes to parse pages when many files need to be updated
+		@param jobs: number of processes, C{1} for a serial update
+		'''
+		for i in self._files_update_iter(jobs):
+			yield
+		for i in self.partial_update_iter():
+			yield
+		self.commit()
+
+	def _files_update_iter(self, jobs):
+		bulk = self.is_empty()
+		if bulk:
+			self._start_bulk_update()
+
+		parser = ParallelPageParser.new_for_layout(self.db, self.layout, jobs)
+		try:
+			if parser is None:
+				for i in self.files.update_iter():
+					yield
+			else:
+				self.pages.parallel_parser = parser
+				parser.fill()
+				for i in self.files.update_iter():
+					parser.fill()
+					yield
+		finally:
+			if parser is not None:
+				self.pages.parallel_parser = None
+				parser.close()
+			if bulk:
+				self._end_bulk_update()
+
+	def is_empty(self):
+		'''Returns C{True} if no pages have been indexed yet'''
+		row = self.db.execute(
+			'SELECT id FROM pages WHERE id <> ? LIMIT 1', (ROOT_ID,)
+		).fetchone()
+		return row is None
+
+	def _start_bulk_update(self):
+		# When building the index from scratch, indexers can skip
+		# work that is only needed for incremental updates
+		logger.debug('Index is empty, start bulk update')
+		self.db.commit()
+		for indexer in self._indexers[1:]:
+			indexer.start_bulk_update()
+		if not self._in_bulk_update:
+			self._in_bulk_update = True
+			self.emit('start-bulk-update')
+
+	def _end_bulk_update(self):
+		for indexer in self._indexers[1:]:
+			indexer.end_bulk_update()
+		self.db.execute('ANALYZE')
+		self.db.commit()
+		logger.debug('Bulk update finished')
 
 	def update(self):
 		'''Convenience method to do a full update at once'''
@@ -358,19 +827,40 @@ class IndexUpdateIter(SignalEmitter):
 		for i in self.check_and_update_iter(file):
 			pass
 
-	def check_and_update_iter(self, file=None):
+	def check_and_update_iter(self, file=None, jobs=None):
+		jobs = jobs or self.jobs
 		checker = FilesIndexChecker(self.db, self.layout.root)
 		checker.queue_check(file=file)
 		for out_of_date in checker.check_iter():
 			yield
 			if out_of_date:
-				for i in self.files.update_iter():
+				for i in self._files_update_iter(jobs):
 					yield
 
 		for i in self.partial_update_iter():
 			yield
 
+		self.commit()
+
+	def commit(self):
+		'''Commit all changes and emit the C{commit} signal. If rows in
+		the "files" or "pages" table changed since the last commit, the
+		generation of the index is incremented as well. Changes in other
+		tables follow from changes in the "pages" table.
+		'''
+		if self._rows_changed:
+			self.db.execute(
+				'UPDATE zim_index SET value = CAST(value AS INTEGER) + 1 '
+				'WHERE key = "generation"'
+			)
+			self._rows_changed = False
+		self.db.commit()
 		self.emit('commit')
+		if self._in_bulk_update:
+			# Emitted on commit, so that also pages and tags that are
+			# added after the files are indexed are part of the batch
+			self._in_bulk_update = False
+			self.emit('end-bulk-update')
 
 	def partial_update_iter(self):
 		'''Like L{update_iter()} but omits checking new files'''
@@ -416,6 +906,120 @@ class BackgroundCheck(object):
 			self.running = False
 
 
+class IndexChangeMonitor(object):
+	'''Monitors all folders in the index for changes using a
+	C{Gio.FileMonitor} per folder. Changed files are collected for a
+	short delay and then passed to the callback, which can queue a check
+	for just these files instead of checking all files in the index.
+
+	Monitoring is not available without Gio, for non-local folders or
+	when the index has more than C{max_watches} folders. In that case
+	L{start()} returns C{False} and the caller needs to fall back to
+	checking all files.
+	'''
+
+	def __init__(self, db, folder, callback, max_watches=MAX_WATCHES, delay=500):
+		'''Constructor
+		@param db: a C{sqlite3.Connection}
+		@param folder: the L{Folder} that is indexed
+		@param callback: function called as C{callback(files)} with a list
+		of L{File} objects for the files and folders that changed
+		@param max_watches: max number of folders to monitor
+		@param delay: time in milliseconds to collect changes before
+		calling the callback
+		'''
+		self.db = db
+		self.folder = folder
+		self.callback = callback
+		self.max_watches = max_watches
+		self.delay = delay
+		self.running = False
+		self._monitors = {}
+		self._queue = set()
+		self._timeout_id = None
+
+	def start(self):
+		'''Start monitoring
+		@returns: C{True} if changes are monitored
+		'''
+		if not self.running \
+		and Gio is not None \
+		and isinstance(self.folder, LocalFolder):
+			self.running = True
+			self.update_watches()
+		return self.running
+
+	def stop(self):
+		self.running = False
+		for monitor in self._monitors.values():
+			monitor.cancel()
+		self._monitors.clear()
+		if self._timeout_id is not None:
+			GObject.source_remove(self._timeout_id)
+			self._timeout_id = None
+		self._queue.clear()
+
+	def update_watches(self):
+		'''Add and remove monitors to match the folders in the index'''
+		if not self.running:
+			return
+
+		paths = set(r[0] for r in self.db.execute(
+			'SELECT path FROM files WHERE node_type = ?', (TYPE_FOLDER,)
+		))
+		if len(paths) > self.max_watches:
+			logger.info('Too many folders to monitor for changes: %i', len(paths))
+			self.stop()
+			return
+
+		for path in set(self._monitors) - paths:
+			self._monitors.pop(path).cancel()
+
+		for path in paths - set(self._monitors):
+			folder = self.folder if path == '.' else self.folder.folder(path)
+			try:
+				monitor = Gio.File.new_for_uri(folder.uri).monitor_directory(
+					Gio.FileMonitorFlags.NONE, None)
+			except GLib.Error:
+				logger.exception('Error while setting up file monitor for: %s', folder)
+				self.stop()
+				return
+			monitor.connect('changed', self._on_changed)
+			self._monitors[path] = monitor
+
+	def _on_changed(self, filemonitor, file, other_file, event_type):
+		# See FSObjectMonitor for notes on the event types, "changed"
+		# without "changes-done-hint" is ignored to skip partial writes
+		if event_type in (
+			Gio.FileMonitorEvent.CREATED,
+			Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+			Gio.FileMonitorEvent.DELETED,
+			Gio.FileMonitorEvent.MOVED,
+		):
+			for f in (file, other_file):
+				if f is not None:
+					name = f.get_basename()
+					if name[0] not in ('.', '~') and name[-1] != '~':
+						# ignore hidden and tmp files, like Folder.list_names()
+						self._queue.add(f.get_path())
+
+			if self._queue and self._timeout_id is None:
+				self._timeout_id = GObject.timeout_add(self.delay, self._flush_queue)
+
+	def _flush_queue(self):
+		self._timeout_id = None
+		files = []
+		for path in sorted(self._queue):
+			file = LocalFile(path)
+			if file.ischild(self.folder):
+				files.append(file)
+		self._queue.clear()
+		if files and self.running:
+			logger.debug('Monitor found %i changed files', len(files))
+			self.callback(files)
+		return False # only run once
+
+
 def on_out_of_date_found(notebook, background_check):
 	op = IndexUpdateOperation(notebook)
 	op.connect('finished', lambda *a: background_check.start()) # continue checking
@@ -428,19 +1032,26 @@ def on_out_of_date_found(notebook, background_check):
 
 class IndexUpdateOperation(NotebookOperation):
 
-	def __init__(self, notebook):
+	def __init__(self, notebook, jobs=None):
+		'''Constructor
+		@param notebook: the L{Notebook} object
+		@param jobs: number of worker processes to parse pages, defaults
+		to the setting of the index, see L{Index.set_jobs()}, which is a
+		serial update unless set otherwise. Starting worker processes is
+		only worth it for large updates like C{zim --index}.
+		'''
 		NotebookOperation.__init__(
 			self,
 			notebook,
 			_('Updating index'), # T: Title of progressbar dialog
-			self._get_iter(notebook)
+			self._get_iter(notebook, jobs or notebook.index.jobs)
 		)
 
-	def _get_iter(self, notebook):
-		return iter(notebook.index.update_iter)
+	def _get_iter(self, notebook, jobs):
+		return notebook.index.update_iter.parallel_update_iter(jobs)
 
 
 class IndexCheckAndUpdateOperation(IndexUpdateOperation):
 
-	def _get_iter(self, notebook):
-		return notebook.index.check_and_update_iter()
+	def _get_iter(self, notebook, jobs):
+		return notebook.index.check_and_update_iter(jobs)
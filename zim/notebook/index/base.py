@@ -2,7 +2,13 @@
 # Copyright 2009-2017 Jaap Karssenberg <jaap.karssenberg@gmail.com>
 
 
+import os
+import re
+import time
+import sqlite3
 import logging
+import pathlib
+import threading
 
 logger = logging.getLogger('zim.notebook.index')
 
@@ -21,12 +27,139 @@ class IndexConsistencyError(AssertionError):
 	pass
 
 
+class IndexInconsistency(object):
+	'''Inconsistency in the index tables found by L{Index.verify()}
+
+	@ivar table: the name of the table, e.g. "pages"
+	@ivar name: the page name or file path of the affected row
+	@ivar message: description of the problem
+	'''
+
+	__slots__ = ('table', 'name', 'message')
+
+	def __init__(self, table, name, message):
+		self.table = table
+		self.name = name
+		self.message = message
+
+	def __str__(self):
+		return '%s: "%s" %s' % (self.table, self.name, self.message)
+
+	def __repr__(self):
+		return '<%s: %s>' % (self.__class__.__name__, self)
+
+
+BATCH_SIZE = 100 #: Default number of rows fetched at once by the update and check loops
+COMMIT_ROWS = 100 #: Default number of rows handled before a commit
+COMMIT_INTERVAL = 250 #: Default max time in milliseconds between commits
+
+
+class BatchCommitter(object):
+	'''Helper for update loops that commits the transaction after a
+	number of rows or after a time interval, whichever comes first.
+	'''
+
+	def __init__(self, db, rows=COMMIT_ROWS, interval=COMMIT_INTERVAL):
+		'''Constructor
+		@param db: a C{sqlite3.Connection}
+		@param rows: max number of rows per commit
+		@param interval: max time in milliseconds between commits
+		'''
+		self.db = db
+		self.rows = rows
+		self.interval = interval / 1000.0
+		self._count = 0
+		self._start = time.time()
+
+	def tick(self):
+		'''Count a row and commit if needed'''
+		self._count += 1
+		if self._count >= self.rows \
+		or time.time() - self._start >= self.interval:
+			self.commit()
+
+	def commit(self):
+		'''Commit now and reset counters'''
+		self.db.commit()
+		self._count = 0
+		self._start = time.time()
+
+
+def sql_regexp(pattern, string):
+	'''Implements the "REGEXP" operator for SQL statements on the index,
+	e.g. C{"name REGEXP ?"}. Uses python regex syntax, use the C{"(?i)"}
+	flag for a case-insensitive match.
+	'''
+	return string is not None and re.search(pattern, string) is not None
+
+
+def init_connection(db):
+	'''Register the SQL functions used by the index and its views on
+	a new connection
+	@param db: a C{sqlite3.Connection}
+	'''
+	db.create_function('regexp', 2, sql_regexp, deterministic=True)
+
+
+class ReadConnectionPool(object):
+	'''Read-only connections to the index database, one per thread.
+	When the database is in WAL mode, the views can use these to read
+	a consistent snapshot while an index update is writing using the
+	main connection. Only the C{execute()} method of the
+	C{sqlite3.Connection} API is supported.
+	'''
+
+	def __init__(self, dbpath):
+		self.uri = pathlib.Path(os.path.abspath(dbpath)).as_uri() + '?mode=ro'
+		self._local = threading.local()
+		self._lock = threading.Lock()
+		self._connections = []
+		self._pragmas = ()
+
+	def set_pragmas(self, pragmas):
+		'''Set "PRAGMA" statements to run for each connection
+		@param pragmas: a list of SQL statements
+		'''
+		with self._lock:
+			self._pragmas = tuple(pragmas)
+			for db in self._connections:
+				for pragma in self._pragmas:
+					db.execute(pragma)
+
+	def _get_connection(self):
+		db = getattr(self._local, 'db', None)
+		if db is None:
+			db = sqlite3.connect(self.uri, uri=True, isolation_level=None, check_same_thread=False)
+				# only used by this thread, but close() can be called from any thread
+			db.row_factory = sqlite3.Row
+			init_connection(db)
+			for pragma in self._pragmas:
+				db.execute(pragma)
+			self._local.db = db
+			with self._lock:
+				self._connections.append(db)
+		return db
+
+	def execute(self, *args):
+		return self._get_connection().execute(*args)
+
+	def close(self):
+		'''Close all connections, a new connection is opened when
+		the pool is used again
+		'''
+		with self._lock:
+			for db in self._connections:
+				db.close()
+			self._connections = []
+		self._local = threading.local()
+
+
 class IndexView(object):
 	'''Base class for "index view" objects'''
 
 	@classmethod
 	def new_from_index(cls, index):
-		return cls(index._db)
+		return cls(index._db_readers)
 
 	def __init__(self, db):
 		self.db = db
@@ -52,6 +185,32 @@ class IndexerBase(SignalEmitter, ConnectorMixin):
 	def update_iter(self):
 		return iter([])
 
+	def start_bulk_update(self):
+		'''Called before the index is build from scratch. Indexers can
+		use this to e.g. drop secondary indexes or skip bookkeeping that
+		is only needed for incremental updates.
+		'''
+		pass
+
+	def end_bulk_update(self):
+		'''Called after the files have been indexed in a bulk update,
+		must restore anything skipped by L{start_bulk_update()}
+		'''
+		pass
+
+	def check_integrity(self):
+		'''Check the tables of this indexer for inconsistencies
+		@returns: a list of L{IndexInconsistency} objects
+		'''
+		return []
+
+	def repair_integrity(self):
+		'''Repair inconsistencies that do not need a re-index of
+		pages, e.g. by dropping rows that refer to pages that do not
+		exist anymore
+		'''
+		pass
+
 
 class MyTreeIter(object):
 	__slots__ = ('treepath', 'row', 'n_children', 'hint')
@@ -74,10 +233,15 @@ class TreeModelMixinBase(ConnectorMixin):
 
 	def __init__(self, index):
 		self.index = index
-		self.db = index._db
+		self.db = index._db # not "_db_readers", need to see rows before commit
 		self.cache = {}
-		self.connect_to_updateiter(index, index.update_iter)
-		self.connectto(index, 'new-update-iter', self.connect_to_updateiter)
+		self._bulk_n_children_top = None
+		self._connect_to_updateiter(index, index.update_iter)
+		self.connectto(index, 'new-update-iter', self._connect_to_updateiter)
+
+	def _connect_to_updateiter(self, index, update_iter):
+		self.connectto_all(update_iter, ('start-bulk-update', 'end-bulk-update'))
+		self.connect_to_updateiter(index, update_iter)
 
 	def connect_to_updateiter(self, update_iter):
 		'''Connect to a new L{IndexUpdateIter}
@@ -96,6 +260,36 @@ class TreeModelMixinBase(ConnectorMixin):
 		'''
 		raise NotImplementedError
 
+	# During a bulk update the row signals of the indexers are not
+	# handled, instead the model is refreshed once when the update is
+	# committed. Handling a signal per row costs more than the indexing
+	# itself when filling a large index with the view open.
+
+	def on_start_bulk_update(self, update_iter):
+		self._bulk_n_children_top = self.n_children_top()
+		for indexer in update_iter._indexers:
+			self.disconnect_from(indexer)
+
+	def on_end_bulk_update(self, update_iter):
+		if self._bulk_n_children_top is None:
+			return # model was created during the bulk update
+
+		n_old = self._bulk_n_children_top
+		self._bulk_n_children_top = None
+		self.flush_cache()
+		self.connect_to_updateiter(self.index, update_iter)
+		self.refresh(n_old)
+
+	def refresh(self, n_old):
+		'''Emit signals to replace all rows in the model by the current
+		state of the index, used after a bulk update.
+
+		@param n_old: number of rows in the top level of the model
+		that the view knows about
+		@implementation: must be implemented by a subclass
+		'''
+		raise NotImplementedError
+
 	def teardown(self):
 		self.flush_cache()
 		self.disconnect_all()
@@ -25,6 +25,8 @@ TYPE_FILE = 2
 from zim.newfs import File, Folder, SEP
 from zim.signals import SignalEmitter
 
+from .base import BatchCommitter, IndexInconsistency, BATCH_SIZE, COMMIT_ROWS, COMMIT_INTERVAL
+
 
 class FilesIndexer(SignalEmitter):
 	'''Class that will update the "files" table in the index based on
@@ -34,6 +36,8 @@ class FilesIndexer(SignalEmitter):
 	@signal: C{file-row-changed (row, file)}: on file content changed
 	@signal: C{file-row-deleted (row)}: on file deleted
 
+	The "digest" column is not set by this class, it is kept for page
+	source files by the L{PagesIndexer}.
 	'''
 
 	# Note that there are no methods for new files or folders,
@@ -50,9 +54,19 @@ class FilesIndexer(SignalEmitter):
 		'file-row-deleted': (None, None, (object,)),
 	}
 
-	def __init__(self, db, folder):
+	def __init__(self, db, folder, batch_size=BATCH_SIZE, commit_rows=COMMIT_ROWS, commit_interval=COMMIT_INTERVAL):
+		'''Constructor
+		@param db: a C{sqlite3.Connection}
+		@param folder: the L{Folder} to index
+		@param batch_size: number of rows fetched at once for update
+		@param commit_rows: max number of rows updated per commit
+		@param commit_interval: max time in milliseconds between commits
+		'''
 		self.db = db
 		self.folder = folder
+		self.batch_size = batch_size
+		self.commit_rows = commit_rows
+		self.commit_interval = commit_interval
 
 		self.db.executescript('''
 		CREATE TABLE IF NOT EXISTS files(
@@ -62,6 +76,7 @@ class FilesIndexer(SignalEmitter):
 			path TEXT UNIQUE NOT NULL,
 			node_type INTEGER NOT NULL,
 			mtime TIMESTAMP,
+			digest TEXT,
 
 			index_status INTEGER DEFAULT 3
 
@@ -93,42 +108,63 @@ class FilesIndexer(SignalEmitter):
 		# sort folders before files: first index structure, then contents
 		# this makes e.g. index links more efficient and robust
 		# sort by id to ensure parents are found before children
-		while True:
-			row = self.db.execute(
-				'SELECT id, path, node_type FROM files'
-				' WHERE index_status = ? AND path LIKE ?'
-				' ORDER BY node_type, id',
-				(STATUS_NEED_UPDATE, prefix + '%')
-			).fetchone()
-
-			if row:
-				node_id, path, node_type = row
+		#
+		# Rows are fetched in batches, but a batch only contains a single
+		# node type. Updating a folder can add new rows, these have a
+		# higher id and thus are handled after the rest of the batch, like
+		# they would be when fetching one row at a time.
+		committer = BatchCommitter(self.db, self.commit_rows, self.commit_interval)
+		try:
+			while True:
+				rows = self.db.execute(
+					'SELECT id, path, node_type FROM files'
+					' WHERE index_status = ? AND path LIKE ?'
+					' ORDER BY node_type, id LIMIT ?',
+					(STATUS_NEED_UPDATE, prefix + '%', self.batch_size)
+				).fetchall()
+				if not rows:
+					break
+
+				batch_type = rows[0]['node_type']
+				for node_id, path, node_type in rows:
+					if node_type != batch_type:
+						break
+					elif not self._needs_update(node_id):
+						continue # e.g. dropped while updating parent folder
+
+					self._update_row(node_id, path, node_type)
+					committer.tick()
+					yield
+		finally:
+			committer.commit()
+
+	def _needs_update(self, node_id):
+		row = self.db.execute(
+			'SELECT index_status FROM files WHERE id = ?', (node_id,)
+		).fetchone()
+		return row is not None and row[0] == STATUS_NEED_UPDATE
+
+	def _update_row(self, node_id, path, node_type):
+		try:
+			if node_type == TYPE_FOLDER:
+				folder = self.folder.folder(path)
+				if folder.exists():
+					self.update_folder(node_id, folder)
+				else:
+					self.delete_folder(node_id)
 			else:
-				break
-
-			try:
-				if node_type == TYPE_FOLDER:
-					folder = self.folder.folder(path)
-					if folder.exists():
-						self.update_folder(node_id, folder)
-					else:
-						self.delete_folder(node_id)
+				file = self.folder.file(path)
+				if file.exists():
+					self.update_file(node_id, file)
 				else:
-					file = self.folder.file(path)
-					if file.exists():
-						self.update_file(node_id, file)
-					else:
-						self.delete_file(node_id)
-			except:
-				self.db.execute( # avoid looping
-					'UPDATE files SET index_status = ? WHERE id = ?',
-					(STATUS_UPTODATE, node_id)
-				)
-				logger.exception('Error while indexing: %s', path)
-					# do this logging *after* above update - else test suite still loops due to log-to-error handler
-
-			self.db.commit()
-			yield
+					self.delete_file(node_id)
+		except:
+			self.db.execute( # avoid looping
+				'UPDATE files SET index_status = ? WHERE id = ?',
+				(STATUS_UPTODATE, node_id)
+			)
+			logger.exception('Error while indexing: %s', path)
+				# do this logging *after* above update - else test suite still loops due to log-to-error handler
 
 	def interactive_add_file(self, file):
 		assert isinstance(file, File) and file.exists()
@@ -190,6 +226,31 @@ class FilesIndexer(SignalEmitter):
 		else:
 			return r[0]
 
+	def move_node(self, node_id, newfile):
+		'''Update the path of a file or folder that has been moved.
+		Rows keep their ids, for a folder also the paths of all
+		children are updated.
+		@param node_id: the id of the row for the old location
+		@param newfile: the L{File} or L{Folder} for the new location
+		'''
+		assert node_id != 1, 'BUG: can\'t move notebook folder'
+		row = self.db.execute('SELECT * FROM files WHERE id=?', (node_id,)).fetchone()
+		oldpath = row['path']
+		newpath = newfile.relpath(self.folder)
+		logger.debug('Move %s to %s', oldpath, newpath)
+
+		parent_id = self._add_parent(newfile.parent())
+		self.db.execute(
+			'UPDATE files SET path=?, parent=? WHERE id=?',
+			(newpath, parent_id, node_id)
+		)
+		if row['node_type'] == TYPE_FOLDER:
+			self.db.execute(
+				'UPDATE files SET path = ? || substr(path, ?) '
+				'WHERE substr(path, 1, ?) = ?',
+				(newpath, len(oldpath) + 1, len(oldpath) + 1, oldpath + SEP)
+			)
+
 	def update_folder(self, node_id, folder):
 		# First invalidate all, so any children that are not found in
 		# update will be left with this status
@@ -208,15 +269,19 @@ class FilesIndexer(SignalEmitter):
 		)
 
 		mtime = folder.mtime() # get mtime before getting contents
-		for child in folder:
-			path = child.relpath(self.folder)
+		prefix = '' if folder == self.folder else folder.relpath(self.folder) + SEP
+		for name, isdir, mtime_on_disk in folder.stat_children():
+			path = prefix + name
 			if path in children:
 				child_id, child_mtime, index_status = children[path]
 				if index_status == STATUS_NEED_UPDATE:
 					# If the status was "need update" already, don't overrule it
 					# here with mtime check - else we break flag_reindex()
-					pass
-				elif child.mtime() != child_mtime:
+					self.db.execute(
+						'UPDATE files SET index_status = ? WHERE id = ?',
+						(STATUS_NEED_UPDATE, child_id)
+					) # restore, all children were flagged for deletion above
+				elif mtime_on_disk != child_mtime:
 					self.db.execute(
 						'UPDATE files SET index_status = ? WHERE id = ?',
 						(STATUS_NEED_UPDATE, child_id)
@@ -225,7 +290,7 @@ class FilesIndexer(SignalEmitter):
 					self.set_node_uptodate(child_id, child_mtime)
 			else:
 				# new child
-				node_type = TYPE_FILE if isinstance(child, File) else TYPE_FOLDER
+				node_type = TYPE_FOLDER if isdir else TYPE_FILE
 				if node_type == TYPE_FILE:
 					self.db.execute(
 						'INSERT INTO files(path, node_type, index_status, parent)'
@@ -290,12 +355,86 @@ class FilesIndexer(SignalEmitter):
 		logger.debug('Drop folder: %s', row['path'])
 		self.db.execute('DELETE FROM files WHERE id == ?', (node_id,))
 
+	def check_integrity(self):
+		'''Check the "files" table for inconsistencies
+		@returns: a list of L{IndexInconsistency} objects
+		'''
+		problems = []
+		for path, in self.db.execute(
+			'SELECT f.path FROM files AS f LEFT JOIN files AS p ON f.parent = p.id '
+			'WHERE f.id > 1 AND p.id IS NULL'
+		):
+			problems.append(IndexInconsistency('files', path, 'parent folder missing'))
+
+		for path, in self.db.execute(
+			'SELECT f.path FROM files AS f JOIN files AS p ON f.parent = p.id '
+			'WHERE f.id > 1 AND p.node_type <> ?',
+			(TYPE_FOLDER,)
+		):
+			problems.append(IndexInconsistency('files', path, 'parent is not a folder'))
+
+		for path, in self.db.execute(
+			'SELECT f.path FROM files AS f JOIN files AS p ON f.parent = p.id '
+			'WHERE f.id > 1 AND CASE WHEN p.id = 1 '
+			'	THEN instr(f.path, ?) > 0 '
+			'	ELSE substr(f.path, 1, length(p.path) + 1) <> p.path || ? '
+			'	OR instr(substr(f.path, length(p.path) + 2), ?) > 0 '
+			'END',
+			(SEP, SEP, SEP)
+		):
+			problems.append(IndexInconsistency('files', path, 'path does not match parent folder'))
+
+		return problems
+
+	def repair_section(self, path):
+		'''Drop the rows for a file or folder and everything below it
+		and flag the parent folder to be indexed again. The update of
+		the parent folder inserts the rows again.
+		@param path: the path of the file or folder relative to the
+		notebook folder, as used in the "files" table
+		'''
+		assert path != '.', 'BUG: can\'t repair notebook folder'
+		for row in self.db.execute(
+			'SELECT * FROM files WHERE path = ? OR substr(path, 1, ?) = ? '
+			'ORDER BY length(path) DESC',
+			(path, len(path) + 1, path + SEP)
+		).fetchall():
+			logger.debug('Drop for repair: %s', row['path'])
+			if row['node_type'] == TYPE_FILE:
+				self.emit('file-row-deleted', row)
+			self.db.execute('DELETE FROM files WHERE id = ?', (row['id'],))
+
+		while True:
+			path = path.rpartition(SEP)[0] or '.'
+			row = self.db.execute(
+				'SELECT id FROM files WHERE path = ? AND node_type = ?',
+				(path, TYPE_FOLDER)
+			).fetchone()
+			if row is not None:
+				self.db.execute(
+					'UPDATE files SET index_status = ? WHERE id = ?',
+					(STATUS_NEED_UPDATE, row['id'])
+				)
+				break
+			elif path == '.':
+				break
+
 
 class FilesIndexChecker(object):
 
-	def __init__(self, db, folder):
+	def __init__(self, db, folder, batch_size=BATCH_SIZE, commit_rows=COMMIT_ROWS, commit_interval=COMMIT_INTERVAL):
+		'''Constructor
+		@param db: a C{sqlite3.Connection}
+		@param folder: the L{Folder} that is indexed
+		@param batch_size: number of rows fetched at once for checking
+		@param commit_rows: max number of rows checked per commit
+		@param commit_interval: max time in milliseconds between commits
+		'''
 		self.db = db
 		self.folder = folder
+		self.batch_size = batch_size
+		self.commit_rows = commit_rows
+		self.commit_interval = commit_interval
 
 	def queue_check(self, file=None, recursive=True):
 		if file is None:
@@ -351,74 +490,114 @@ class FilesIndexChecker(object):
 		# sort folders before files: first index structure, then contents
 		# this makes e.g. index links more efficient and robust
 		# sort by id to ensure parents are found before children
-
-		while True:
-			row = self.db.execute(
-				'SELECT id, path, node_type, mtime, index_status FROM files'
-				' WHERE index_status > ? '
-				' ORDER BY node_type, id',
-				(STATUS_UPTODATE,)
-			).fetchone()
-
-			if row:
-				#~ logger.debug('Check %s', row['path'])
-				node_id, path, node_type, mtime, check = row
+		#
+		# Rows are fetched in batches, when an out of date record is found
+		# the batch is dropped because the consumer of this iterator will
+		# typically update the index before continuing. A batch only
+		# contains a single node type, because checking a folder also
+		# checks the files in it, see _check_folder_content().
+		committer = BatchCommitter(self.db, self.commit_rows, self.commit_interval)
+		try:
+			while True:
+				rows = self.db.execute(
+					'SELECT id, path, node_type, mtime, index_status FROM files'
+					' WHERE index_status > ? '
+					' ORDER BY node_type, id LIMIT ?',
+					(STATUS_UPTODATE, self.batch_size)
+				).fetchall()
+				if not rows:
+					break # done
+
+				batch_type = rows[0]['node_type']
+				for row in rows:
+					#~ logger.debug('Check %s', row['path'])
+					if row['node_type'] != batch_type:
+						break # re-fetch, files may have been checked already
+					elif row['index_status'] == STATUS_NEED_UPDATE:
+						committer.commit()
+						yield True
+						break # let updater handle this first, then re-fetch
+
+					new_status = self._check_row(*row)
+					if new_status == STATUS_NEED_UPDATE:
+						committer.commit()
+						yield True
+						break # re-fetch after the update
+					else:
+						committer.tick()
+						yield False
+		finally:
+			committer.commit()
+
+	def _check_row(self, node_id, path, node_type, mtime, check):
+		try:
+			if node_type == TYPE_FOLDER:
+				obj = self.folder.folder(path)
 			else:
-				break # done
+				obj = self.folder.file(path)
 
-			if check == STATUS_NEED_UPDATE:
-				yield True
-				continue # let updater handle this first
-
-			try:
+			if not obj.exists():
+				new_status = STATUS_NEED_UPDATE
+			else:
 				if node_type == TYPE_FOLDER:
-					obj = self.folder.folder(path)
-				else:
-					obj = self.folder.file(path)
-
-				if not obj.exists():
-					check = STATUS_CHECK # update will drop children, no need to recurs anymore
-					new_status = STATUS_NEED_UPDATE
-
+					if mtime == obj.mtime() and self._check_folder_content(node_id, obj):
+						new_status = STATUS_UPTODATE
+					else:
+						new_status = STATUS_NEED_UPDATE
 				else:
-					if node_type == TYPE_FOLDER:
-						if mtime == obj.mtime() and self._check_folder_content(node_id, obj):
-							new_status = STATUS_UPTODATE
-						else:
-							new_status = STATUS_NEED_UPDATE
+					if mtime == obj.mtime():
+						new_status = STATUS_UPTODATE
 					else:
-						if mtime == obj.mtime():
-							new_status = STATUS_UPTODATE
-						else:
-							new_status = STATUS_NEED_UPDATE
+						new_status = STATUS_NEED_UPDATE
 
-				self.db.execute(
-					'UPDATE files SET index_status = ?'
-					' WHERE id = ?',
-					(new_status, node_id)
-				)
-				self.db.commit()
+			# Only update if status did not change while we were checking,
+			# e.g. by an interactive update or flag_reindex()
+			self.db.execute(
+				'UPDATE files SET index_status = ?'
+				' WHERE id = ? AND index_status = ?',
+				(new_status, node_id, check)
+			)
 
-			except:
-				logger.exception('Error while indexing: %s', path)
-				self.db.execute( # avoid looping
-					'UPDATE files SET index_status = ? WHERE id = ?',
-					(STATUS_NEED_UPDATE, node_id)
-				)
-				self.db.commit()
-				new_status = STATUS_NEED_UPDATE
+		except:
+			logger.exception('Error while indexing: %s', path)
+			self.db.execute( # avoid looping
+				'UPDATE files SET index_status = ? WHERE id = ?',
+				(STATUS_NEED_UPDATE, node_id)
+			)
+			new_status = STATUS_NEED_UPDATE
 
-			yield new_status == STATUS_NEED_UPDATE
+		return new_status
 
 	def _check_folder_content(self, node_id, folder):
 		# This method adds more robustness for detecting new / missing files
 		# in cases where the folder mtime is not reliable. This is a issue seen
 		# a few times already on cloud synced and encrypted file systems.
-		on_disk = folder.list_names()
-		in_index = sorted(os.path.basename(r['path'])
-			for r in self.db.execute('SELECT path FROM files WHERE parent = ?', (node_id,))
+		#
+		# The listing also gives the mtime of all children, so files
+		# that are queued for a check are checked here in bulk instead
+		# of a stat call per row.
+		on_disk = dict(
+			(name, (isdir, mtime)) for name, isdir, mtime in folder.stat_children()
+		)
+		in_index = set()
+		checked = []
+		for child_id, path, node_type, mtime, index_status in self.db.execute(
+			'SELECT id, path, node_type, mtime, index_status FROM files WHERE parent = ?',
+			(node_id,)
+		):
+			name = os.path.basename(path)
+			in_index.add(name)
+			if node_type == TYPE_FILE and index_status == STATUS_CHECK \
+			and name in on_disk and not on_disk[name][0]:
+				new_status = STATUS_UPTODATE if on_disk[name][1] == mtime else STATUS_NEED_UPDATE
+				checked.append((new_status, child_id, STATUS_CHECK))
+
+		self.db.executemany(
+			'UPDATE files SET index_status = ?'
+			' WHERE id = ? AND index_status = ?',
+			checked
 		)
-		return in_index == on_disk
+		return in_index == set(on_disk)
 
 
 class TestFilesDBTable(object):
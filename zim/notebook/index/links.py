@@ -22,7 +22,6 @@ re-calculate all links on every page index to ensure the outcome.)
 '''
 
 import logging
-import sqlite3
 
 logger = logging.getLogger('zim.notebook.index')
 
@@ -32,14 +31,21 @@ from zim.notebook.page import Path, HRef, \
 	HREF_REL_ABSOLUTE, HREF_REL_FLOATING, HREF_REL_RELATIVE
 
 
-from .base import IndexerBase, IndexView, IndexNotFoundError
-from .pages import PagesViewInternal, ROOT_ID
+from .base import IndexerBase, IndexView, IndexNotFoundError, IndexInconsistency
+from .pages import PagesViewInternal, LinkResolutionCache, PageIndexRecord, ROOT_ID, HAVE_RECURSIVE_CTE
 
 
 LINK_DIR_FORWARD = 1 #: Constant for forward links
 LINK_DIR_BACKWARD = 2 #: Constant for backward links
 LINK_DIR_BOTH = 3 #: Constant for links in any direction
 
+SECTION_CTE = (
+	'WITH section(id) AS ('
+	'	SELECT descendant FROM pages_closure WHERE ancestor=?'
+	') '
+) # Prefix for queries that need the ids of a page and all its children
+
+
 class IndexLink(object):
 	'''Class used to represent links between two pages
 
@@ -61,13 +67,19 @@ class LinksIndexer(IndexerBase):
 
 	__signals__ = {}
 
+	DEFERRED_INDEXES = '''
+		CREATE INDEX IF NOT EXISTS links_anchorkey ON links(anchorkey);
+	''' # not needed while inserting links, created after a bulk update
+
 	def __init__(self, db, pagesindexer):
 		IndexerBase.__init__(self, db)
-		self._pages = PagesViewInternal(db)
+		self.link_cache = LinkResolutionCache()
+		self._pages = PagesViewInternal(db, self.link_cache)
 		self._pagesindexer = pagesindexer
+		self._bulk_update = False
 		self.connectto_all(pagesindexer, (
 			'page-row-inserted', 'page-row-changed', 'page-row-deleted',
-			'page-changed'
+			'page-row-moved', 'page-changed'
 		))
 
 		self.db.execute('''
@@ -88,6 +100,7 @@ class LinksIndexer(IndexerBase):
 				CONSTRAINT uc_LinkOnce UNIQUE (source, rel, names)
 			);
 		''')
+		self.db.executescript(self.DEFERRED_INDEXES)
 
 	def on_page_changed(self, o, row, doc):
 		# Drop links for this page and add new ones (don't bother
@@ -96,56 +109,89 @@ class LinksIndexer(IndexerBase):
 			'DELETE FROM links WHERE source=?',
 			(row['id'],)
 		)
+		links = {}
 		for href in doc.iter_href(include_anchors=False):
 			assert href.parts()  # links cannot be only anchor
 			anchorkey = natural_sort_key(href.parts()[0])
-			try:
-				#print("INSERT INTO links(%d, %d, %d, %s,...)" % (row['id'], ROOT_ID, href.rel, href.names))
-				self.db.execute(
-					'INSERT INTO links(source, target, rel, names, anchorkey, needscheck) '
-					'VALUES (?, ?, ?, ?, ?, ?)',
-					(row['id'], ROOT_ID, href.rel, href.names, anchorkey, 1)
-				)
-			except sqlite3.IntegrityError:
-				logger.exception('Integrity error when inserting link (%d,%d,%d,%s)', row['id'], ROOT_ID, href.rel, href.names)
+			if (href.rel, href.names) in links:
+				logger.error('Integrity error when inserting link (%d,%d,%d,%s)', row['id'], ROOT_ID, href.rel, href.names)
+			else:
+				links[(href.rel, href.names)] = (row['id'], ROOT_ID, href.rel, href.names, anchorkey, 1)
+
+		self.db.executemany(
+			'INSERT INTO links(source, target, rel, names, anchorkey, needscheck) '
+			'VALUES (?, ?, ?, ?, ?, ?)',
+			links.values()
+		)
+
+	def start_bulk_update(self):
+		self._bulk_update = True
+		self.db.execute('DROP INDEX IF EXISTS links_anchorkey')
+
+	def end_bulk_update(self):
+		self._bulk_update = False
+		self.db.executescript(self.DEFERRED_INDEXES)
+		# Placeholders can only have been added by an interactive update
+		# during the bulk update, flag links that may need to resolve to
+		# pages that were inserted in the mean time
+		self.db.execute(
+			'UPDATE links SET needscheck=1 '
+			'WHERE rel=? and target in ( '
+			'	SELECT id FROM pages WHERE is_link_placeholder=1 '
+			')',
+			(HREF_REL_FLOATING,)
+		)
 
 	def on_page_row_inserted(self, o, row):
+		self.link_cache.invalidate(row['sortkey'])
+
 		# Placeholders for pages of the same name need to be
 		# recalculated, flag links to be checked with same anchorkey.
-		if not row['is_link_placeholder']:
+		# Only links from pages below the parent of the new page can
+		# resolve to it, see the prefix check in "_resolve_link()".
+		# In a bulk update all links are checked afterwards anyway.
+		if not row['is_link_placeholder'] and not self._bulk_update:
+			parentname = row['name'].rpartition(':')[0]
 			self.db.execute( # NOTE using subquery because sqlite does not have JOIN for UPDATE
 				'UPDATE links SET needscheck=1 '
 				'WHERE rel=? and anchorkey=? and target in ( '
 				'	SELECT id FROM pages WHERE is_link_placeholder=1 '
-				')',
-				(HREF_REL_FLOATING, row['sortkey'])
+				') and ( '
+				'	SELECT substr(name, 1, ?) FROM pages WHERE id=links.source '
+				') = ?',
+				(HREF_REL_FLOATING, row['sortkey'], len(parentname), parentname)
 			)
 
 	def on_page_row_changed(self, o, newrow, oldrow):
+		if oldrow['is_link_placeholder'] != newrow['is_link_placeholder']:
+			self.link_cache.invalidate(newrow['sortkey'])
+
 		if oldrow['is_link_placeholder'] and not newrow['is_link_placeholder']:
 			self.on_page_row_inserted(o, newrow)
 		elif not oldrow['is_link_placeholder'] and newrow['is_link_placeholder'] and newrow['n_children'] > 0:
 			# Re-calc links to children, might result in this this page being deleted fully
 			# if children no longer resolve here due to new placeholder status
-			self._recursive_flag_links_for_update(newrow)
+			self._flag_section_links_for_update(newrow)
 		else:
 			pass
 
-	def _recursive_flag_links_for_update(self, row):
+	def _flag_section_links_for_update(self, row):
+		# Only floating links that are anchored at this page depend on
+		# its placeholder status, absolute and relative links to the
+		# children still resolve the same
 		self.db.execute(
-			'UPDATE links SET needscheck=1, target=? WHERE target=?',
-			(ROOT_ID, row['id'],)
+			'UPDATE links SET needscheck=1, target=? '
+			'WHERE rel=? and anchorkey=? and target IN ('
+			'	SELECT descendant FROM pages_closure WHERE ancestor=?'
+			')',
+			(ROOT_ID, HREF_REL_FLOATING, row['sortkey'], row['id'])
 		) # Need to link somewhere, if target is gone, use ROOT instead
-		for child in self.db.execute(
-			'SELECT * FROM pages WHERE parent=?',
-			(row['id'],)
-		).fetchall():
-			self._recursive_flag_links_for_update(child) # recurs
 
 	def on_page_row_deleted(self, o, row):
 		# Drop all outgoing links, flag incoming links to be checked.
 		# Check could result in page being re-created as placeholder
 		# at end of db update.
+		self.link_cache.invalidate(row['sortkey'])
 		self.db.execute(
 			'DELETE FROM links WHERE source=?',
 			(row['id'],)
@@ -155,6 +201,30 @@ class LinksIndexer(IndexerBase):
 			(ROOT_ID, row['id'],)
 		) # Need to link somewhere, if target is gone, use ROOT instead
 
+	def on_page_row_moved(self, o, row, oldrow):
+		# Links from and to the moved pages need to be resolved again.
+		# Links to the old names will result in placeholders, like
+		# when the pages were deleted. Also check floating links that
+		# may now resolve to one of the moved pages.
+		self.link_cache.clear()
+		if HAVE_RECURSIVE_CTE:
+			self.db.execute(
+				SECTION_CTE +
+				'UPDATE links SET needscheck=1 '
+				'WHERE source IN section OR target IN section OR ('
+				'	rel=? and anchorkey IN (SELECT sortkey FROM pages WHERE id IN section) '
+				'	and target IN (SELECT id FROM pages WHERE is_link_placeholder=1)'
+				')',
+				(row['id'], HREF_REL_FLOATING)
+			)
+		else:
+			for child in [PageIndexRecord(row)] + list(self._pages.walk(row['id'])):
+				self.db.execute(
+					'UPDATE links SET needscheck=1 WHERE source=? or target=?',
+					(child.id, child.id)
+				)
+				self.on_page_row_inserted(o, child._row)
+
 	def is_uptodate(self):
 		row = self.db.execute(
 			'SELECT * FROM links WHERE needscheck=1 '
@@ -171,6 +241,25 @@ class LinksIndexer(IndexerBase):
 			self.on_page_row_deleted(None, row)
 			yield
 
+		# Absolute and relative links resolve to the page with the
+		# exact name if it exists, resolve these in a single query
+		self.db.execute(
+			'UPDATE links SET needscheck=0, target=('
+			'	SELECT id FROM pages WHERE name=links.names'
+			') WHERE needscheck=1 and rel=? and links.names IN (SELECT name FROM pages)',
+			(HREF_REL_ABSOLUTE,)
+		)
+		self.db.execute(
+			'UPDATE links SET needscheck=0, target=('
+			'	SELECT t.id FROM pages AS s, pages AS t '
+			'	WHERE s.id=links.source and t.name=s.name || \':\' || links.names'
+			') WHERE needscheck=1 and rel=? and source<>? and ('
+			'	SELECT t.id FROM pages AS s, pages AS t '
+			'	WHERE s.id=links.source and t.name=s.name || \':\' || links.names'
+			') IS NOT NULL',
+			(HREF_REL_RELATIVE, ROOT_ID)
+		)
+
 		# Check total
 		n, = self.db.execute('SELECT COUNT(*) FROM links WHERE needscheck=1').fetchone()
 
@@ -208,8 +297,32 @@ class LinksIndexer(IndexerBase):
 			# Without this guard function we would need to iterate several times
 			# through this cleanup function.
 
+		logger.debug('Link resolution cache: %i hits, %i misses',
+			self.link_cache.hits, self.link_cache.misses)
 		self.db.commit()
 
+	def check_integrity(self):
+		problems = []
+		n, = self.db.execute(
+			'SELECT count(*) FROM links WHERE source NOT IN (SELECT id FROM pages)'
+		).fetchone()
+		if n:
+			problems.append(IndexInconsistency('links', '', '%i links from pages that do not exist' % n))
+		for name, in self.db.execute(
+			'SELECT DISTINCT pages.name FROM links JOIN pages ON links.source = pages.id '
+			'WHERE links.target NOT IN (SELECT id FROM pages)'
+		):
+			problems.append(IndexInconsistency('links', name, 'links to pages that do not exist'))
+		return problems
+
+	def repair_integrity(self):
+		self.db.execute('DELETE FROM links WHERE source NOT IN (SELECT id FROM pages)')
+		self.db.execute(
+			'UPDATE links SET needscheck=1, target=? '
+			'WHERE target NOT IN (SELECT id FROM pages)',
+			(ROOT_ID,)
+		)
+
 	def _allow_cleanup(self, row):
 		c, = self.db.execute(
 			'SELECT COUNT(*) FROM links WHERE target=?', (row['id'],)
@@ -300,8 +413,38 @@ class LinksView(IndexView):
 		return self._list_links_section(page_id, pagename, direction)
 
 	def _list_links_section(self, page_id, pagename, direction):
-		# Can be optimized with WITH clause, but not supported sqlite < 3.8.4
+		if not HAVE_RECURSIVE_CTE:
+			return self._list_links_section_recursive(page_id, pagename, direction)
+
+		# Links are listed per page in the section, so a link between two
+		# pages in the section shows up twice for LINK_DIR_BOTH
+		forward = (
+			'SELECT DISTINCT s.name, t.name FROM links '
+			'JOIN section ON links.source = section.id '
+			'JOIN pages AS s ON links.source = s.id '
+			'JOIN pages AS t ON links.target = t.id'
+		)
+		backward = (
+			'SELECT DISTINCT s.name, t.name FROM links '
+			'JOIN section ON links.target = section.id '
+			'JOIN pages AS s ON links.source = s.id '
+			'JOIN pages AS t ON links.target = t.id '
+			'WHERE links.source <> ?' # hack used to create placeholders
+		)
+		if direction == LINK_DIR_FORWARD:
+			c = self.db.execute(SECTION_CTE + forward, (page_id,))
+		elif direction == LINK_DIR_BOTH:
+			c = self.db.execute(
+				SECTION_CTE + forward + ' UNION ALL ' + backward + ' AND links.source <> links.target',
+				(page_id, ROOT_ID)
+			)
+		else:
+			c = self.db.execute(SECTION_CTE + backward, (page_id, ROOT_ID))
 
+		for source, target in c:
+			yield IndexLink(Path(source), Path(target))
+
+	def _list_links_section_recursive(self, page_id, pagename, direction):
 		for link in self._list_links(page_id, pagename, direction):
 			yield link
 
@@ -310,8 +453,27 @@ class LinksView(IndexView):
 				yield link
 
 	def n_list_links_section(self, pagename, direction=LINK_DIR_FORWARD):
-		# Can be optimized with WITH clause, but not supported sqlite < 3.8.4
 		page_id = self._pages.get_page_id(pagename)
+		if not HAVE_RECURSIVE_CTE:
+			return self._n_list_links_section_recursive(page_id, direction)
+
+		forward = 'SELECT count(*) FROM links WHERE source IN section'
+		backward = 'SELECT count(*) FROM links WHERE target IN section and source<>?'
+			# Excluding root here because linking from root
+			# is used as a hack to create placeholders
+		if direction == LINK_DIR_FORWARD:
+			c = self.db.execute(SECTION_CTE + forward, (page_id,))
+		elif direction == LINK_DIR_BOTH:
+			c = self.db.execute(
+				SECTION_CTE + 'SELECT (' + forward + '), (' + backward + ' and source<>target)',
+				(page_id, ROOT_ID)
+			)
+		else:
+			c = self.db.execute(SECTION_CTE + backward, (page_id, ROOT_ID))
+
+		return sum(c.fetchone())
+
+	def _n_list_links_section_recursive(self, page_id, direction):
 		n = self._n_list_links(page_id, direction)
 		for child in self._pages.walk(page_id):
 			n += self._n_list_links(child.id, direction)
@@ -4,7 +4,10 @@
 
 from datetime import datetime
 from typing import Generator, Optional
+from array import array
+from bisect import bisect_left
 
+import zlib
 import sqlite3
 import logging
 
@@ -26,11 +29,29 @@ ROOT_PATH = Path(':')
 ROOT_ID = 1 # Constant for the ID of the root namespace in "pages"
 			# (Primary key starts count at 1 and first entry will be root)
 
+HAVE_RECURSIVE_CTE = sqlite3.sqlite_version_info >= (3, 8, 3)
+	# Recursive "WITH" clause is used to walk the page tree in a single query,
+	# for older sqlite versions we fall back to one query per page
+
 PAGE_EXISTS_UNCERTAIN = 0 # e.g. folder with unknown children - not shown to outside world
 PAGE_EXISTS_AS_LINK = 1 # placeholder for link target
 PAGE_EXISTS_HAS_CONTENT = 2 # either has content or children have content
 
 
+def compress_text(text):
+	'''Compress page text for the "pages_text" table
+	@param text: the text as given by L{ParseTree.get_search_text()}
+	@returns: a C{bytes} object
+	'''
+	return zlib.compress(text.encode('UTF-8'), 1)
+		# fastest level, the text is written for every page that is indexed
+
+
+def decompress_text(data):
+	'''Inverse of L{compress_text()}'''
+	return zlib.decompress(data).decode('UTF-8')
+
+
 def emptyParseTree():
 	b = ParseTreeBuilder()
 	b.start('zim-tree')
@@ -46,7 +67,19 @@ class PagesIndexer(IndexerBase):
 	@signal: C{page-row-delete (row)}: row to be deleted
 	@signal: C{page-row-deleted (row)}: row that has been deleted
 
+	@signal: C{page-row-move (row)}: row to be moved
+	@signal: C{page-row-detached (row)}: row that is being moved has been
+	removed from its old parent
+	@signal: C{page-row-moved (row, oldrow)}: row has been moved, including
+	all children
+
 	@signal: C{page-changed (row, content)}: page contents changed
+
+	The content digest of page source files is stored in the "files"
+	table. When a file has a new mtime, but the content did not change,
+	the page is not updated. E.g. after a version control checkout or a
+	backup restore. The attribute C{n_unchanged} counts the files for
+	which this happened.
 	'''
 
 	__signals__ = {
@@ -54,12 +87,24 @@ class PagesIndexer(IndexerBase):
 		'page-row-changed': (None, None, (object, object)),
 		'page-row-delete': (None, None, (object,)),
 		'page-row-deleted': (None, None, (object,)),
+		'page-row-move': (None, None, (object,)),
+		'page-row-detached': (None, None, (object,)),
+		'page-row-moved': (None, None, (object, object)),
 		'page-changed': (None, None, (object, object))
 	}
 
+	DEFERRED_INDEXES = '''
+		CREATE UNIQUE INDEX IF NOT EXISTS pages_name ON pages(name);
+		CREATE INDEX IF NOT EXISTS pages_sortkey ON pages(sortkey);
+		CREATE INDEX IF NOT EXISTS pages_name_nocase ON pages(name COLLATE NOCASE);
+	''' # not needed while inserting pages, created after a bulk update
+
 	def __init__(self, db, layout, filesindexer):
 		IndexerBase.__init__(self, db)
 		self.layout = layout
+		self.parallel_parser = None # set by IndexUpdateIter for parallel updates
+		self.parse_cache = None # set by Index if the notebook has a parse cache
+		self.n_unchanged = 0
 		self.connectto_all(filesindexer, (
 			'file-row-inserted', 'file-row-changed', 'file-row-deleted'
 		))
@@ -80,10 +125,22 @@ class PagesIndexer(IndexerBase):
 
 				CONSTRAINT no_self_ref CHECK (parent <> id)
 			);
-			CREATE UNIQUE INDEX IF NOT EXISTS pages_name ON pages(name);
-			CREATE INDEX IF NOT EXISTS pages_sortkey ON pages(sortkey);
 			CREATE INDEX IF NOT EXISTS pages_parent ON pages(parent);
+
+			CREATE TABLE IF NOT EXISTS pages_closure(
+				ancestor INTEGER REFERENCES pages(id),
+				descendant INTEGER REFERENCES pages(id),
+				depth INTEGER NOT NULL,
+				PRIMARY KEY (ancestor, descendant)
+			) WITHOUT ROWID;
+			CREATE INDEX IF NOT EXISTS pages_closure_descendant ON pages_closure(descendant);
+
+			CREATE TABLE IF NOT EXISTS pages_text(
+				id INTEGER PRIMARY KEY REFERENCES pages(id),
+				text BLOB
+			);
 		''')
+		self.db.executescript(self.DEFERRED_INDEXES)
 		row = self.db.execute('SELECT * FROM pages WHERE id == 1').fetchone()
 		if row is None:
 			c = self.db.execute(
@@ -92,6 +149,22 @@ class PagesIndexer(IndexerBase):
 				(0, '', '', '', 1)
 			)
 			assert c.lastrowid == 1 # ensure we start empty
+			self.db.execute(
+				'INSERT INTO pages_closure(ancestor, descendant, depth) VALUES (?, ?, ?)',
+				(ROOT_ID, ROOT_ID, 0)
+			)
+
+	def start_bulk_update(self):
+		# Lookups by name use the index of the "UNIQUE" constraint,
+		# so these indexes are only overhead while inserting
+		self.db.executescript('''
+			DROP INDEX IF EXISTS pages_name;
+			DROP INDEX IF EXISTS pages_sortkey;
+			DROP INDEX IF EXISTS pages_name_nocase;
+		''')
+
+	def end_bulk_update(self):
+		self.db.executescript(self.DEFERRED_INDEXES)
 
 	def _select(self, pagename):
 		return self.db.execute(
@@ -138,11 +211,46 @@ class PagesIndexer(IndexerBase):
 			file = self.layout.root.file(filerow['path'])
 			format = self.layout.get_format(file)
 			mtime = file.mtime()
-			tree = format.Parser().parse(file.read(), file_input=True)
-			self.update_page(pagename, mtime, tree)
+			tree, etag = self._get_parsetree(filerow, file, format, mtime)
+			if tree is None:
+				logger.debug('File content did not change: %s', file)
+				self.n_unchanged += 1
+			else:
+				self.update_page(pagename, mtime, tree)
+			self.db.execute(
+				'UPDATE files SET digest = ? WHERE id = ?',
+				(etag[1], filerow['id'])
+			)
 		else:
 			pass # some conflict file changed
 
+	def _get_parsetree(self, filerow, file, format, mtime):
+		# Returns the parse tree and the etag of the file content, the
+		# parse tree is None if the content digest matches the digest
+		# in "filerow". The digest is taken from the content that is read
+		# for parsing, so the file is read at most once.
+		if self.parse_cache is not None:
+			result = self.parse_cache.lookup(file, format)
+			if result is not None:
+				tree, etag = result
+				return (None if etag[1] == filerow['digest'] else tree), etag
+
+		tree = None
+		if self.parallel_parser is not None:
+			tree, etag = self.parallel_parser.get_parsetree(filerow, mtime)
+			if tree is not None and etag[1] == filerow['digest']:
+				return None, etag
+		if tree is None:
+			text, etag = file.read_with_etag()
+			if etag[1] == filerow['digest']:
+				return None, etag
+			tree = format.Parser().parse(text, file_input=True)
+
+		if self.parse_cache is not None:
+			self.parse_cache.store(file, format, etag, tree)
+
+		return tree, etag
+
 	def on_file_row_deleted(self, o, filerow):
 		pagename, file_type = self.layout.map_filepath(filerow['path'])
 		if file_type != FILE_TYPE_PAGE_SOURCE:
@@ -162,6 +270,7 @@ class PagesIndexer(IndexerBase):
 					# checks if any children have sources - else will be removed
 				try:
 					row = self._select(pagename)
+					self.db.execute('DELETE FROM pages_text WHERE id=?', (row['id'],))
 					self.emit('page-changed', row, emptyParseTree())
 				except IndexNotFoundError:
 					pass
@@ -216,6 +325,7 @@ class PagesIndexer(IndexerBase):
 			row = self._select(pagename)
 		else:
 			row = self._select(pagename)
+			self._insert_closure(row['id'], parent_row['id'])
 			self._update_parent_nchildren(pagename.parent)
 			self.emit('page-row-inserted', row)
 
@@ -267,6 +377,10 @@ class PagesIndexer(IndexerBase):
 		)
 
 		row = self._select(pagename)
+		self.db.execute(
+			'INSERT OR REPLACE INTO pages_text(id, text) VALUES (?, ?)',
+			(row['id'], compress_text(content.get_search_text()))
+		)
 		self.emit('page-changed', row, content)
 		self.emit('page-row-changed', row, row)
 
@@ -280,10 +394,201 @@ class PagesIndexer(IndexerBase):
 
 		self.emit('page-row-delete', row)
 		self.db.execute('DELETE FROM pages WHERE name=?', (pagename.name,))
+		self.db.execute('DELETE FROM pages_closure WHERE descendant=?', (row['id'],))
+			# page has no children, so it is only a descendant of its parents
+		self.db.execute('DELETE FROM pages_text WHERE id=?', (row['id'],))
 		self._update_parent_nchildren(pagename.parent)
 		self.emit('page-row-deleted', row)
 		self.update_parent(pagename.parent, allow_cleanup)
 
+	def move_page(self, oldname, newname):
+		'''Move a page including all children to a new name. The rows
+		keep their ids, so data of other indexers for these pages is kept.
+		The new name can not exist yet, except as a link placeholder
+		without children.
+		@param oldname: the L{Path} of the page to move
+		@param newname: the new L{Path}
+		'''
+		assert not (newname == oldname or newname.ischild(oldname) or oldname.ischild(newname))
+		row = self._select(oldname)
+		assert row is not None and row['id'] != ROOT_ID
+
+		existing = self._select(newname)
+		if existing is not None:
+			assert existing['source_file'] is None and existing['n_children'] == 0
+			self.remove_page(newname, allow_cleanup=lambda r: False)
+
+		if self._select(newname.parent) is None:
+			self._insert_page(newname.parent, False)
+		parent_row = self._select(newname.parent)
+
+		# Detach the row first, to keep a consistent state for the
+		# tree models between the removal and the insert
+		self.emit('page-row-move', row)
+		self.db.execute('UPDATE pages SET parent=NULL WHERE id=?', (row['id'],))
+		self.db.execute(
+			'DELETE FROM pages_closure '
+			'WHERE descendant IN (SELECT descendant FROM pages_closure WHERE ancestor=?) '
+			'AND ancestor NOT IN (SELECT descendant FROM pages_closure WHERE ancestor=?)',
+			(row['id'], row['id'])
+		) # drop the paths from the old parents into the section
+		self._update_parent_nchildren(oldname.parent)
+		self.emit('page-row-detached', row)
+
+		self.db.execute(
+			'UPDATE pages SET name=?, lowerbasename=?, sortkey=?, parent=? WHERE id=?',
+			(newname.name, newname.basename.lower(), natural_sort_key(newname.basename), parent_row['id'], row['id'])
+		)
+		self.db.execute(
+			'UPDATE pages SET name = ? || substr(name, ?) '
+			'WHERE id IN (SELECT descendant FROM pages_closure WHERE ancestor=? AND depth>0)',
+			(newname.name, len(oldname.name) + 1, row['id'])
+		)
+		self.db.execute(
+			'INSERT INTO pages_closure(ancestor, descendant, depth) '
+			'SELECT p.ancestor, c.descendant, p.depth + c.depth + 1 '
+			'FROM pages_closure AS p, pages_closure AS c '
+			'WHERE p.descendant=? AND c.ancestor=?',
+			(parent_row['id'], row['id'])
+		) # connect all new parents to the section
+		self._update_parent_nchildren(newname.parent)
+		self.emit('page-row-moved', self._select(newname), row)
+
+		self.update_parent(oldname.parent)
+		self.update_parent(newname.parent)
+
+	def _insert_closure(self, page_id, parent_id):
+		# The "pages_closure" table has a row for each page and each of
+		# its parents, including the page itself at depth 0. This allows
+		# selecting all pages in a section with a single indexed query.
+		self.db.execute(
+			'INSERT INTO pages_closure(ancestor, descendant, depth) '
+			'SELECT ancestor, ?, depth + 1 FROM pages_closure WHERE descendant=? '
+			'UNION ALL SELECT ?, ?, 0',
+			(page_id, parent_id, page_id, page_id)
+		)
+
+	def check_integrity(self):
+		'''Check the "pages" table for inconsistencies, these are the
+		same checks as in L{TestPagesDBTable.assertPagesDBConsistent()}
+		@returns: a list of L{IndexInconsistency} objects
+		'''
+		problems = []
+		def add(sql, message, args=()):
+			for name, in self.db.execute(sql, args):
+				problems.append(IndexInconsistency('pages', name, message))
+
+		add(
+			'SELECT p.name FROM pages AS p LEFT JOIN pages AS c ON c.parent = p.id '
+			'GROUP BY p.id HAVING p.n_children <> count(c.id)',
+			'has wrong number of children'
+		)
+		add(
+			'SELECT p.name FROM pages AS p LEFT JOIN pages AS q ON p.parent = q.id '
+			'WHERE p.id > 1 AND q.id IS NULL',
+			'parent page missing'
+		)
+		add(
+			'SELECT name FROM pages WHERE source_file IS NOT NULL AND is_link_placeholder = 1',
+			'is a placeholder while it has a source file'
+		)
+		add(
+			'SELECT p.name FROM pages AS p WHERE p.id > 1 '
+			'AND p.source_file IS NULL AND p.is_link_placeholder = 0 '
+			'AND NOT EXISTS (SELECT id FROM pages WHERE parent = p.id AND is_link_placeholder = 0)',
+			'is not a placeholder while it has no source and no children with content'
+		)
+		add(
+			'SELECT p.name FROM pages AS p JOIN pages AS q ON p.parent = q.id '
+			'WHERE p.id > 1 AND q.id > 1 AND p.is_link_placeholder = 0 AND q.is_link_placeholder = 1',
+			'is not a placeholder while its parent is'
+		)
+		add(
+			'SELECT p.name FROM pages AS p LEFT JOIN files AS f ON p.source_file = f.id '
+			'WHERE p.id > 1 AND p.source_file IS NOT NULL AND f.id IS NULL',
+			'source file missing'
+		)
+		add(
+			'SELECT p.name FROM pages AS p JOIN pages AS q ON p.parent = q.id '
+			'WHERE p.id > 1 AND CASE WHEN q.id = 1 '
+			'	THEN instr(p.name, \':\') > 0 '
+			'	ELSE substr(p.name, 1, length(q.name) + 1) <> q.name || \':\' '
+			'	OR instr(substr(p.name, length(q.name) + 2), \':\') > 0 '
+			'END',
+			'name does not match parent page'
+		)
+		add(
+			'SELECT p.name FROM pages AS p LEFT JOIN pages_closure AS c ON c.descendant = p.id '
+			'GROUP BY p.id HAVING count(c.ancestor) <> CASE WHEN p.id = 1 THEN 1 '
+			'	ELSE length(p.name) - length(replace(p.name, \':\', \'\')) + 2 END '
+			'OR p.id > 1 AND NOT EXISTS ('
+			'	SELECT ancestor FROM pages_closure WHERE ancestor = p.parent AND descendant = p.id AND depth = 1'
+			')',
+			'has wrong ancestors in the closure table'
+		)
+		n, = self.db.execute(
+			'SELECT count(*) FROM pages_closure '
+			'WHERE ancestor NOT IN (SELECT id FROM pages) '
+			'OR descendant NOT IN (SELECT id FROM pages)'
+		).fetchone()
+		if n:
+			problems.append(IndexInconsistency('pages_closure', '', '%i rows for pages that do not exist' % n))
+		n, = self.db.execute(
+			'SELECT count(*) FROM pages_text '
+			'WHERE id NOT IN (SELECT id FROM pages WHERE source_file IS NOT NULL)'
+		).fetchone()
+		if n:
+			problems.append(IndexInconsistency('pages_text', '', '%i rows for pages that have no content' % n))
+
+		return problems
+
+	def repair_integrity(self):
+		self.db.execute(
+			'DELETE FROM pages_closure '
+			'WHERE ancestor NOT IN (SELECT id FROM pages) '
+			'OR descendant NOT IN (SELECT id FROM pages)'
+		)
+		self.db.execute(
+			'DELETE FROM pages_text '
+			'WHERE id NOT IN (SELECT id FROM pages WHERE source_file IS NOT NULL)'
+		)
+		self.db.execute(
+			'INSERT OR IGNORE INTO pages_closure(ancestor, descendant, depth) VALUES (?, ?, ?)',
+			(ROOT_ID, ROOT_ID, 0)
+		)
+		self._update_parent_nchildren(ROOT_PATH)
+
+	def repair_section(self, pagename):
+		'''Drop the rows for a page and all its children, the rows are
+		selected by name, so this does not depend on the parent relation
+		being consistent. Other indexers drop their data for these pages
+		in response to the signals. The pages are inserted again when
+		their source files are indexed.
+		@param pagename: a L{Path}
+		'''
+		assert not pagename.isroot, 'BUG: can\'t repair notebook root'
+		for row in self.db.execute(
+			'SELECT * FROM pages WHERE name = ? OR substr(name, 1, ?) = ? '
+			'ORDER BY length(name) DESC',
+			(pagename.name, len(pagename.name) + 1, pagename.name + ':')
+		).fetchall():
+			logger.debug('Drop for repair: %s', row['name'])
+			self.emit('page-row-delete', row)
+			self.db.execute('DELETE FROM pages WHERE id = ?', (row['id'],))
+			self.db.execute(
+				'DELETE FROM pages_closure WHERE ancestor = ? OR descendant = ?',
+				(row['id'], row['id'])
+			)
+			self.db.execute('DELETE FROM pages_text WHERE id = ?', (row['id'],))
+			self.emit('page-row-deleted', row)
+
+		parent = pagename.parent
+		while self._select(parent) is None:
+			parent = parent.parent
+		self._update_parent_nchildren(parent)
+		if not parent.isroot:
+			self.update_parent(parent)
+
 	def _update_parent_nchildren(self, parentname):
 		# parent n_children needs to be up-to-date when we emit the "deleted"
 		# signal, else Gtk.TreeView sees an inconsistency
@@ -337,13 +642,59 @@ class PageIndexRecord(Path):
 		return not self._row['is_link_placeholder']
 
 
+class LinkResolutionCache(object):
+	'''Cache for the results of L{PagesViewInternal.resolve_link()}
+
+	Entries are keyed by the namespace of the source page and the link,
+	so links with the same text from pages in the same namespace share
+	an entry. For each entry the sortkeys of the names that were looked
+	up are recorded, the owner must call L{invalidate()} with the sortkey
+	of each page row that is inserted or deleted, or that changes its
+	placeholder status.
+
+	@ivar hits: number of links resolved from the cache
+	@ivar misses: number of links that needed to be resolved
+	'''
+
+	def __init__(self):
+		self._results = {}
+		self._keys_by_sortkey = {}
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		try:
+			result = self._results[key]
+		except KeyError:
+			self.misses += 1
+			return None
+		else:
+			self.hits += 1
+			return result
+
+	def set(self, key, sortkeys, result):
+		self._results[key] = result
+		for sortkey in sortkeys:
+			self._keys_by_sortkey.setdefault(sortkey, set()).add(key)
+
+	def invalidate(self, sortkey):
+		'''Drop all entries that depend on pages with C{sortkey}'''
+		for key in self._keys_by_sortkey.pop(sortkey, ()):
+			self._results.pop(key, None)
+
+	def clear(self):
+		self._results.clear()
+		self._keys_by_sortkey.clear()
+
+
 class PagesViewInternal(object):
 	'''This class defines private methods used by L{PagesView},
 	L{LinksView}, L{TagsView} and others.
 	'''
 
-	def __init__(self, db):
+	def __init__(self, db, link_cache=None):
 		self.db = db
+		self.link_cache = link_cache
 
 	def get_pagename(self, page_id):
 		row = self.db.execute(
@@ -362,9 +713,47 @@ class PagesViewInternal(object):
 		return row['id']
 
 	def resolve_link(self, source, href, ignore_link_placeholders=True, source_id=None):
+		if self.link_cache is not None:
+			key, sortkeys, source_id = self._link_cache_key(source, href, ignore_link_placeholders, source_id)
+			if key is not None:
+				result = self.link_cache.get(key)
+				if result is None:
+					parent, parent_id, names = self._resolve_link(source, href, ignore_link_placeholders, source_id)
+					result = self.resolve_pagename(parent, names)
+					self.link_cache.set(key, sortkeys, result)
+				return result
+
 		parent, parent_id, names = self._resolve_link(source, href, ignore_link_placeholders, source_id)
 		return self.resolve_pagename(parent, names)
 
+	def _link_cache_key(self, source, href, ignore_link_placeholders, source_id):
+		# Returns the key for the link cache, the sortkeys of the names
+		# the result depends on and the source id. The key is None when
+		# the result can not be cached.
+		parts = href.parts()
+		if not parts:
+			return None, None, source_id # link to anchor on source page
+
+		sortkeys = set(map(natural_sort_key, parts))
+		if href.rel == HREF_REL_ABSOLUTE or source.isroot:
+			namespace = None
+		elif href.rel == HREF_REL_RELATIVE:
+			# Resolves from the source, or its nearest existing parent
+			namespace = source.name
+			sortkeys.update(map(natural_sort_key, source.parts))
+		else:
+			# Floating links from existing pages only depend on the
+			# namespace of the source, other sources are not cached
+			if source_id is None:
+				try:
+					source_id = self.get_page_id(source)
+				except IndexNotFoundError:
+					return None, None, None
+			namespace = source.parent.name
+
+		key = (namespace, href.rel, href.names, ignore_link_placeholders)
+		return key, sortkeys, source_id
+
 	def _resolve_link(self, source, href, ignore_link_placeholders=True, source_id=None):
 		if href.rel == HREF_REL_ABSOLUTE or source.isroot:
 			return (ROOT_PATH, ROOT_ID, href.parts())
@@ -488,8 +877,27 @@ class PagesViewInternal(object):
 			return page_id, pagename
 
 	def walk(self, parent_id):
-		# Need to do this recursive to preserve sorting
-		#              else we could just do "name LIKE parent%"
+		if not HAVE_RECURSIVE_CTE:
+			return self._walk_recursive(parent_id)
+
+		return (PageIndexRecord(row) for row in self._walk_cte(parent_id))
+
+	def _walk_cte(self, parent_id):
+		# Need to walk the tree to preserve sorting, else we could just
+		# do "name LIKE parent%". Ordering the queue by "level DESC" makes
+		# the recursion depth first, children are ordered by sortkey.
+		return self.db.execute(
+			'WITH RECURSIVE tree AS ('
+			'	SELECT *, 1 AS level FROM pages WHERE parent=? '
+			'	UNION ALL '
+			'	SELECT pages.*, tree.level + 1 FROM pages '
+			'	JOIN tree ON pages.parent = tree.id '
+			'	ORDER BY level DESC, sortkey, name'
+			') SELECT * FROM tree',
+			(parent_id,)
+		)
+
+	def _walk_recursive(self, parent_id):
 		for row in self.db.execute(
 			'SELECT * FROM pages WHERE parent=? '
 			'ORDER BY sortkey, name',
@@ -497,17 +905,35 @@ class PagesViewInternal(object):
 		):
 			yield PageIndexRecord(row)
 			if row['n_children'] > 0:
-				for child in self.walk(row['id']): # recurs
+				for child in self._walk_recursive(row['id']): # recurs
 					yield child
 
 	def walk_bottomup(self, parent_id):
+		if not HAVE_RECURSIVE_CTE:
+			return self._walk_bottomup_recursive(parent_id)
+
+		return self._walk_bottomup_cte(parent_id)
+
+	def _walk_bottomup_cte(self, parent_id):
+		# Walk the tree depth first and hold back each page until
+		# all its children have been yielded
+		stack = []
+		for row in self._walk_cte(parent_id):
+			while stack and stack[-1]['level'] >= row['level']:
+				yield PageIndexRecord(stack.pop())
+			stack.append(row)
+
+		while stack:
+			yield PageIndexRecord(stack.pop())
+
+	def _walk_bottomup_recursive(self, parent_id):
 		for row in self.db.execute(
 			'SELECT * FROM pages WHERE parent=? '
 			'ORDER BY sortkey, name',
 			(parent_id,)
 		):
 			if row['n_children'] > 0:
-				for child in self.walk_bottomup(row['id']): # recurs
+				for child in self._walk_bottomup_recursive(row['id']): # recurs
 					yield child
 			yield PageIndexRecord(row)
 
@@ -602,6 +1028,70 @@ class PagesView(IndexView):
 		for row in self.db.execute(" ".join(query_fragments), query_parameters):
 			yield PageIndexRecord(row)
 
+	def match_names(self, patterns: list, regex=None, inverse: bool = False) -> Generator[PageIndexRecord, None, None]:
+		'''Generator for all pages with a name that matches any of the
+		given patterns, in no particular order
+
+		The patterns are SQL "LIKE" patterns, which are case-insensitive
+		for ASCII only and use "\\" as escape character. A prefix pattern
+		like "Foo:%" is resolved using the "pages_name_nocase" index.
+		Because the patterns can not express all case-insensitive
+		matches for unicode, they can be a superset and C{regex} can
+		be used to check the exact match on the page name.
+
+		@param patterns: a list of "LIKE" patterns
+		@param regex: optional regular expression to filter the names
+		@param inverse: if C{True} yield all pages that do I{not} match
+		@returns: yields L{PageIndexRecord} objects
+		'''
+		if not patterns:
+			where = '0'
+		else:
+			where = ' OR '.join(["name LIKE ? ESCAPE '\\'"] * len(patterns))
+
+		for row in self.db.execute(
+			'SELECT * FROM pages WHERE id<>? AND (%s)' % where,
+			(ROOT_ID,) + tuple(patterns)
+		):
+			if bool(regex is None or regex.match(row['name'])) != inverse:
+				yield PageIndexRecord(row)
+
+		if inverse:
+			for row in self.db.execute(
+				'SELECT * FROM pages WHERE id<>? AND NOT (%s)' % where,
+				(ROOT_ID,) + tuple(patterns)
+			):
+				yield PageIndexRecord(row)
+
+	def iter_text(self, paths: Optional[list] = None) -> Generator[tuple, None, None]:
+		'''Generator for the text of pages as stored by the indexer, this
+		allows searching page content without reading and parsing the
+		source files. See L{ParseTree.get_search_text()} for the format.
+		Pages without source file are skipped, in no particular order.
+
+		@param paths: an optional list of L{Path} objects, if C{None}
+		all pages are listed
+		@returns: yields 2-tuples of a L{Path} and the text, the text is
+		C{None} for pages that have a source file but were not yet indexed
+		'''
+		sql = 'SELECT pages.name, pages_text.text FROM pages ' \
+			'LEFT JOIN pages_text ON pages.id = pages_text.id ' \
+			'WHERE pages.id<>%i AND pages.source_file IS NOT NULL' % ROOT_ID
+		if paths is None:
+			cursors = [self.db.execute(sql)]
+		else:
+			names = [p.name for p in paths]
+			cursors = (
+				self.db.execute(
+					sql + ' AND pages.name IN (%s)' % ','.join('?' * len(batch)),
+					batch
+				) for batch in (names[i:i+500] for i in range(0, len(names), 500))
+			) # stay below the maximum number of sql variables
+
+		for cursor in cursors:
+			for name, data in cursor:
+				yield Path(name), (decompress_text(data) if data is not None else None)
+
 	def walk(self, path: Optional[Path] = None) -> Generator[PageIndexRecord, None, None]:
 		'''Generator function to yield all pages in the index, depth
 		first
@@ -612,8 +1102,6 @@ class PagesView(IndexView):
 		@returns: an iterator that yields L{Path} objects
 		@raises IndexNotFoundError: if C{path} does not exist in the index
 		'''
-		# Need to do this recursive to preserve sorting
-		#              else we could just do "name LIKE parent%"
 		page_id = self._pages.get_page_id(path) if path else ROOT_ID # can raise
 		return self._pages.walk(page_id)
 
@@ -621,6 +1109,47 @@ class PagesView(IndexView):
 		page_id = self._pages.get_page_id(path) if path else ROOT_ID # can raise
 		return self._pages.walk_bottomup(page_id)
 
+	def list_descendants(self, path: Optional[Path] = None, depth: Optional[int] = None) -> Generator[PageIndexRecord, None, None]:
+		'''Generator for all pages below C{path}, unlike L{walk()} the
+		pages are not yielded in tree order but sorted by name
+		@param path: a L{Path} object, defaults to the root path
+		@param depth: optional maximum depth below C{path}, e.g. a
+		depth of 1 gives only the direct children
+		@returns: yields L{PageIndexRecord} objects
+		@raises IndexNotFoundError: if C{path} is not found in the index
+		'''
+		page_id = self._pages.get_page_id(path) if path else ROOT_ID # can raise
+		if depth is None:
+			c = self.db.execute(
+				'SELECT pages.* FROM pages_closure '
+				'JOIN pages ON pages_closure.descendant = pages.id '
+				'WHERE pages_closure.ancestor=? AND pages_closure.depth>0 '
+				'ORDER BY pages.name',
+				(page_id,)
+			)
+		else:
+			c = self.db.execute(
+				'SELECT pages.* FROM pages_closure '
+				'JOIN pages ON pages_closure.descendant = pages.id '
+				'WHERE pages_closure.ancestor=? AND pages_closure.depth BETWEEN 1 AND ? '
+				'ORDER BY pages.name',
+				(page_id, depth)
+			)
+		for row in c:
+			yield PageIndexRecord(row)
+
+	def n_descendants(self, path: Optional[Path] = None) -> int:
+		'''@returns: number of pages below C{path}, at any depth
+		@param path: optional, defaults to root path
+		@raises IndexNotFoundError: if C{path} is not found in the index
+		'''
+		page_id = self._pages.get_page_id(path) if path else ROOT_ID # can raise
+		c, = self.db.execute(
+			'SELECT COUNT(*) FROM pages_closure WHERE ancestor=? AND depth>0',
+			(page_id,)
+		).fetchone()
+		return c
+
 	def n_all_pages(self) -> int:
 		'''@returns: total number of pages in the index'''
 		c, = self.db.execute('SELECT COUNT(*) FROM pages').fetchone()
@@ -658,14 +1187,13 @@ class PagesView(IndexView):
 			raise ValueError('Can\'t use root')
 
 		r = self.db.execute(
-			'SELECT parent FROM pages WHERE name=?', (path.name,)
+			'SELECT parent, sortkey FROM pages WHERE name=?', (path.name,)
 		).fetchone()
 		if r is None:
 			raise IndexNotFoundError('No such page: %s' % path)
 		else:
-			parent_id = r[0]
+			parent_id, sortkey = r
 
-		sortkey = natural_sort_key(path.basename)
 		r = self.db.execute('''
 			SELECT * FROM pages WHERE parent=? and (
 				sortkey<? or (sortkey=? and name<?)
@@ -842,13 +1370,20 @@ IS_PAGE = 1 #: Hint for MyTreeIter
 class PagesTreeModelMixin(TreeModelMixinBase):
 
 	# Optimize lookup for finding records in the same level
+	# - keep for each parent the ordered ids of the children, so a
+	#   treepath maps to a record without "OFFSET" queries and a record
+	#   maps to a treepath with a binary search on (sortkey, name)
 	# - always cache parent, to retrieve other children more quickly
 	# - cache a range of 20 records at once
+	#
+	# The id arrays are kept in "_children" and are not dropped by
+	# "flush_cache()", instead they are updated by the row signals.
 
 	# Signals use "find_all" instead of "find" to allow for subclasses that
 	# have multiple entries, like models for tags
 
 	def __init__(self, index, root=None, reverse=False):
+		self._children = {} # parent id -> (array of ids, list of keys)
 		TreeModelMixinBase.__init__(self, index)
 		self._REVERSE = reverse
 		if root is None:
@@ -869,12 +1404,15 @@ class PagesTreeModelMixin(TreeModelMixinBase):
 		self._MY_ROOT_ID = myrow['id'] if myrow else None
 
 	def connect_to_updateiter(self, index, update_iter):
+		self._children.clear()
 		self.connectto_all(update_iter.pages,
-			('page-row-inserted', 'page-row-changed', 'page-row-delete', 'page-row-deleted')
+			('page-row-inserted', 'page-row-changed', 'page-row-delete', 'page-row-deleted',
+			'page-row-move', 'page-row-detached', 'page-row-moved')
 		)
 
 	def on_page_row_inserted(self, o, row):
 		self.flush_cache()
+		self._insert_child(row)
 		if row['name'] == self._MY_ROOT_NAME:
 			self._set_root_id()
 		else:
@@ -906,6 +1444,7 @@ class PagesTreeModelMixin(TreeModelMixinBase):
 		# always deal with that.
 
 		self.flush_cache()
+		self._remove_child(row)
 		if row['name'] == self._MY_ROOT_NAME:
 			self._MY_ROOT_ID = None
 		else:
@@ -916,6 +1455,101 @@ class PagesTreeModelMixin(TreeModelMixinBase):
 
 		self._deleted_paths = None
 
+	# A moved page is handled as a delete followed by an insert. Only
+	# the top of the moved section needs signals, the view will query
+	# the children when needed.
+
+	def on_page_row_move(self, o, row):
+		self.on_page_row_delete(o, row)
+
+	def on_page_row_detached(self, o, row):
+		self.on_page_row_deleted(o, row)
+
+	def on_page_row_moved(self, o, row, oldrow):
+		self._children.clear() # names of all children changed
+		self.on_page_row_inserted(o, row)
+		if row['n_children'] > 0:
+			for treepath in self._find_all_pages(row['name']):
+				treeiter = self.get_iter(treepath) # not mytreeiter !
+				self.emit('row-has-child-toggled', treepath, treeiter)
+
+	def refresh(self, n_old):
+		self._children.clear()
+		if self._MY_ROOT_NAME:
+			self._set_root_id()
+
+		for i in reversed(range(n_old)):
+			self.emit('row-deleted', Gtk.TreePath((i,)))
+
+		for i in range(self.n_children_top()):
+			treepath = Gtk.TreePath((i,))
+			treeiter = self.get_iter(treepath) # not mytreeiter !
+			self.emit('row-inserted', treepath, treeiter)
+			if self.get_mytreeiter((i,)).n_children > 0:
+				self.emit('row-has-child-toggled', treepath, treeiter)
+
+	def _get_children(self, parent_id):
+		# Returns a 2-tuple of an array with the ids of the children of
+		# "parent_id" and a list with their sort keys, both in
+		# ascending order
+		try:
+			return self._children[parent_id]
+		except KeyError:
+			ids = array('q')
+			keys = []
+			for row in self.db.execute(
+				'SELECT id, sortkey, name FROM pages WHERE parent=? '
+				'ORDER BY sortkey ASC, name ASC',
+				(parent_id,)
+			):
+				ids.append(row['id'])
+				keys.append((row['sortkey'], row['name']))
+			self._children[parent_id] = (ids, keys)
+			return ids, keys
+
+	def _insert_child(self, row):
+		if row['parent'] not in self._children:
+			return # will be build including this row when needed
+
+		ids, keys = self._children[row['parent']]
+		key = (row['sortkey'], row['name'])
+		i = bisect_left(keys, key)
+		if i == len(ids) or ids[i] != row['id']:
+			ids.insert(i, row['id'])
+			keys.insert(i, key)
+
+	def _remove_child(self, row):
+		self._children.pop(row['id'], None)
+		if row['parent'] not in self._children:
+			return
+
+		ids, keys = self._children[row['parent']]
+		i = bisect_left(keys, (row['sortkey'], row['name']))
+		if i < len(ids) and ids[i] == row['id']:
+			del ids[i]
+			del keys[i]
+		else:
+			del self._children[row['parent']] # out of sync, re-build later
+
+	def _child_offset(self, parent_id, row):
+		# Returns the position of "row" below "parent_id" in the model
+		ids, keys = self._get_children(parent_id)
+		i = bisect_left(keys, (row['sortkey'], row['name']))
+		if i == len(ids) or ids[i] != row['id']:
+			# Out of sync with the table, or python sorts differently
+			# than sqlite for these keys - fall back to a linear search
+			del self._children[parent_id]
+			ids, keys = self._get_children(parent_id)
+			try:
+				i = ids.index(row['id'])
+			except ValueError:
+				raise IndexNotFoundError(row['name'])
+
+		if self._REVERSE:
+			return len(ids) - 1 - i
+		else:
+			return i
+
 	def n_children_top(self):
 		if self._MY_ROOT_ID is None:
 			return 0
@@ -946,23 +1580,25 @@ class PagesTreeModelMixin(TreeModelMixinBase):
 
 		# Now cache a slice at the target level
 		offset = treepath[-1]
-		if self._REVERSE:
-			rows = self.db.execute('''
-				SELECT * FROM pages WHERE parent=?
-				ORDER BY sortkey DESC, name DESC LIMIT 20 OFFSET ?
-				''',
-				(parent_id, offset)
-			)
+		ids, keys = self._get_children(parent_id)
+		if offset >= len(ids):
+			return None
+		elif self._REVERSE:
+			end = len(ids) - offset
+			chunk = ids[max(0, end - 20):end][::-1]
 		else:
-			rows = self.db.execute('''
-				SELECT * FROM pages WHERE parent=?
-				ORDER BY sortkey ASC, name ASC LIMIT 20 OFFSET ?
-				''',
-				(parent_id, offset)
+			chunk = ids[offset:offset + 20]
+
+		rows = dict(
+			(row['id'], row) for row in self.db.execute(
+				'SELECT * FROM pages WHERE id IN (%s)' % ','.join('?' * len(chunk)),
+				tuple(chunk)
 			)
-		for i, row in enumerate(rows):
+		)
+		for i, id in enumerate(chunk):
 			mytreepath = tuple(parentpath) + (offset + i,)
-			if mytreepath not in self.cache:
+			if id in rows and mytreepath not in self.cache:
+				row = rows[id]
 				self.cache[mytreepath] = MyTreeIter(
 					Gtk.TreePath(mytreepath),
 					row,
@@ -1017,24 +1653,7 @@ class PagesTreeModelMixin(TreeModelMixinBase):
 			if myrow is None:
 				raise IndexNotFoundError
 
-			sortkey = myrow['sortkey']
-			if self._REVERSE:
-				row = self.db.execute('''
-					SELECT COUNT(*) FROM pages
-					WHERE parent=? and (
-						sortkey>? or (sortkey=? and name>?)
-					)''',
-					(parent_id, sortkey, sortkey, name)
-				).fetchone()
-			else:
-				row = self.db.execute('''
-					SELECT COUNT(*) FROM pages
-					WHERE parent=? and (
-						sortkey<? or (sortkey=? and name<?)
-					)''',
-					(parent_id, sortkey, sortkey, name)
-				).fetchone()
-			treepath.append(row[0])
+			treepath.append(self._child_offset(parent_id, myrow))
 			parent_id = myrow['id']
 
 			if update_cache:
@@ -1094,6 +1713,17 @@ class TestPagesDBTable(object):
 						'Placeholder status for parent of %s is inconsistent' % row['name']
 					)
 
+		# Check closure table matches the parent relations
+		wanted = set()
+		parents = dict(db.execute('SELECT id, parent FROM pages'))
+		for id in parents:
+			ancestor, depth = id, 0
+			while ancestor in parents:
+				wanted.add((ancestor, id, depth))
+				ancestor, depth = parents[ancestor], depth + 1
+		in_db = set(tuple(r) for r in db.execute('SELECT ancestor, descendant, depth FROM pages_closure'))
+		self.assertEqual(in_db, wanted, 'Closure table inconsistent')
+
 	def assertPagesDBEquals(self, db, pages):
 		rows = db.execute('SELECT * FROM pages WHERE id>1').fetchall()
 		in_db = set(r['name'] for r in rows)
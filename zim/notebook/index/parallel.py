@@ -0,0 +1,170 @@
+
+'''This module contains helpers to read and parse page source files
+in a pool of worker processes while the index is being updated.
+
+Parsing wiki text is pure python and bound by a single CPU core. For
+large updates (e.g. "zim --index --flush") the L{ParallelPageParser}
+reads and parses files ahead of the L{PagesIndexer} in worker processes.
+The results are still applied to the database by a single writer, in
+the same order as the serial update, so the index content is identical.
+'''
+
+import os
+import logging
+import multiprocessing
+import collections
+
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger('zim.notebook.index')
+
+from zim.newfs import LocalFolder
+
+from .files import STATUS_NEED_UPDATE, TYPE_FILE
+
+
+PARALLEL_MIN_FILES = 50 #: Minimum number of files pending before starting a pool
+PREFETCH_PER_JOB = 8 #: Number of files parsed ahead per worker process
+
+
+def default_jobs():
+	'''Returns the default number of worker processes for index updates'''
+	return os.cpu_count() or 1
+
+
+def _parse_file_job(path, format_module):
+	# Runs in a worker process - must be a module level function
+	from zim.newfs import LocalFile
+	from zim.base.klasslookup import get_module
+
+	try:
+		file = LocalFile(path)
+		text, etag = file.read_with_etag()
+		format = get_module(format_module)
+		tree = format.Parser().parse(text, file_input=True)
+	except Exception:
+		# The serial code path parses the file again and handles the error
+		logger.exception('Error while parsing: %s', path)
+		return None, None
+	else:
+		return etag, tree
+
+
+class ParallelPageParser(object):
+	'''Reads and parses page source files ahead of the L{PagesIndexer}
+	in a pool of worker processes.
+
+	The parser looks ahead in the "files" table for files that are
+	flagged for update, in the same order as the L{FilesIndexer} will
+	process them. The L{PagesIndexer} asks for the result with
+	L{get_parsetree()} and falls back to parsing the file itself when
+	no (valid) result is available.
+
+	The pool is only started when enough files are pending, so small
+	updates do not pay the cost of starting worker processes.
+	'''
+
+	def __init__(self, db, layout, jobs):
+		'''Constructor
+		@param db: a C{sqlite3.Connection}
+		@param layout: a L{NotebookLayout} with a L{LocalFolder} as root
+		@param jobs: number of worker processes
+		'''
+		assert jobs > 1
+		self.db = db
+		self.layout = layout
+		self.jobs = jobs
+		self._pool = None
+		self._queue = collections.OrderedDict() # file id -> (path, future)
+		self._last_id = 0
+
+	@classmethod
+	def new_for_layout(cls, db, layout, jobs):
+		'''Returns a new L{ParallelPageParser} object or C{None} when
+		parallel parsing is not supported for this layout
+		'''
+		if jobs and jobs > 1 and isinstance(layout.root, LocalFolder):
+			return cls(db, layout, jobs)
+		else:
+			return None
+
+	def _start_pool(self):
+		logger.debug('Starting %i processes for parsing pages', self.jobs)
+		# Use "spawn" to not fork a process that may have gtk threads running
+		context = multiprocessing.get_context('spawn')
+		self._pool = ProcessPoolExecutor(self.jobs, mp_context=context)
+
+	def fill(self):
+		'''Queue files that are flagged for update for parsing in the
+		worker processes. Should be called in between steps of the
+		L{FilesIndexer} update.
+		'''
+		window = self.jobs * PREFETCH_PER_JOB
+		if len(self._queue) > window // 2:
+			return
+
+		rows = self.db.execute(
+			'SELECT id, path FROM files '
+			'WHERE index_status = ? AND node_type = ? AND id > ? '
+			'ORDER BY id LIMIT ?',
+			(STATUS_NEED_UPDATE, TYPE_FILE, self._last_id, max(window, PARALLEL_MIN_FILES))
+		).fetchall()
+
+		if self._pool is None:
+			if len(rows) < PARALLEL_MIN_FILES:
+				return # not worth it (yet)
+			else:
+				self._start_pool()
+
+		for file_id, path in rows[:window - len(self._queue)]:
+			self._last_id = file_id
+			if not path.endswith(self.layout.default_extension):
+				continue # not a page source - let the indexer decide for others
+			file = self.layout.root.file(path)
+			try:
+				format = self.layout.get_format(file)
+			except AssertionError:
+				continue
+			future = self._pool.submit(_parse_file_job, file.path, format.__name__)
+			self._queue[file_id] = (path, future)
+
+	def get_parsetree(self, filerow, mtime):
+		'''Get the parse tree for a file from the worker processes
+		@param filerow: the row for the file in the "files" table
+		@param mtime: the mtime of the file as seen by the indexer
+		@returns: a 2-tuple of a L{ParseTree} and the etag of the file
+		content, or C{(None, None)} if no result is available
+		'''
+		# Files before this one that were not asked for are skipped by
+		# the indexer, drop them. Rows are processed in order of id.
+		file_id = filerow['id']
+		while self._queue:
+			first_id = next(iter(self._queue))
+			if first_id < file_id:
+				path, future = self._queue.pop(first_id)
+				future.cancel()
+			else:
+				break
+
+		if file_id not in self._queue:
+			return None, None
+
+		path, future = self._queue.pop(file_id)
+		if path != filerow['path']:
+			future.cancel()
+			return None, None
+
+		etag, tree = future.result()
+		if tree is None or etag[0] != mtime:
+			return None, None # file changed in between, or error
+		else:
+			return tree, etag
+
+	def close(self):
+		'''Stop the worker processes'''
+		for path, future in self._queue.values():
+			future.cancel()
+		self._queue.clear()
+		if self._pool is not None:
+			self._pool.shutdown(wait=False)
+			self._pool = None
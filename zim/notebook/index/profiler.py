@@ -0,0 +1,190 @@
+
+'''This module implements a profiling mode for the index. It is enabled
+by setting the C{ZIM_PROFILE_INDEX} environment variable, or by the
+C{--profile-index} option for C{zim --index}.
+
+When enabled, the L{Index} uses a L{ProfiledConnection} for the
+database and all indexers are attached to an L{IndexProfiler}. This
+records the time spent in the C{update_iter()} method of each indexer
+and in each handler for the signals of the L{FilesIndexer} and
+L{PagesIndexer}, e.g. the C{page-changed} handlers. A report is
+printed when the process exits.
+'''
+
+import os
+import sys
+import time
+import sqlite3
+import logging
+
+logger = logging.getLogger('zim.notebook.index')
+
+
+PROFILE_ENV = 'ZIM_PROFILE_INDEX'
+
+
+def profiling_enabled():
+	'''Returns C{True} if the C{ZIM_PROFILE_INDEX} environment variable is set'''
+	return bool(os.environ.get(PROFILE_ENV))
+
+
+class ProfiledConnection(sqlite3.Connection):
+	'''Connection class that records the time used by each SQL
+	statement in an L{IndexProfiler}. Set the C{profiler} attribute
+	after construction.
+	'''
+
+	profiler = None
+
+	def execute(self, sql, *args):
+		start = time.perf_counter()
+		try:
+			return sqlite3.Connection.execute(self, sql, *args)
+		finally:
+			self.profiler.add_statement(sql, time.perf_counter() - start)
+
+	def executemany(self, sql, *args):
+		start = time.perf_counter()
+		try:
+			return sqlite3.Connection.executemany(self, sql, *args)
+		finally:
+			self.profiler.add_statement(sql, time.perf_counter() - start)
+
+	def executescript(self, sql):
+		start = time.perf_counter()
+		try:
+			return sqlite3.Connection.executescript(self, sql)
+		finally:
+			self.profiler.add_statement(sql, time.perf_counter() - start)
+
+
+class IndexProfiler(object):
+	'''Collects timing data for index updates
+
+	Time is recorded per indexer method, excluding the time spent in
+	nested calls that are timed themselves. E.g. the time for parsing
+	a page is counted for the C{PagesIndexer} while the handlers of
+	the C{page-changed} signal are counted for the respective indexers.
+
+	@ivar n_statements: number of SQL statements run, as seen by the
+	trace callback
+	@ivar n_pages: number of pages that were indexed
+	'''
+
+	def __init__(self):
+		self.start_time = time.perf_counter()
+		self.n_statements = 0
+		self.n_pages = 0
+		self._timings = {} # name -> [time, calls]
+		self._statements = {} # sql -> [time, calls, max]
+		self._stack = [] # time of timed children for each nested call
+
+	def attach_connection(self, db):
+		'''Start recording statements for a database connection
+		@param db: a L{ProfiledConnection}
+		'''
+		db.profiler = self
+		db.set_trace_callback(self._on_trace)
+
+	def _on_trace(self, sql):
+		self.n_statements += 1
+
+	def add_statement(self, sql, elapsed):
+		sql = ' '.join(sql.split())
+		record = self._statements.setdefault(sql, [0.0, 0, 0.0])
+		record[0] += elapsed
+		record[1] += 1
+		record[2] = max(record[2], elapsed)
+
+	def attach_indexer(self, indexer):
+		'''Time the C{update_iter()} method of an indexer and all signal
+		handlers that are connected to it after this call
+		@param indexer: an L{IndexerBase} object
+		'''
+		name = indexer.__class__.__name__ + '.update_iter'
+		orig_update_iter = indexer.update_iter
+
+		def update_iter():
+			my_iter = orig_update_iter()
+			while True:
+				try:
+					self._call(name, next, my_iter)
+				except StopIteration:
+					return
+				yield
+
+		indexer.update_iter = update_iter
+
+		if 'page-changed' in indexer.__signals__:
+			indexer.connect('page-changed', self._on_page_changed)
+
+		orig_connect = indexer._connect
+
+		def _connect(category, signal, callback):
+			return orig_connect(category, signal, self._wrap(callback))
+
+		indexer._connect = _connect
+
+	def _on_page_changed(self, *a):
+		self.n_pages += 1
+
+	def _wrap(self, callback):
+		if hasattr(callback, '__self__'):
+			name = callback.__self__.__class__.__name__ + '.' + callback.__name__
+		else:
+			name = getattr(callback, '__qualname__', repr(callback))
+
+		def wrapper(*args):
+			return self._call(name, callback, *args)
+
+		return wrapper
+
+	def _call(self, name, func, *args):
+		self._stack.append(0.0)
+		start = time.perf_counter()
+		try:
+			return func(*args)
+		finally:
+			elapsed = time.perf_counter() - start
+			children = self._stack.pop()
+			record = self._timings.setdefault(name, [0.0, 0])
+			record[0] += elapsed - children
+			record[1] += 1
+			if self._stack:
+				self._stack[-1] += elapsed
+
+	def report(self, n_statements=10):
+		'''Returns a report of the timing data
+		@param n_statements: number of slowest statements to include
+		@returns: a string
+		'''
+		total = time.perf_counter() - self.start_time
+		lines = [
+			'Index profile',
+			'Total time: %.2fs, %i pages indexed (%.1f pages/s), %i SQL statements' % (
+				total, self.n_pages, self.n_pages / total if total else 0, self.n_statements),
+			'',
+			'Time per indexer:',
+		]
+
+		indexers = {}
+		for name, (elapsed, calls) in self._timings.items():
+			indexer = name.split('.', 1)[0]
+			indexers.setdefault(indexer, []).append((elapsed, calls, name))
+
+		for indexer, records in sorted(indexers.items(), key=lambda i: -sum(r[0] for r in i[1])):
+			lines.append('  %-40s %9.3fs' % (indexer, sum(r[0] for r in records)))
+			for elapsed, calls, name in sorted(records, reverse=True):
+				lines.append('    %-38s %9.3fs %8i calls' % (name, elapsed, calls))
+
+		lines += ['', 'Slowest statements:']
+		records = sorted(self._statements.items(), key=lambda i: -i[1][0])
+		for sql, (elapsed, calls, maxtime) in records[:n_statements]:
+			if len(sql) > 100:
+				sql = sql[:97] + '...'
+			lines.append('  %9.3fs %8ix max %.3fs  %s' % (elapsed, calls, maxtime, sql))
+
+		return '\n'.join(lines) + '\n'
+
+	def print_report(self):
+		sys.stderr.write(self.report())
@@ -8,7 +8,7 @@ from zim.base.naturalsort import natural_sort_key
 from zim.signals import SIGNAL_NORMAL
 
 
-from .base import IndexerBase, IndexView, IndexNotFoundError
+from .base import IndexerBase, IndexView, IndexNotFoundError, IndexInconsistency
 from .pages import PagesViewInternal
 
 
@@ -87,6 +87,7 @@ class TagsIndexer(IndexerBase):
 		)
 
 		seen = set()
+		added = []
 		for name in doc.iter_tag_names():
 			sortkey = natural_sort_key(name)
 			if sortkey in seen:
@@ -111,11 +112,14 @@ class TagsIndexer(IndexerBase):
 					assert row
 					self.emit('tag-row-inserted', row)
 
-				self.db.execute(
-					'INSERT INTO tagsources(source, tag) VALUES (?, ?)',
-					(pagerow['id'], row['id'])
-				)
-				self.emit('tag-added-to-page', row, pagerow)
+				added.append(row)
+
+		self.db.executemany(
+			'INSERT INTO tagsources(source, tag) VALUES (?, ?)',
+			[(pagerow['id'], row['id']) for row in added]
+		)
+		for row in added:
+			self.emit('tag-added-to-page', row, pagerow)
 
 		for row in list(oldtags.values()):
 			self._remove_tag_from_page(row, pagerow)
@@ -164,6 +168,23 @@ class TagsIndexer(IndexerBase):
 
 		self.db.commit()
 
+	def check_integrity(self):
+		problems = []
+		n, = self.db.execute(
+			'SELECT count(*) FROM tagsources '
+			'WHERE source NOT IN (SELECT id FROM pages) OR tag NOT IN (SELECT id FROM tags)'
+		).fetchone()
+		if n:
+			problems.append(IndexInconsistency('tagsources', '', '%i rows for pages or tags that do not exist' % n))
+		return problems
+
+	def repair_integrity(self):
+		# Tags that are no longer used are dropped by update_iter()
+		self.db.execute(
+			'DELETE FROM tagsources '
+			'WHERE source NOT IN (SELECT id FROM pages) OR tag NOT IN (SELECT id FROM tags)'
+		)
+
 
 class TagsView(IndexView):
 
@@ -366,8 +387,10 @@ class TagsTreeModelBase(PagesTreeModelMixin):
 					break
 
 	def connect_to_updateiter(self, index, update_iter):
+		self._children.clear()
 		self.connectto_all(update_iter.pages,
-			('page-row-inserted', 'page-row-changed', 'page-row-delete', 'page-row-deleted')
+			('page-row-inserted', 'page-row-changed', 'page-row-delete', 'page-row-deleted',
+			'page-row-move', 'page-row-detached', 'page-row-moved')
 		)
 		self.connectto_all(update_iter.tags,
 			('tag-row-inserted', 'tag-row-deleted', 'tag-added-to-page', 'tag-remove-from-page', 'tag-removed-from-page')
@@ -381,6 +404,10 @@ class TagsTreeModelBase(PagesTreeModelMixin):
 		if row['name'] in self.tags:
 			self._update_ids()
 
+	def refresh(self, n_old):
+		self._update_ids() # tag rows may have been inserted
+		PagesTreeModelMixin.refresh(self, n_old)
+
 	def on_tag_removed_from_page(self, o, row, pagerow):
 		self.flush_cache()
 		if self._deleted_tag_path:
@@ -144,6 +144,15 @@ class FilesLayout(NotebookLayout):
 			Path.assertValidPageName(name)
 			return Path(name), type
 
+	def map_folder(self, folder):
+		'''Map a folder to the pagename of the namespace it contains
+		@param folder: a L{Folder} object
+		@returns: a L{Path}
+		'''
+		name = decode_filename(folder.relpath(self.root))
+		Path.assertValidPageName(name)
+		return Path(name)
+
 	def map_filepath(self, path):
 		'''Like L{map_file} but takes a string with relative path'''
 		return self.map_file(self.root.file(path))
@@ -19,7 +19,7 @@ import zim.formats
 
 from zim.fs import adapt_from_oldfs
 from zim.newfs import SEP, Folder, LocalFile, LocalFolder
-from zim.config import INIConfigFile, String, ConfigDefinitionByClass, Boolean, Choice
+from zim.config import INIConfigFile, String, ConfigDefinitionByClass, Boolean, Choice, Integer
 from zim.errors import Error
 from zim.base.naturalsort import natural_sort_key
 from zim.newfs.helpers import TrashNotSupportedError
@@ -61,6 +61,12 @@ class NotebookConfig(INIConfigFile):
 			('default_file_format', String('zim-wiki')),
 			('default_file_extension', String('.txt')),
 			('notebook_layout', String('files')),
+			('parse_cache_size', Integer(0)), # in MB, 0 disables the cache
+		))
+		self['Index'].define((
+			('profile', Choice('auto', {'auto', 'small', 'medium', 'large'})),
+			('cache_size', Integer(None)), # in MB, overrules profile
+			('mmap_size', Integer(None)), # in MB, overrules profile
 		))
 
 
@@ -288,6 +294,22 @@ class Notebook(ConnectorMixin, SignalEmitter):
 
 		self._page_cache = weakref.WeakValueDictionary()
 
+		self.parse_cache = None
+		if self.properties['parse_cache_size'] > 0:
+			from .parsecache import ParseTreeCache
+			if isinstance(cache_dir, LocalFolder):
+				dbpath = cache_dir.file('parsecache.db').path
+			else:
+				dbpath = ':memory:'
+			self.parse_cache = ParseTreeCache(dbpath, self.properties['parse_cache_size'] * 1024 * 1024)
+			self.index.set_parse_cache(self.parse_cache)
+
+		self.index.set_db_profile(
+			config['Index']['profile'],
+			config['Index']['cache_size'],
+			config['Index']['mmap_size'],
+		)
+
 		self.name = None
 		self.icon = None
 		self.document_root = None
@@ -402,7 +424,7 @@ class Notebook(ConnectorMixin, SignalEmitter):
 
 			folder = self.layout.get_attachments_folder(path)
 			format = self.layout.get_format(file)
-			page = Page(path, False, file, folder, format)
+			page = Page(path, False, file, folder, format, self.parse_cache)
 			if self.readonly:
 				page._readonly = True # XXX
 			try:
@@ -631,8 +653,7 @@ class Notebook(ConnectorMixin, SignalEmitter):
 
 		# Process index changes after all fs changes
 		# more robust if anything goes wrong in index update
-		for old, new in changes:
-			self.index.file_moved(old, new)
+		self.index.files_moved(changes)
 
 
 	def _update_links_in_moved_page(self, oldroot, newroot):
@@ -456,7 +456,7 @@ class Page(Path, SignalEmitter):
 		'modified-changed': (SIGNAL_NORMAL, None, ()),
 	}
 
-	def __init__(self, path, haschildren, file, folder, format):
+	def __init__(self, path, haschildren, file, folder, format, parse_cache=None):
 		assert isinstance(path, Path)
 		self.name = path.name
 		self.haschildren = haschildren
@@ -476,6 +476,7 @@ class Page(Path, SignalEmitter):
 			self.format = format
 		self.source_file = file
 		self.attachments_folder = folder
+		self._parse_cache = parse_cache
 
 	@property
 	def readonly(self):
@@ -625,12 +626,16 @@ class Page(Path, SignalEmitter):
 			return self._parsetree
 		else:
 			try:
-				text, self._last_etag = self.source_file.read_with_etag()
+				if self._parse_cache is not None:
+					tree, self._last_etag = \
+						self._parse_cache.get_parsetree(self.source_file, self.format)
+				else:
+					text, self._last_etag = self.source_file.read_with_etag()
+					tree = self.format.Parser().parse(text, file_input=True)
 			except zim.newfs.FileNotFoundError:
 				return None
 			else:
-				parser = self.format.Parser()
-				self._parsetree = parser.parse(text, file_input=True)
+				self._parsetree = tree
 				self._meta = self._parsetree.meta
 				assert self._meta is not None
 				return self._parsetree
@@ -0,0 +1,260 @@
+
+'''This module implements a persistent cache for the parse trees of
+page source files.
+
+Parsing wiki text is the most expensive step when a page is loaded,
+searched or indexed. The L{ParseTreeCache} keeps a serialized version
+of the parse tree in a sqlite database in the notebook cache folder, so
+a file that did not change does not need to be parsed again. The tree
+is stored as a compressed token stream (see L{ParseTree.iter_tokens()})
+which is much faster to load than the wiki source is to parse.
+'''
+
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger('zim.notebook')
+
+import zim
+
+from zim.formats import ParseTree
+from zim.newfs import FileNotFoundError
+
+
+CACHE_VERSION = '1' #: bump when the serialization format changes
+DEFAULT_MAX_SIZE = 50 * 1024 * 1024 #: default size budget in bytes
+
+
+def _dump_tree(tree):
+	tokens = list(tree.iter_tokens())
+	data = json.dumps([list(tree.meta.items()), tokens], separators=(',', ':'))
+	return zlib.compress(data.encode('UTF-8'))
+
+
+def _load_tree(data):
+	meta, tokens = json.loads(zlib.decompress(data).decode('UTF-8'))
+	tree = ParseTree.new_from_tokens(tuple(t) for t in tokens)
+	for k, v in meta:
+		tree.meta[k] = v
+	return tree
+
+
+class ParseTreeCache(object):
+	'''Persistent cache for parse trees of page source files
+
+	Entries are keyed by the file path and the format used for parsing.
+	An entry is valid when the mtime and size of the file did not change,
+	or else when the md5 digest of the content is the same. When the total
+	size of the cached data exceeds C{max_size}, the least recently used
+	entries are dropped.
+
+	Errors in the cache database are logged and otherwise ignored, the
+	file is just parsed again.
+
+	@ivar hits: number of parse trees loaded from the cache
+	@ivar misses: number of files that needed to be parsed
+	'''
+
+	def __init__(self, dbpath, max_size=DEFAULT_MAX_SIZE):
+		'''Constructor
+		@param dbpath: a file path for the sqlite db, or C{":memory:"}
+		@param max_size: size budget for the cached data in bytes
+		'''
+		self.dbpath = dbpath
+		self.max_size = max_size
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+		try:
+			self._db_connect(dbpath)
+		except sqlite3.DatabaseError:
+			logger.exception('Could not open parse tree cache: %s', dbpath)
+			self._db_connect(':memory:')
+
+	def _db_connect(self, dbpath):
+		self.db = sqlite3.connect(dbpath, isolation_level=None, check_same_thread=False)
+			# autocommit - no explicit transactions needed for a cache
+		self.db.row_factory = sqlite3.Row
+		self._db_init()
+
+	def _db_init(self):
+		try:
+			self.db.execute('PRAGMA journal_mode=WAL;')
+			self.db.execute('PRAGMA synchronous=OFF;')
+			version = self.db.execute(
+				'SELECT value FROM cache_info WHERE key = "version"'
+			).fetchone()
+		except sqlite3.DatabaseError:
+			version = None
+
+		if version is None or version[0] != self._version():
+			logger.debug('Initializing parse tree cache: %s', self.dbpath)
+			self.db.executescript('''
+				DROP TABLE IF EXISTS cache_info;
+				DROP TABLE IF EXISTS parsetrees;
+				CREATE TABLE cache_info (
+					key TEXT PRIMARY KEY,
+					value TEXT
+				);
+				CREATE TABLE parsetrees (
+					id INTEGER PRIMARY KEY,
+					path TEXT NOT NULL,
+					format TEXT NOT NULL,
+					mtime TIMESTAMP,
+					size INTEGER,
+					digest BLOB,
+					atime TIMESTAMP,
+					data BLOB,
+					CONSTRAINT uc_PathFormat UNIQUE (path, format)
+				);
+				CREATE INDEX parsetrees_atime ON parsetrees(atime);
+			''')
+			self.db.execute(
+				'INSERT INTO cache_info VALUES ("version", ?)', (self._version(),)
+			)
+
+		self._size = self.db.execute(
+			'SELECT TOTAL(LENGTH(data)) FROM parsetrees'
+		).fetchone()[0]
+
+	@staticmethod
+	def _version():
+		# Parser changes between releases can change the tree
+		return CACHE_VERSION + '-' + zim.__version__
+
+	def get_parsetree(self, file, format):
+		'''Get the parse tree for a page source file. Loads the tree from
+		the cache when possible, else parses the file and stores the
+		result in the cache.
+		@param file: a L{File} object
+		@param format: the format module used to parse the file
+		@returns: a 2-tuple of a L{ParseTree} and the etag for the file
+		content, see L{File.read_with_etag()}
+		@raises FileNotFoundError: if the file does not exist
+		'''
+		result = self.lookup(file, format)
+		if result is None:
+			text, etag = file.read_with_etag()
+			tree = format.Parser().parse(text, file_input=True)
+			self.store(file, format, etag, tree)
+			return tree, etag
+		else:
+			return result
+
+	def lookup(self, file, format):
+		'''Get the parse tree for a page source file from the cache
+		@param file: a L{File} object
+		@param format: the format module used to parse the file
+		@returns: a 2-tuple of a L{ParseTree} and the etag for the file
+		content, or C{None} when there is no valid entry in the cache
+		@raises FileNotFoundError: if the file does not exist
+		'''
+		mtime, size = file.mtime(), file.size()
+		try:
+			with self._lock:
+				row = self.db.execute(
+					'SELECT id, mtime, size, digest, data FROM parsetrees '
+					'WHERE path = ? AND format = ?',
+					(file.path, format.__name__)
+				).fetchone()
+		except sqlite3.DatabaseError:
+			logger.exception('Error reading parse tree cache')
+			row = None
+
+		if row is None:
+			self.misses += 1
+			return None
+
+		if row['mtime'] == mtime and row['size'] == size:
+			etag = (mtime, row['digest'])
+		else:
+			# mtime changed, see if the content changed as well
+			text, etag = file.read_with_etag()
+			if etag[1] != row['digest']:
+				self.misses += 1
+				return None
+
+		try:
+			tree = _load_tree(row['data'])
+		except:
+			logger.exception('Error loading parse tree from cache')
+			self.misses += 1
+			return None
+
+		self.hits += 1
+		try:
+			with self._lock:
+				self.db.execute(
+					'UPDATE parsetrees SET mtime = ?, size = ?, atime = ? WHERE id = ?',
+					(etag[0], size, time.time(), row['id'])
+				)
+		except sqlite3.DatabaseError:
+			logger.exception('Error writing parse tree cache')
+
+		return tree, etag
+
+	def store(self, file, format, etag, tree):
+		'''Store the parse tree for a page source file in the cache
+		@param file: a L{File} object
+		@param format: the format module used to parse the file
+		@param etag: the etag for the file content as returned by
+		L{File.read_with_etag()}
+		@param tree: the L{ParseTree} for the file content
+		'''
+		try:
+			data = _dump_tree(tree)
+		except (TypeError, ValueError):
+			logger.debug('Could not serialize parse tree for: %s', file)
+			return
+
+		try:
+			size = file.size()
+			with self._lock:
+				row = self.db.execute(
+					'SELECT LENGTH(data) FROM parsetrees WHERE path = ? AND format = ?',
+					(file.path, format.__name__)
+				).fetchone()
+				if row is not None:
+					self._size -= row[0]
+				self.db.execute(
+					'INSERT OR REPLACE INTO parsetrees'
+					'(path, format, mtime, size, digest, atime, data) '
+					'VALUES (?, ?, ?, ?, ?, ?, ?)',
+					(file.path, format.__name__, etag[0], size, etag[1], time.time(), data)
+				)
+				self._size += len(data)
+				if self._size > self.max_size:
+					self._evict()
+		except FileNotFoundError:
+			pass
+		except sqlite3.DatabaseError:
+			logger.exception('Error writing parse tree cache')
+
+	def _evict(self):
+		# Drop least recently used entries until we are well below
+		# the size budget, to not evict on every store
+		target = self.max_size * 0.9
+		drop = []
+		for row_id, length in self.db.execute(
+			'SELECT id, LENGTH(data) FROM parsetrees ORDER BY atime'
+		):
+			if self._size <= target:
+				break
+			drop.append((row_id,))
+			self._size -= length
+
+		logger.debug('Parse tree cache full, dropping %i entries', len(drop))
+		self.db.executemany('DELETE FROM parsetrees WHERE id = ?', drop)
+
+	def flush(self):
+		'''Remove all entries from the cache'''
+		with self._lock:
+			self.db.execute('DELETE FROM parsetrees')
+			self._size = 0
+
+	def close(self):
+		self.db.close()
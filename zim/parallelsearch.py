@@ -0,0 +1,177 @@
+
+'''This module contains a helper to scan page content for search terms
+in a pool of worker processes.
+
+Searching for content needs to read and parse each page that is in
+scope, which is bound by a single CPU core. The L{ParallelContentScanner}
+spreads the candidate pages over worker processes that each read, parse
+and match a batch of pages. Only the match counts are sent back, and
+they are yielded in the order of the candidate list, so the
+L{SearchSelection} can merge scores and call its callback exactly as
+for a serial search.
+
+Since the text of pages is stored in the index, only pages that are not
+indexed yet are scanned, so a pool is mainly useful for a search right
+after the index was created. The pool is only used when asked for, see
+L{ParallelContentScanner.new_for_notebook()}.
+'''
+
+import logging
+import multiprocessing
+import collections
+
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger('zim.search')
+
+from zim.newfs import LocalFolder
+
+
+PARALLEL_MIN_PAGES = 500 #: Minimum number of candidate pages before starting a pool
+PAGES_PER_BATCH = 25 #: Number of pages scanned per job
+PREFETCH_PER_JOB = 4 #: Number of batches queued ahead per worker process
+
+
+def _count_content_job(items, regexes):
+	# Runs in a worker process - must be a module level function
+	# Returns for each item a list with the number of matches per regex,
+	# C{()} when the page has no source file or C{None} when the page
+	# should be scanned by the calling process instead
+	from zim.newfs import LocalFile
+	from zim.base.klasslookup import get_module
+
+	results = []
+	for item in items:
+		if item is None:
+			results.append(None)
+			continue
+
+		path, format_module = item
+		try:
+			file = LocalFile(path)
+			if not file.exists():
+				results.append(())
+				continue
+			text = file.read()
+			tree = get_module(format_module).Parser().parse(text, file_input=True)
+			results.append([tree.countre(regex) for regex in regexes])
+		except Exception:
+			# Leave it to the serial code path to log the error
+			results.append(None)
+
+	return results
+
+
+class ParallelContentScanner(object):
+	'''Counts matches of regular expressions in the content of pages in
+	a pool of worker processes.
+
+	Pages that are open in the application (and so may have changes that
+	are not yet saved) and pages that fail in the worker are not scanned
+	in the pool. For these L{scan()} yields C{None} and the caller should
+	get the content from the notebook itself.
+	'''
+
+	def __init__(self, notebook, jobs):
+		'''Constructor
+		@param notebook: a L{Notebook} with a L{LocalFolder} as root
+		@param jobs: number of worker processes
+		'''
+		assert jobs > 1
+		self.notebook = notebook
+		self.jobs = jobs
+		self._pool = None
+
+	@classmethod
+	def new_for_notebook(cls, notebook, n_pages, jobs=None):
+		'''Returns a new L{ParallelContentScanner} object or C{None} when
+		a parallel scan is not supported or not worth it
+		@param notebook: a L{Notebook} object
+		@param n_pages: the number of candidate pages
+		@param jobs: number of worker processes, defaults to the setting
+		of the index, see L{Index.set_jobs()}, which is a serial search
+		unless set otherwise
+		'''
+		jobs = jobs or notebook.index.jobs
+		if jobs > 1 and n_pages >= PARALLEL_MIN_PAGES \
+			and isinstance(notebook.layout.root, LocalFolder):
+				return cls(notebook, jobs)
+		else:
+			return None
+
+	def _start_pool(self):
+		logger.debug('Starting %i processes for searching content', self.jobs)
+		# Use "spawn" to not fork a process that may have gtk threads running
+		context = multiprocessing.get_context('spawn')
+		self._pool = ProcessPoolExecutor(self.jobs, mp_context=context)
+
+	def _get_item(self, path):
+		page = self.notebook._page_cache.get(path.name)
+		if page is not None and (page._textbuffer or page._parsetree):
+			return None # use content in memory
+
+		try:
+			file, folder = self.notebook.layout.map_page(path)
+			if file.exists() and not self.notebook.layout.is_source_file(file):
+				return None
+			format = self.notebook.layout.get_format(file)
+		except Exception:
+			return None
+		else:
+			return (file.path, format.__name__)
+
+	def _batches(self, paths):
+		batch = []
+		for path in paths:
+			batch.append(path)
+			if len(batch) == PAGES_PER_BATCH:
+				yield batch
+				batch = []
+		if batch:
+			yield batch
+
+	def scan(self, paths, regexes):
+		'''Generator that counts matches for each page
+		Stopping the iteration early cancels all pending work.
+		@param paths: an iterable of L{Path} objects
+		@param regexes: a list of compiled regular expressions
+		@returns: yields 2-tuples of a L{Path} and either a list with the
+		number of matches for each regex, C{()} when the page has no
+		content, or C{None} when the caller should scan the page itself
+		'''
+		if self._pool is None:
+			self._start_pool()
+
+		window = self.jobs * PREFETCH_PER_JOB
+		queue = collections.deque() # (batch, future)
+		batches = self._batches(paths)
+		try:
+			while True:
+				for batch in batches:
+					items = [self._get_item(p) for p in batch]
+					queue.append((batch, self._pool.submit(_count_content_job, items, regexes)))
+					if len(queue) >= window:
+						break
+
+				if not queue:
+					break
+
+				batch, future = queue.popleft()
+				try:
+					results = future.result()
+				except Exception:
+					logger.exception('Worker process failed')
+					results = [None] * len(batch)
+
+				for path, counts in zip(batch, results):
+					yield path, counts
+		finally:
+			for batch, future in queue:
+				future.cancel()
+			queue.clear()
+
+	def close(self):
+		'''Stop the worker processes'''
+		if self._pool is not None:
+			self._pool.shutdown(wait=False)
+			self._pool = None
@@ -83,7 +83,7 @@ sqlite.
 		but instead try to replicate what zim internally uses: the number
 		of times the word was found in the page.
 		'''
-		db = searchselection.notebook.index._db
+		db = searchselection.notebook.index._db_readers
 
 		# All keywords passed to this functions are content-related so
 		# we don't need to check the term.keyword property.
@@ -47,13 +47,18 @@ For content '*' can occur on both sides, but does not match whitespace
 
 import re
 import logging
+import weakref
+import collections
 
 from zim.parsing import Re, unescape_string
+from zim.signals import ConnectorMixin
 from zim.notebook import Path, \
 	PageNotFoundError, IndexNotFoundError, \
 	LINK_DIR_BACKWARD, LINK_DIR_FORWARD
+from zim.notebook.index.pages import ROOT_ID, PageIndexRecord
 
 from zim.plugins import PluginManager
+from zim.parallelsearch import ParallelContentScanner
 
 logger = logging.getLogger('zim.search')
 
@@ -284,8 +289,16 @@ class SearchSelection(PageSelection):
 	they match the query.
 	'''
 
-	def __init__(self, notebook):
+	def __init__(self, notebook, jobs=None):
+		'''Constructor
+		@param notebook: a L{Notebook} object
+		@param jobs: number of worker processes used to search page
+		content, defaults to the setting of the index, which is a
+		serial search unless set otherwise. Only pages that are not
+		indexed yet are scanned, see L{zim.parallelsearch}.
+		'''
 		self.notebook = notebook
+		self.jobs = jobs
 		self.cancelled = False
 		self.query = None
 		self.scores = {}
@@ -306,6 +319,9 @@ class SearchSelection(PageSelection):
 		  - C{path} is the C{Path} for the last searched path or C{None}
 
 		If the callback returns C{False} the search is cancelled.
+
+		Results for searches of the whole notebook are cached, see
+		L{SearchCache}.
 		'''
 		# Clear state
 		self.cancelled = False
@@ -313,6 +329,20 @@ class SearchSelection(PageSelection):
 		self.clear()
 		self.scores = {}
 
+		if selection is None and self.notebook is not None:
+			cache = SearchCache.get_for_notebook(self.notebook)
+			if cache.get(query, self):
+				if callback:
+					callback(self, None)
+				return
+		else:
+			cache = None
+
+		self._search(query, selection, callback)
+		if cache is not None and not self.cancelled:
+			cache.store(query, self)
+
+	def _search(self, query, selection=None, callback=None):
 		# Actual search
 		self.update(self._process_group(query.root, selection, callback))
 
@@ -333,20 +363,11 @@ class SearchSelection(PageSelection):
 		if len(group) == 1 and isinstance(group[0], QueryGroup):
 			group = group[0]
 
-		# For optimization we sort the terms in the group based  on how
-		# easy we can get them. Anything that needs content is last.
-		indexterms = []
-		subgroups = []
-		contentterms = []
-		for term in group:
-			if isinstance(term, QueryGroup):
-				subgroups.append(term)
-			else:
-				assert isinstance(term, QueryTerm)
-				if term.keyword in ('content', 'contentorname'):
-					contentterms.append(term)
-				else:
-					indexterms.append(term)
+		# The planner sorts the terms in the group based on how easy we
+		# can get them. Anything that needs content is last. Sub-groups
+		# that can be answered from the index are treated as index terms.
+		planner = QueryPlanner(self)
+		indexterms, subgroups, contentterms = planner.split(group)
 
 		# Decide what operator to use
 		if group.operator == OPERATOR_AND:
@@ -354,11 +375,18 @@ class SearchSelection(PageSelection):
 		else:
 			op_func = self._or_operator
 
-		# First process index terms - no callback in between - this is fast
+		# First process index terms - all at once in SQL, no callback
+		# in between - this is fast
 		results = None
-		for term in indexterms:
-			results, scope = op_func(results, scope,
-				self._process_from_index(term, scope))
+		if indexterms:
+			myresults = SearchSelection(None)
+			for path, score in planner.execute(group.operator, indexterms, scope):
+				myresults.add(path)
+				self._count_score(path, score)
+
+			results, scope = op_func(results, scope, myresults)
+			if group.operator == OPERATOR_AND and not results:
+				return set() # no need to look any further
 
 		if callback:
 			if group.operator == OPERATOR_AND:
@@ -381,6 +409,8 @@ class SearchSelection(PageSelection):
 		for term in subgroups:
 			results, scope = op_func(results, scope,
 				self._process_group(term, scope, callbackwrapper))
+			if group.operator == OPERATOR_AND and not results:
+				return set() # no need to look any further
 
 			if callback:
 				if group.operator == OPERATOR_AND:
@@ -393,18 +423,24 @@ class SearchSelection(PageSelection):
 					return results or set()
 
 		# Optimization of the contentorname items to quickly show results for name
+		# For AND this only gives final results when there are no plain
+		# content terms, else pages must match those as well. In that
+		# case the results so far are only the scope for the content.
+		prefill = group.operator == OPERATOR_OR or \
+			all(term.keyword == 'contentorname' for term in contentterms)
 		for term in contentterms:
 			if scope and id(scope) == id(results):
 				scope = scope.copy()
 			myscope = scope # local copy here, need to pass full scope to _process_content
 			if term.keyword == 'contentorname':
-				results, myscope = op_func(results, myscope,
-					self._process_from_index(term, myscope, scoring=10))
+				myresults = self._process_from_index(term, myscope, scoring=10)
+				if prefill:
+					results, myscope = op_func(results, myscope, myresults)
 
-		if callback and (
-			group.operator == OPERATOR_OR or
-			all(term.keyword == 'contentorname' for term in contentterms)
-		):
+		if not prefill:
+			results = None
+
+		if callback and prefill:
 			cont = callback(results, None)
 			if not cont:
 				self.cancelled = True
@@ -466,27 +502,33 @@ class SearchSelection(PageSelection):
 		myresults = SearchSelection(None)
 		myresults.scores = self.scores # HACK for callback function
 		scoped = False
+		inversed = False
 
 		if term.keyword in ('name', 'namespace', 'section', 'contentorname'):
 			scoped = True # for these keywords we use scope immediatly
-			if scope:
-				generator = iter(scope)
-			else:
-				generator = self.notebook.pages.walk()
-
 			if term.keyword in ('namespace', 'section'):
 				regex = self._namespace_regex(term.string)
+				patterns = self._namespace_patterns(term.string)
 			elif term.keyword == 'contentorname':
 				# More lax matching for default case
-				regex = self._name_regex('*' + term.string.strip('*') + '*')
+				string = '*' + term.string.strip('*') + '*'
+				regex = self._name_regex(string)
+				patterns = self._name_patterns(string)
 				term.name_regex = regex # needed in _process_content
 			else:
 				regex = self._name_regex(term.string)
+				patterns = self._name_patterns(term.string)
 
 			#~ print('!! REGEX: ' + regex.pattern)
-			for path in generator:
-				if regex.match(path.name):
-					myresults.add(path)
+			if scope:
+				for path in scope:
+					if regex.match(path.name):
+						myresults.add(path)
+			else:
+				# Let the index do the work, including the inverse
+				myresults.update(
+					self.notebook.pages.match_names(patterns, regex, term.inverse))
+				inversed = term.inverse
 
 		elif term.keyword in ('linksfrom', 'linksto'):
 			if term.keyword == 'linksfrom':
@@ -538,7 +580,7 @@ class SearchSelection(PageSelection):
 			myresults &= scope # only keep results that in scope
 
 		# Inverse selection
-		if term.inverse:
+		if term.inverse and not inversed:
 			if not scope:
 				# initialize scope with whole notebook :S
 				scope = set()
@@ -571,74 +613,114 @@ class SearchSelection(PageSelection):
 			term.content_regex = self._content_regex(term.string)
 			# term.name_regex already defined in _process_from_index
 
-		def page_generator(paths):
-			for path in paths:
-				try:
-					yield self.notebook.get_page(path)
-				except:
-					logger.exception('Exception opening: %s', path)
-					continue
-
-		if scope:
-			generator = page_generator(scope)
-		else:
-			generator = page_generator(self.notebook.pages.walk())
-
 		if results is None:
 			results = SearchSelection(None)
 
-		for page in generator:
-			#~ print('!! Search content', page)
-			try:
-				tree = page.get_parsetree()
-			except:
-				logger.exception('Exception reading: %s', page)
-				continue
-
-			if tree is None:
-				continue # Assume need to have content even for negative query
-
-			path = Path(page.name)
-			if operator == OPERATOR_AND:
-				score = 0
-				for term in terms:
-					#~ print('!! Count AND %s' % term)
-					myscore = tree.countre(term.content_regex)
-					if term.keyword == 'contentorname' \
-					and term.name_regex.match(path.name):
-						myscore += 1 # effective score going to 11
-
-					if bool(myscore) != term.inverse: # implicit XOR
-						score += myscore or 1
-					else:
-						score = 0
-						break
-
-				if score:
-					results.add(path)
-					self._count_score(path, score)
-			else: # OPERATOR_OR
-				for term in terms:
-					#~ print('!! Count OR %s' % term)
-					score = tree.countre(term.content_regex)
-					if term.keyword == 'contentorname' \
-					and term.name_regex.match(path.name):
-						score += 1 # effective score going to 11
-
-					if bool(score) != term.inverse: # implicit XOR
-						results.add(path)
-						self._count_score(path, score or 1)
+		regexes = [term.content_regex for term in terms]
 
+		def add_result(path, counts):
+			path = Path(path.name)
+			self._score_content(path, counts, terms, operator, results)
 			if callback:
 				# Since we are always last in the processing of the
 				# (top-level) group, we can call the callback with all results
-				cont = callback(results, path)
-				if not cont:
+				if not callback(results, path):
 					self.cancelled = True
+			return not self.cancelled
+
+		# First use the text stored in the index, this avoids reading
+		# and parsing each page. Pages that are not indexed yet and pages
+		# that are loaded in memory (and may have unsaved changes) are
+		# searched using the page content.
+		paths = []
+		for path, text in self.notebook.pages.iter_text(list(scope) if scope else None):
+			if text is None or self._page_in_memory(path):
+				paths.append(path)
+			elif not add_result(path, [len(regex.findall(text)) for regex in regexes]):
+				return results
+
+		# Pages without source file are not listed by the index,
+		# but may have content in memory
+		seen = set(p.name for p in paths)
+		for path in (scope or list(self.notebook._page_cache.values())):
+			if path.name not in seen and self._page_in_memory(path):
+				paths.append(Path(path.name))
+
+		scanner = ParallelContentScanner.new_for_notebook(self.notebook, len(paths), self.jobs)
+		if scanner:
+			generator = scanner.scan(paths, regexes)
+		else:
+			generator = ((path, None) for path in paths)
+
+		try:
+			for path, counts in generator:
+				if counts is None:
+					counts = self._count_content(path, regexes)
+				if not counts:
+					continue # Assume need to have content even for negative query
+
+				if not add_result(path, counts):
 					break
+		finally:
+			if scanner:
+				generator.close()
+				scanner.close()
 
 		return results
 
+	def _page_in_memory(self, path):
+		page = self.notebook._page_cache.get(path.name)
+		return page is not None and bool(page._textbuffer or page._parsetree)
+
+	def _count_content(self, path, regexes):
+		# Returns the number of matches in the page content for each
+		# regex, or None if the page has no content
+		try:
+			page = self.notebook.get_page(path)
+		except:
+			logger.exception('Exception opening: %s', path)
+			return None
+
+		try:
+			tree = page.get_parsetree()
+		except:
+			logger.exception('Exception reading: %s', page)
+			return None
+
+		if tree is None:
+			return None
+		else:
+			return [tree.countre(regex) for regex in regexes]
+
+	def _score_content(self, path, counts, terms, operator, results):
+		if operator == OPERATOR_AND:
+			score = 0
+			for term, myscore in zip(terms, counts):
+				#~ print('!! Count AND %s' % term)
+				if term.keyword == 'contentorname' \
+				and term.name_regex.match(path.name):
+					myscore += 1 # effective score going to 11
+
+				if bool(myscore) != term.inverse: # implicit XOR
+					score += myscore or 1
+				else:
+					score = 0
+					break
+
+			if score:
+				results.add(path)
+				self._count_score(path, score)
+		else: # OPERATOR_OR
+			for term, score in zip(terms, counts):
+				#~ print('!! Count OR %s' % term)
+				if term.keyword == 'contentorname' \
+				and term.name_regex.match(path.name):
+					score += 1 # effective score going to 11
+
+				if bool(score) != term.inverse: # implicit XOR
+					results.add(path)
+					self._count_score(path, score or 1)
+
 	def _name_regex(self, string, case=False):
 		# Build a regex for matching a glob against a page name
 		# Don't use word delimiters here, since page names could be in
@@ -664,6 +746,46 @@ class SearchSelection(PageSelection):
 		else:
 			return re.compile(regex, re.U | re.I)
 
+	def _name_patterns(self, string):
+		# Build SQL "LIKE" patterns matching at least the same page
+		# names as the regex from _name_regex()
+		if string.startswith('*'):
+			prefix = '%'
+			string = string.lstrip('*')
+		else:
+			prefix = ''
+			string = string.lstrip(':')
+
+		if string.endswith('*'):
+			postfix = '%'
+			string = string.rstrip('*')
+		else:
+			postfix = ''
+
+		return [prefix + self._like_escape(string) + postfix]
+
+	def _namespace_patterns(self, string):
+		# like _name_patterns but for _namespace_regex()
+		namespace = self._like_escape(string.strip('*:'))
+		return [namespace, namespace + ':%']
+
+	@staticmethod
+	def _like_escape(string):
+		# Escape a string for a "LIKE" pattern. LIKE is only case
+		# insensitive for ASCII, so other characters - and the ASCII
+		# letters that match non-ASCII characters case-insensitive in
+		# python, like "K" for the Kelvin sign - become wildcards, the
+		# regex on the name gives the exact match.
+		escaped = []
+		for c in string:
+			if c in '%_\\':
+				escaped.append('\\' + c)
+			elif ord(c) > 127 or c in 'iksIKS':
+				escaped.append('_')
+			else:
+				escaped.append(c)
+		return ''.join(escaped)
+
 	def _namespace_regex(self, string, case=False):
 		# like _name_regex but adds recursive descent below the page
 		namespace = re.escape(string.strip('*:'))
@@ -699,3 +821,510 @@ class SearchSelection(PageSelection):
 			return re.compile(regex, re.U)
 		else:
 			return re.compile(regex, re.U | re.I)
+
+
+INDEX_KEYWORDS = ('name', 'namespace', 'section', 'linksfrom', 'linksto', 'tag')
+
+_NO_PAGES_SQL = 'SELECT id FROM pages WHERE 0' # term can not match any page
+
+
+class QueryPlanner(object):
+	'''Plans how the terms of a L{Query} are evaluated
+
+	All terms that can be answered from the index, and sub-groups that
+	consist only of such terms, are compiled into a single SQL statement
+	that combines them with "INTERSECT", "UNION" and "EXCEPT" and that
+	also computes the scores. Terms are ordered by the number of pages
+	they are estimated to match, based on counts from the indexes, so
+	the most selective terms come first. The result of the statement is
+	the scope for terms that need to scan page content. Sub-groups that
+	need content are ordered by the number of content terms they have.
+
+	Use L{explain()} to see the plan for a query when debugging a
+	slow search.
+	'''
+
+	def __init__(self, selection):
+		'''Constructor
+		@param selection: the L{SearchSelection} for the search
+		'''
+		self.selection = selection
+		self.notebook = selection.notebook
+		self.db = selection.notebook.pages.db
+		self._estimates = {}
+		self._n_pages = None
+
+	def is_index_term(self, term):
+		'''Returns C{True} if a L{QueryTerm} or L{QueryGroup} can be
+		answered from the index only
+		'''
+		if isinstance(term, QueryGroup):
+			return len(term) > 0 and all(self.is_index_term(t) for t in term)
+		else:
+			return term.keyword in INDEX_KEYWORDS
+
+	def split(self, group):
+		'''Sort the members of a group by how they are evaluated
+		@param group: a L{QueryGroup}
+		@returns: a 3-tuple of a list of index terms (including
+		sub-groups of only index terms), a list of other sub-groups
+		and a list of content terms
+		'''
+		indexterms = []
+		subgroups = []
+		contentterms = []
+		for term in group:
+			if self.is_index_term(term):
+				indexterms.append(term)
+			elif isinstance(term, QueryGroup):
+				subgroups.append(term)
+			else:
+				assert isinstance(term, QueryTerm)
+				assert term.keyword in ('content', 'contentorname'), 'BUG: unknown keyword: %s' % term.keyword
+				contentterms.append(term)
+
+		subgroups.sort(key=self._n_content_terms)
+		return indexterms, subgroups, contentterms
+
+	def _n_content_terms(self, group):
+		return sum(
+			self._n_content_terms(t) if isinstance(t, QueryGroup)
+				else int(not self.is_index_term(t))
+					for t in group
+		)
+
+	def n_pages(self):
+		if self._n_pages is None:
+			self._n_pages = self.notebook.pages.n_all_pages()
+		return self._n_pages
+
+	def estimate(self, term):
+		'''Estimate the number of pages matching a term or group
+		@param term: a L{QueryTerm} or L{QueryGroup} with only index terms
+		@returns: an integer
+		'''
+		if id(term) not in self._estimates:
+			if isinstance(term, QueryGroup):
+				estimates = [self.estimate(t) for t in term]
+				if term.operator == OPERATOR_AND:
+					n = min(estimates)
+				else:
+					n = min(sum(estimates), self.n_pages())
+			else:
+				sql, params = self._compile_term(term)
+				if sql == _NO_PAGES_SQL:
+					n = 0
+				elif sql.startswith('SELECT id FROM pages') and params[0].startswith('%'):
+					n = self.n_pages() # can't use the index, assume the worst
+				else:
+					n, = self.db.execute('SELECT COUNT(*) FROM (%s)' % sql, params).fetchone()
+				if term.inverse:
+					n = max(self.n_pages() - n, 0)
+			self._estimates[id(term)] = n
+
+		return self._estimates[id(term)]
+
+	def _compile_term(self, term):
+		# Returns SQL selecting the "id" of pages matching the term -
+		# ignoring "inverse" - and the parameters for the statement
+		selection = self.selection
+		if term.keyword in ('name', 'namespace', 'section'):
+			if term.keyword == 'name':
+				regex = selection._name_regex(term.string)
+				patterns = selection._name_patterns(term.string)
+			else:
+				regex = selection._namespace_regex(term.string)
+				patterns = selection._namespace_patterns(term.string)
+
+			pattern = regex.pattern
+			if regex.flags & re.I:
+				pattern = '(?i)' + pattern
+
+			return (
+				'SELECT id FROM pages WHERE id<>%i AND (%s) AND name REGEXP ?' % (
+					ROOT_ID, ' OR '.join(["name LIKE ? ESCAPE '\\'"] * len(patterns))),
+				tuple(patterns) + (pattern,)
+			)
+		elif term.keyword in ('linksfrom', 'linksto'):
+			if term.string.endswith('*'):
+				section = 'SELECT descendant FROM pages_closure WHERE ancestor=(SELECT id FROM pages WHERE name=?)'
+				string = term.string.rstrip('*')
+			else:
+				section = 'SELECT id FROM pages WHERE name=?'
+				string = term.string
+
+			try:
+				path = self.notebook.pages.lookup_from_user_input(string)
+			except ValueError:
+				return _NO_PAGES_SQL, ()
+
+			if term.keyword == 'linksfrom':
+				sql = 'SELECT target AS id FROM links WHERE source IN (%s)' % section
+			else:
+				sql = 'SELECT source AS id FROM links WHERE target IN (%s) AND source<>%i' % (section, ROOT_ID)
+					# Excluding root here because linking from root
+					# is used as a hack to create placeholders
+			return sql, (path.name,)
+		elif term.keyword == 'tag':
+			return (
+				'SELECT tagsources.source AS id FROM tagsources '
+				'JOIN tags ON tagsources.tag = tags.id WHERE tags.name=?',
+				(term.string.strip('*').lstrip('@'),)
+			)
+		else:
+			assert False, 'BUG: not an index term: %s' % term.keyword
+
+	def compile(self, operator, terms):
+		'''Compile index terms into a single SQL statement
+		@param operator: the operator to combine the terms, either
+		C{OPERATOR_AND} or C{OPERATOR_OR}
+		@param terms: a list of L{QueryTerm} and L{QueryGroup} objects
+		that can be answered from the index
+		@returns: a 2-tuple of the SQL statement and the parameters.
+		The statement selects the columns of the "pages" table for
+		the matching pages and a "score" column.
+		'''
+		ctes = []
+		params = []
+		scores = []
+		name = self._compile_group(operator, terms, ctes, params, scores)
+		sql = 'WITH %s SELECT pages.*, %s AS score FROM %s JOIN pages ON pages.id = %s.id' % (
+			', '.join(ctes), ' + '.join(scores), name, name)
+		return sql, tuple(params)
+
+	def _compile_group(self, operator, terms, ctes, params, scores):
+		# Adds a common table expression for each term and one to combine
+		# them, returns the name of the last one. Terms can list the same
+		# page more than once (e.g. multiple links), so a single term needs
+		# DISTINCT where compound selects de-duplicate anyway. Each term adds 1 to the
+		# score of the pages it matches, like in _process_from_index()
+		positive = []
+		negative = []
+		for term in sorted(terms, key=self.estimate):
+			if isinstance(term, QueryGroup):
+				positive.append(self._compile_group(term.operator, term, ctes, params, scores))
+			else:
+				sql, myparams = self._compile_term(term)
+				name = 't%i' % len(ctes)
+				ctes.append('%s(id) AS (%s)' % (name, sql))
+				params.extend(myparams)
+				if term.inverse:
+					negative.append(name)
+					scores.append('(pages.id NOT IN %s)' % name)
+				else:
+					positive.append(name)
+					scores.append('(pages.id IN %s)' % name)
+
+		all_pages = 'SELECT id FROM pages WHERE id<>%i' % ROOT_ID
+		if operator == OPERATOR_AND:
+			sql = ' INTERSECT '.join('SELECT DISTINCT id FROM %s' % n for n in positive) or all_pages
+			sql += ''.join(' EXCEPT SELECT id FROM %s' % n for n in negative)
+		else:
+			sql = ' UNION '.join(
+				['SELECT DISTINCT id FROM %s' % n for n in positive] +
+				[all_pages + ' AND id NOT IN %s' % n for n in negative]
+			)
+
+		name = 'g%i' % len(ctes)
+		ctes.append('%s(id) AS (%s)' % (name, sql))
+		return name
+
+	def execute(self, operator, terms, scope=None):
+		'''Get the pages matching index terms
+		@param operator: the operator to combine the terms
+		@param terms: a list of L{QueryTerm} and L{QueryGroup} objects
+		that can be answered from the index
+		@param scope: optional set of L{Path} objects to limit the results
+		@returns: yields 2-tuples of a L{PageIndexRecord} and the score
+		'''
+		sql, params = self.compile(operator, terms)
+		for row in self.db.execute(sql, params):
+			path = PageIndexRecord(row)
+			if not scope or path in scope:
+				yield path, row['score']
+
+	def explain(self, query):
+		'''Describe how a query is evaluated
+		@param query: a L{Query} object
+		@returns: a string with the plan for each group, including the
+		SQL statement and the query plan from sqlite
+		'''
+		lines = []
+		self._explain_group(query.root, '', lines)
+		return '\n'.join(lines) + '\n'
+
+	def _explain_group(self, group, indent, lines):
+		if len(group) == 1 and isinstance(group[0], QueryGroup):
+			group = group[0] # like _process_group()
+
+		indexterms, subgroups, contentterms = self.split(group)
+		operator = 'AND' if group.operator == OPERATOR_AND else 'OR'
+		lines.append(indent + '%s group' % operator)
+		if indexterms:
+			lines.append(indent + '  Index terms:')
+			for term in sorted(indexterms, key=self.estimate):
+				lines.append(indent + '    %s - estimated %i pages' % (self._describe(term), self.estimate(term)))
+			sql, params = self.compile(group.operator, indexterms)
+			lines.append(indent + '  SQL: %s' % sql)
+			lines.append(indent + '  Parameters: %r' % (params,))
+			for row in self.db.execute('EXPLAIN QUERY PLAN ' + sql, params):
+				lines.append(indent + '    ' + row[-1])
+
+		for subgroup in subgroups:
+			self._explain_group(subgroup, indent + '  ', lines)
+
+		if contentterms:
+			if group.operator == OPERATOR_AND and (indexterms or subgroups):
+				scope = 'the pages matching the terms above'
+			else:
+				scope = 'all %i pages' % self.n_pages()
+			lines.append(indent + '  Content scan of %s for: %s' % (
+				scope, ', '.join(self._describe(t) for t in contentterms)))
+
+	def _describe(self, term):
+		if isinstance(term, QueryGroup):
+			operator = ' AND ' if term.operator == OPERATOR_AND else ' OR '
+			return '(' + operator.join(self._describe(t) for t in term) + ')'
+		else:
+			return '%s%s: "%s"' % ('NOT ' if term.inverse else '', term.keyword, term.string)
+
+
+SEARCH_CACHE_SIZE = 20 #: Maximum number of queries kept in the L{SearchCache}
+SEARCH_CACHE_MAX_PATHS = 100000 #: Maximum number of result pages kept in the L{SearchCache}
+SEARCH_CACHE_MAX_CHANGES = 100 #: Maximum number of changed pages to search again instead of dropping results
+
+LOCAL_KEYWORDS = ('name', 'namespace', 'section', 'tag', 'content', 'contentorname')
+	# Keywords that only depend on the page itself, for other keywords
+	# a change in one page can change the results for other pages
+
+
+def _query_key(group):
+	# Normalized key for a query tree, the order of terms in a group
+	# does not change the results or the scores
+	items = []
+	for item in group:
+		if isinstance(item, QueryGroup):
+			items.append(_query_key(item))
+		else:
+			items.append((item.keyword, item.string, item.inverse))
+	return (group.operator, tuple(sorted(items, key=repr)))
+
+
+def _query_is_local(group):
+	return all(
+		_query_is_local(item) if isinstance(item, QueryGroup)
+			else item.keyword in LOCAL_KEYWORDS
+				for item in group
+	)
+
+
+class _SearchCacheEntry(object):
+
+	__slots__ = ('results', 'scores', 'generation', 'local', 'changed', 'modified')
+
+	def __init__(self, selection, generation, local, modified):
+		self.results = set(selection)
+		self.scores = dict(selection.scores)
+		self.generation = generation
+		self.local = local
+		self.changed = set() # names of pages changed in the index since stored
+		self.modified = modified # names of pages with unsaved changes
+
+
+class SearchCache(ConnectorMixin):
+	'''Cache for the results of L{SearchSelection.search()}
+
+	Results are keyed by the normalized query and are valid for the
+	generation of the index they were computed for. When the index
+	changes, results for queries that only use keywords that depend on
+	the page itself (like names, tags and content) are kept and only
+	the changed pages are searched again when the query is repeated.
+	Other results are dropped. Commits that did not change any rows,
+	like opening a page or a check that found no changes, keep all
+	results. When the index was updated by another process, all results
+	are dropped. Pages with unsaved changes are searched again on each
+	lookup.
+
+	The least recently used results are dropped when the cache holds
+	more than L{SEARCH_CACHE_SIZE} queries or more than
+	L{SEARCH_CACHE_MAX_PATHS} result pages in total.
+
+	@ivar hits: number of searches answered from the cache
+	@ivar misses: number of searches that were not in the cache
+	'''
+
+	_caches = weakref.WeakKeyDictionary() # notebook -> SearchCache
+
+	@classmethod
+	def get_for_notebook(cls, notebook):
+		'''Get the cache for a notebook, creates one if needed
+		@param notebook: a L{Notebook} object
+		@returns: a L{SearchCache} object
+		'''
+		try:
+			return cls._caches[notebook]
+		except KeyError:
+			cache = cls(notebook)
+			cls._caches[notebook] = cache
+			return cache
+
+	def __init__(self, notebook):
+		'''Constructor
+		@param notebook: a L{Notebook} object
+		'''
+		self.notebook = weakref.proxy(notebook) # cache is kept per notebook
+		self.index = notebook.index
+		self.hits = 0
+		self.misses = 0
+		self._entries = collections.OrderedDict() # key -> _SearchCacheEntry
+		self._n_paths = 0
+		self._connect_to_updateiter(self.index, self.index.update_iter)
+		self._changed = set() # page names, or None if all results are affected
+		self._rows_changed = False # any row signals since last commit
+		self._generation = self.index.get_generation() # last generation seen
+		self.connectto(self.index, 'new-update-iter', self._connect_to_updateiter)
+		self.connectto(self.index, 'changed', self.on_index_changed)
+
+	def _connect_to_updateiter(self, index, update_iter):
+		self._changed = None # new update iter, changes may be missing
+		self.connectto(update_iter, 'start-bulk-update', self.on_start_bulk_update)
+		self.connectto_all(update_iter.files, (
+			'file-row-inserted', 'file-row-deleted'
+		), handler=self.on_file_row)
+		self.connectto_all(update_iter.pages, (
+			'page-row-inserted', 'page-row-changed', 'page-row-deleted', 'page-changed'
+		), handler=self.on_page_row)
+		self.connectto(update_iter.pages, 'page-row-moved', self.on_page_row_moved)
+
+	def on_start_bulk_update(self, update_iter):
+		self._changed = None
+
+	def on_file_row(self, filesindexer, row):
+		self._rows_changed = True # e.g. attachment, does not affect results
+
+	def on_page_row(self, pagesindexer, row, *a):
+		self._rows_changed = True
+		if self._changed is not None:
+			self._changed.add(row['name'])
+
+	def on_page_row_moved(self, pagesindexer, row, oldrow):
+		self._rows_changed = True
+		self._changed = None # children are renamed as well
+
+	def on_index_changed(self, index):
+		changed, self._changed = self._changed, set()
+		rows_changed, self._rows_changed = self._rows_changed, False
+		generation, last = index.get_generation(), self._generation
+		self._generation = generation
+		if generation == last:
+			return # commit without changes, e.g. opening a page
+
+		if not rows_changed or generation != last + 1 \
+			or changed is None or len(changed) > SEARCH_CACHE_MAX_CHANGES:
+				# Changed by another process, or too many changes
+				# to keep track of, we don't know what changed
+				self.clear()
+				return
+
+		for key, entry in list(self._entries.items()):
+			if not changed:
+				entry.generation = generation
+			elif entry.local and len(entry.changed | changed) <= SEARCH_CACHE_MAX_CHANGES:
+				entry.changed |= changed
+				entry.generation = generation
+			else:
+				self._drop(key)
+
+	def clear(self):
+		'''Drop all cached results'''
+		self._entries.clear()
+		self._n_paths = 0
+
+	def _drop(self, key):
+		entry = self._entries.pop(key)
+		self._n_paths -= len(entry.results)
+
+	@staticmethod
+	def _key(query):
+		# The indexed_fts plugin gives different scores
+		return (_query_key(query.root), "indexed_fts" in PluginManager)
+
+	def _modified_pages(self):
+		return set(
+			page.name for page in list(self.notebook._page_cache.values())
+				if page.modified
+		)
+
+	def get(self, query, selection):
+		'''Fill a selection with cached results for a query
+		@param query: a L{Query} object
+		@param selection: an empty L{SearchSelection} object
+		@returns: C{True} if the results were in the cache, C{False}
+		otherwise
+		'''
+		key = self._key(query)
+		entry = self._entries.get(key)
+		if entry is not None and entry.generation != self.index.get_generation():
+			self._drop(key) # updated without signals
+			entry = None
+
+		if entry is None:
+			self.misses += 1
+			logger.debug('Search cache miss for: %s (hits: %i, misses: %i)', query.string, self.hits, self.misses)
+			return False
+
+		self.hits += 1
+		logger.debug('Search cache hit for: %s (hits: %i, misses: %i)', query.string, self.hits, self.misses)
+		self._entries.move_to_end(key)
+		modified = self._modified_pages()
+		changed = entry.changed | entry.modified | modified
+		if changed:
+			self._refresh(entry, query, changed, selection.jobs)
+			self._n_paths = sum(len(e.results) for e in self._entries.values())
+			entry.changed = set()
+			entry.modified = modified
+
+		selection.update(entry.results)
+		selection.scores = dict(entry.scores)
+		return True
+
+	def _refresh(self, entry, query, names, jobs):
+		# Search again for changed pages only and merge the results
+		scope = set()
+		for name in names:
+			path = Path(name)
+			entry.results.discard(path)
+			entry.scores.pop(path, None)
+			try:
+				scope.add(self.notebook.pages.lookup_by_pagename(path))
+			except IndexNotFoundError:
+				pass # page was deleted
+
+		if scope: # empty scope would search the whole notebook
+			selection = SearchSelection(self.notebook, jobs=jobs)
+			selection._search(query, scope)
+			entry.results.update(selection)
+			entry.scores.update(selection.scores)
+
+	def store(self, query, selection):
+		'''Store the results of a search
+		@param query: a L{Query} object
+		@param selection: the L{SearchSelection} with results for C{query}
+		'''
+		if len(selection) > SEARCH_CACHE_MAX_PATHS:
+			return
+
+		key = self._key(query)
+		if key in self._entries:
+			self._drop(key)
+
+		self._entries[key] = _SearchCacheEntry(
+			selection,
+			self.index.get_generation(),
+			_query_is_local(query.root),
+			self._modified_pages()
+		)
+		self._n_paths += len(selection)
+		while len(self._entries) > SEARCH_CACHE_SIZE \
+			or self._n_paths > SEARCH_CACHE_MAX_PATHS:
+				self._drop(next(iter(self._entries)))